@@ -0,0 +1,124 @@
+# backend/anomaly.py
+# 異常值標記：導入時為每行算出 anomaly_flags 位元組合（每個檢測器一位），查詢按位過濾，不再逐行求值長條件。
+# 檢測器都是 DuckDB 表達式，隨導入的 SELECT 按向量批次執行；其中滾動中位數偏離用同一 token 前
+# ANOMALY_MEDIAN_WINDOW 筆成交的視窗中位數（分區資料集按批計算，視窗不跨批）。
+#
+# 帶旗標的行另外寫一份旁路檔（單檔資料集為 <parquet>.anomalies；分區資料集每批一個
+# <dataset>/_anomalies/<batch>.anomalies），欄位與資料集相同、只有異常行，異常視圖直接讀它而不掃全量。
+# 副檔名不是 .parquet，不會被資料集的 glob 讀到；是否與資料一致的判斷同 cube（見 engine.py）。
+
+import json
+import os
+
+import dataset
+from config import (
+    ANOMALY_DEVIATION_FACTOR,
+    ANOMALY_MEDIAN_MIN_TRADES,
+    ANOMALY_MEDIAN_WINDOW,
+    ANOMALY_SENTINEL,
+)
+
+ANOMALY_SUFFIX = ".anomalies"
+COLUMN = "anomaly_flags"
+
+# 旗標名: (位, 說明)；位一經導入寫進資料就不能改，新增檢測器只能用新的位
+FLAGS = {
+    "zero_price": (1, "成交价（买单买价/卖单卖价）为 0"),
+    "null_price": (2, "成交价为 NULL"),
+    "nan_price": (4, "成交价为 NaN"),
+    "sentinel_price": (8, f"成交价为 inf 或不小于 {ANOMALY_SENTINEL:g} 的哨兵值"),
+    "amount_without_price": (16, "buy_amount > 0 但买价为 NULL/0/NaN"),
+    "median_deviation": (32, f"成交价偏离同 token 前 {ANOMALY_MEDIAN_WINDOW} 笔的中位数超过 {ANOMALY_DEVIATION_FACTOR:g} 倍"),
+}
+
+# abnormal_only 的舊語意（schema.ABNORMAL_CONDITION）：成交價為 NULL、0 或 NaN
+ABNORMAL_MASK = FLAGS["zero_price"][0] | FLAGS["null_price"][0] | FLAGS["nan_price"][0]
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def parse_flags(names):
+    """逗號分隔的旗標名 → 位元組合；未知名稱拋出 ValueError。"""
+    mask = 0
+    for name in (x.strip() for x in (names or "").split(",")):
+        if not name:
+            continue
+        if name not in FLAGS:
+            raise ValueError(f"未知的 anomaly_flags: {name}（可选 {', '.join(FLAGS)}）")
+        mask |= FLAGS[name][0]
+    return mask
+
+
+def condition(mask):
+    """帶有 mask 中任一旗標的行。"""
+    return f"({COLUMN} & {int(mask)}) <> 0"
+
+
+def trade_price(buy_col="buy_price", sell_col="sell_price"):
+    """成交價：买单看买价、卖单看卖价，其他类型为 NULL（与 ABNORMAL_CONDITION 相同的取法）。"""
+    return f"CASE type WHEN 'buy_token' THEN {buy_col} WHEN 'sell_token' THEN {sell_col} END"
+
+
+def flags_expr(token_col="token_mint_address", order_cols=("trade_timestamp", "transaction_slot", "transaction_signature")):
+    """
+    導入時的 anomaly_flags 表達式（原始欄位，價格以 SOL 計價）。
+    中位數只取正常價格（正、有限、非哨兵），視窗內有效成交不足 ANOMALY_MEDIAN_MIN_TRADES 筆時不判斷。
+    """
+    price = trade_price()
+    is_trade = "type IN ('buy_token', 'sell_token')"
+    valid = f"({price} > 0 AND {price} < {ANOMALY_SENTINEL:.17e})"
+    window = (
+        f"OVER (PARTITION BY {token_col} ORDER BY {', '.join(order_cols)} "
+        f"ROWS BETWEEN {int(ANOMALY_MEDIAN_WINDOW)} PRECEDING AND 1 PRECEDING)"
+    )
+    median = f"median({price}) FILTER (WHERE {valid}) {window}"
+    count = f"count({price}) FILTER (WHERE {valid}) {window}"
+    factor = float(ANOMALY_DEVIATION_FACTOR)
+    detectors = {
+        "zero_price": f"{price} = 0",
+        "null_price": f"{is_trade} AND {price} IS NULL",
+        "nan_price": f"isnan({price})",
+        "sentinel_price": f"NOT isnan({price}) AND (isinf({price}) OR {price} >= {ANOMALY_SENTINEL:.17e})",
+        "amount_without_price": "buy_amount > 0 AND (buy_price IS NULL OR buy_price = 0 OR isnan(buy_price))",
+        "median_deviation": (
+            f"{valid} AND {count} >= {int(ANOMALY_MEDIAN_MIN_TRADES)} "
+            f"AND ({price} > {factor!r} * {median} OR {price} * {factor!r} < {median})"
+        ),
+    }
+    bits = " | ".join(f"CASE WHEN {expr} THEN {FLAGS[name][0]} ELSE 0 END" for name, expr in detectors.items())
+    return f"CAST({bits} AS USMALLINT)"
+
+
+def anomaly_path(path):
+    if dataset.is_dataset_dir(path):
+        return os.path.join(path, "_anomalies")
+    return path + ANOMALY_SUFFIX
+
+
+def anomaly_files(path):
+    target = anomaly_path(path)
+    if os.path.isdir(target):
+        return sorted(os.path.join(target, f) for f in os.listdir(target) if f.endswith(ANOMALY_SUFFIX))
+    return [target] if os.path.isfile(target) else []
+
+
+def source_sql(files):
+    """旁路檔的 read_parquet 表達式；分區欄位在旁路檔裡是普通欄位，不按 hive 分區讀。"""
+    return "read_parquet([" + ", ".join(sql_string(f) for f in files) + "])"
+
+
+def build(con, source, target, order_by, meta):
+    """
+    把 source（已寫好的資料檔）中帶旗標的行按 order_by 排序寫到 target；meta 寫進 key-value metadata，
+    用來判斷旁路檔是否與資料一致。先寫臨時檔再替換。返回行數。
+    """
+    kv = ", ".join(f"{k}: {sql_string(json.dumps(v))}" for k, v in meta.items())
+    tmp = target + ".tmp"
+    rows = con.execute(f"""
+        COPY (SELECT * FROM {source} WHERE {COLUMN} <> 0 ORDER BY {', '.join(order_by)})
+        TO {sql_string(tmp)} (FORMAT parquet, COMPRESSION zstd, KV_METADATA {{{kv}}})
+    """).fetchone()[0]
+    os.replace(tmp, target)
+    return rows
@@ -0,0 +1,3 @@
+# backend/bench
+# 性能基準：generate.py 生成 SlotTest 格式的合成資料，harness.py 對各查詢端點壓測並與保存的基準比較。
+# 在 backend 目錄下以模組方式執行：python -m bench.generate ... / python -m bench.harness ...
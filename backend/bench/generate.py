@@ -0,0 +1,177 @@
+# backend/bench/generate.py
+# 合成 SlotTest 資料：68 欄、無表頭 CSV，格式與 SlotTest.csv 相同，可直接交給 ingest.py 導入。
+# 全部在 DuckDB 內以行號 + seed 的整數雜湊生成，同樣參數得到逐位元組相同的檔案（與 DuckDB 版本、線程數無關）。
+# 分佈：token 與錢包按冪律偏斜（少數熱門 token 佔大部分成交），每個 token 有自己的價格量級，
+# USD 價格大致覆蓋 PRICE_BINS 的六個區間；另按比例混入 0 / NULL / NaN / 1e20 價格等異常值。
+#
+# 用法（在 backend 目錄下）：
+#   python -m bench.generate 1M -o ../bench_1m.csv
+#   python -m bench.generate 10M -o ../bench_10m.csv --ingest ../bench_10m.parquet
+#   python -m bench.generate 100M -o ../bench_100m.csv --seed 7
+
+import argparse
+import logging
+import time
+
+import duckdb
+
+from config import DEFAULT_SOL_PRICE, DUCKDB_THREADS
+from ingest import sql_string
+from schema import RAW_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# 2024-04-18 00:00:00 UTC（毫秒）
+START_MS = 1713398400000
+# 每個 slot 約 400ms
+SLOT_MS = 400
+FIRST_SLOT = 262000000
+PUMP_PROGRAM = "6EF8rrecthR5Dkzon8Nwu78hRvfCKubJ14M5uBEwF6P"
+
+# 異常值比例（按 type 作用在買價或賣價上，與 schema.ABNORMAL_CONDITION 對應）
+ANOMALY_RATES = {
+    "zero": 0.008,
+    "null": 0.005,
+    "nan": 0.003,
+    "sentinel": 0.001,  # 1e20，上游用作「無價格」的哨兵值
+}
+
+SIZES = {"1M": 1_000_000, "10M": 10_000_000, "100M": 100_000_000}
+
+
+def parse_rows(value):
+    """1M / 10M / 100M 或整數。"""
+    value = str(value).strip().upper()
+    if value in SIZES:
+        return SIZES[value]
+    if value.endswith("K"):
+        return int(float(value[:-1]) * 1_000)
+    if value.endswith("M"):
+        return int(float(value[:-1]) * 1_000_000)
+    return int(value)
+
+
+def define_macros(con, seed):
+    # mix: 乘法 + xorshift，輸入先取模保證乘積不超過 BIGINT；rnd(i, k) 為第 k 個獨立的 [0,1) 均勻數
+    con.execute("CREATE MACRO mix(x) AS (xor(x % 4294967291, (x % 4294967291) >> 16) * 1597334677) % 4294967291")
+    con.execute(f"CREATE MACRO rnd(i, k) AS mix(mix(mix(i * 8191 + k * 131071 + {int(seed)}))) / 4294967291.0")
+
+
+def column_exprs(rows, days, sol_price):
+    """RAW_COLUMNS 中各欄的生成表達式（基於 base CTE 的欄位）；沒列出的欄位為 NULL。"""
+    span_ms = int(days * 86400000)
+    # 每個 token 的 log10(SOL 價格) 量級：USD 價格 log10 在 [-2, 6) 均勻，覆蓋六個 USD 區間
+    log_sol = f"(-2 + 8 * rnd(tok, 101) - log10({sol_price}))"
+    # 單筆成交相對量級的抖動（三角分佈，±0.5 個數量級）
+    price = f"pow(10, {log_sol} + (u_noise1 + u_noise2 - 1) * 0.5)"
+    anomaly = (
+        f"CASE WHEN u_anom < {ANOMALY_RATES['zero']} THEN 0 "
+        f"WHEN u_anom < {ANOMALY_RATES['zero'] + ANOMALY_RATES['null']} THEN NULL "
+        f"WHEN u_anom < {ANOMALY_RATES['zero'] + ANOMALY_RATES['null'] + ANOMALY_RATES['nan']} THEN 'NaN'::DOUBLE "
+        f"WHEN u_anom < {sum(ANOMALY_RATES.values())} THEN 1e20 "
+        f"ELSE {price} END"
+    )
+    buy_price = f"CASE WHEN is_buy THEN {anomaly} ELSE {price} * 1.002 END"
+    sell_price = f"CASE WHEN is_buy THEN {price} * 0.998 ELSE {anomaly} END"
+    token = "substr(md5('token:' || tok), 1, 40) || 'pump'"
+    wallet = "substr(md5('wallet:' || wal), 1, 32) || substr(md5('w2:' || wal), 1, 12)"
+    sol_amount = "pow(10, -2 + 3 * u_amt)"
+    token_amount = f"{sol_amount} / greatest({price}, 1e-12)"
+    ts = f"{START_MS} + (i * {span_ms}) // {rows} + CAST(floor(u_time * 997) AS BIGINT)"
+    return {
+        "type": "CASE WHEN is_buy THEN 'buy_token' ELSE 'sell_token' END",
+        "trade_timestamp": ts,
+        "transaction_slot": f"{FIRST_SLOT} + ({ts} - {START_MS}) // {SLOT_MS}",
+        "trader_wallet_address": wallet,
+        "token_mint_address": token,
+        "signers": wallet,
+        "signer_balance_changes": f"'[' || round(CASE WHEN is_buy THEN -1 ELSE 1 END * {sol_amount}, 9) || ']'",
+        "buy_direction": "'in'",
+        "buy_currency": f"CASE WHEN is_buy THEN {token} ELSE 'SOL' END",
+        "buy_amount": f"CASE WHEN is_buy THEN {token_amount} ELSE {sol_amount} END",
+        "buy_price": buy_price,
+        "buy_sol_amount": sol_amount,
+        "sell_direction": "'out'",
+        "sell_currency": f"CASE WHEN is_buy THEN 'SOL' ELSE {token} END",
+        "sell_amount": f"CASE WHEN is_buy THEN {sol_amount} ELSE {token_amount} END",
+        "sell_price": sell_price,
+        "sell_sol_amount": sol_amount,
+        "pool_state_real_token_reserves_pre_reserves": "1e15 * (1 - rnd(tok, 102) * 0.8)",
+        "pool_state_real_token_reserves_post_reserves": f"1e15 * (1 - rnd(tok, 102) * 0.8) - CASE WHEN is_buy THEN {token_amount} ELSE -{token_amount} END",
+        "pool_state_real_token_reserves_change": f"CASE WHEN is_buy THEN -{token_amount} ELSE {token_amount} END",
+        "pool_state_completion_rate": "round(rnd(tok, 103) * 100, 4)",
+        "net_sol_balance_change": f"CASE WHEN is_buy THEN -{sol_amount} ELSE {sol_amount} END - 0.000005",
+        "transaction_fee": "0.000005",
+        "transaction_signature": "md5('sig:' || i) || substr(md5('sig2:' || i), 1, 24)",
+        "source_name": "'pump_fun'",
+        "source_program": sql_string(PUMP_PROGRAM),
+        "version": "'0'",
+    }
+
+
+def generate_sql(rows, seed=0, tokens=None, wallets=None, days=7, token_skew=3.0, wallet_skew=2.0,
+                 buy_ratio=0.55, sol_price=DEFAULT_SOL_PRICE):
+    """返回生成 rows 行的 SELECT（欄位與順序同 RAW_COLUMNS）。"""
+    tokens = tokens or max(50, min(200000, rows // 2000))
+    wallets = wallets or max(100, rows // 20)
+    exprs = column_exprs(rows, days, sol_price)
+    select = ", ".join(
+        f"CAST({exprs[name]} AS {dtype}) AS {name}" if name in exprs else f"CAST(NULL AS {dtype}) AS {name}"
+        for name, dtype in RAW_COLUMNS
+    )
+    # salt 讓不同 seed 的行號雜湊互不相關
+    return f"""
+        WITH base AS (
+            SELECT
+                i,
+                CAST(floor({tokens} * pow(rnd(i, 1), {token_skew})) AS BIGINT) + {int(seed)} * 1000003 AS tok,
+                CAST(floor({wallets} * pow(rnd(i, 2), {wallet_skew})) AS BIGINT) + {int(seed)} * 1000003 AS wal,
+                rnd(i, 3) < {buy_ratio} AS is_buy,
+                rnd(i, 4) AS u_anom,
+                rnd(i, 5) AS u_noise1,
+                rnd(i, 6) AS u_noise2,
+                rnd(i, 7) AS u_amt,
+                rnd(i, 8) AS u_time
+            FROM range({int(rows)}) t(i)
+        )
+        SELECT {select} FROM base
+    """
+
+
+def generate_csv(csv_path, rows, seed=0, threads=DUCKDB_THREADS, **kwargs):
+    """寫出無表頭 CSV，返回行數。保持插入順序，輸出檔與線程數無關。"""
+    start = time.time()
+    con = duckdb.connect(database=":memory:", config={"threads": int(threads)} if threads else {})
+    try:
+        define_macros(con, seed)
+        sql = generate_sql(rows, seed=seed, **kwargs)
+        logger.info(f"[generate] {rows} rows (seed={seed}) -> {csv_path}")
+        written = con.execute(f"COPY ({sql}) TO {sql_string(csv_path)} (FORMAT csv, HEADER false)").fetchone()[0]
+    finally:
+        con.close()
+    logger.info(f"[generate] wrote {written} rows in {time.time() - start:.1f}s")
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成 SlotTest 格式的合成資料（無表頭 CSV，可選直接導入成 parquet）")
+    parser.add_argument("rows", help="行數：1M / 10M / 100M 或整數（可帶 K/M 後綴）")
+    parser.add_argument("-o", "--output", required=True, help="輸出 CSV 路徑")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tokens", type=int, default=None, help="不同 token 數（預設 rows/2000，介於 50-200000）")
+    parser.add_argument("--wallets", type=int, default=None, help="不同錢包數（預設 rows/20）")
+    parser.add_argument("--days", type=float, default=7, help="成交時間跨度（天），從 2024-04-18 UTC 起")
+    parser.add_argument("--token-skew", type=float, default=3.0, help="token 偏斜指數，越大越集中在熱門 token")
+    parser.add_argument("--ingest", metavar="PARQUET", default=None, help="生成後用 ingest.py 導入到此 parquet")
+    args = parser.parse_args(argv)
+    rows = parse_rows(args.rows)
+    generate_csv(args.output, rows, seed=args.seed, tokens=args.tokens, wallets=args.wallets,
+                 days=args.days, token_skew=args.token_skew)
+    if args.ingest:
+        import ingest
+        ingest.ingest_csv(args.output, args.ingest)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    main()
@@ -0,0 +1,339 @@
+# backend/bench/harness.py
+# 查詢端點壓測：先逐個請求（測單請求延遲），再按並發數混合發送（測吞吐），
+# 報告各端點的 p50/p95/p99 延遲、吞吐與峰值 RSS，並可保存為基準、與基準比較（退化時退出碼 1）。
+# 預設在進程內直接驅動 FastAPI app（不經網路），也可用 --url 壓測已啟動的服務。
+# 請求參數由 --seed 決定，同一份資料、同一個 seed 每次發出的請求序列相同。
+#
+# 用法（在 backend 目錄下）：
+#   python -m bench.harness --data ../bench_1m.parquet --save-baseline ../bench_1m.json
+#   python -m bench.harness --data ../bench_1m.parquet --baseline ../bench_1m.json
+#   python -m bench.harness --data ../bench_1m.parquet --cache off --concurrency 16
+#   python -m bench.harness --url http://127.0.0.1:8000 --server-pid 12345
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import resource
+import sys
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ["filter_data", "batch_bins_data", "random_sample", "price_ranges", "top_tokens", "histogram"]
+PERCENTILES = (50, 95, 99)
+# 並發輪每個請求都記錄端點延遲，另外以 _all 彙總
+ALL = "_all"
+
+
+def percentile(sorted_values, p):
+    """nearest-rank 百分位。"""
+    if not sorted_values:
+        return None
+    k = math.ceil(p / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def summarize(latencies, errors, elapsed):
+    """latencies 為秒；返回毫秒統計與每秒請求數。"""
+    values = sorted(latencies)
+    result = {"count": len(values), "errors": errors}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        result[f"p{p}_ms"] = None if value is None else round(value * 1000, 2)
+    result["mean_ms"] = round(sum(values) / len(values) * 1000, 2) if values else None
+    result["throughput"] = round(len(values) / elapsed, 2) if elapsed > 0 else None
+    return result
+
+
+class Scenario:
+    """按 seed 生成各端點的請求（路徑 + 參數），模擬前端的實際用法。"""
+
+    def __init__(self, seed=0, tokens=None):
+        self.rng = random.Random(seed)
+        self.tokens = tokens or []
+
+    def token_list(self, k):
+        return ",".join(self.rng.sample(self.tokens, min(k, len(self.tokens))))
+
+    def filter_data(self):
+        rng = self.rng
+        params = {
+            "price_type": rng.choice(["buy_price", "sell_price"]),
+            "price_unit": rng.choice(["USD", "USD", "SOL"]),
+            "page": rng.choice([1, 1, 1, 2, 3, rng.randint(4, 50)]),
+            "page_size": rng.choice([20, 20, 50, 100]),
+        }
+        if rng.random() < 0.7:
+            params["price_bin"] = rng.randint(0, 5)
+        if self.tokens and rng.random() < 0.3:
+            params["token_list"] = self.token_list(rng.randint(1, 3))
+        if rng.random() < 0.1:
+            params["abnormal_only"] = "true"
+        return "/api/filter_data", params
+
+    def batch_bins_data(self):
+        rng = self.rng
+        params = {"price_type": rng.choice(["buy_price", "sell_price"]), "page_size": 20}
+        if rng.random() < 0.3:
+            params.update(bins="2,3,4,5,1,0", mode="init")
+        else:
+            # 前端按 5 頁一批翻頁
+            start = rng.choice([2, 6, 11, rng.randint(3, 40) * 5 + 1])
+            params.update(bins=str(rng.randint(0, 5)), page_start=start, page_end=start + 4 if start > 2 else 5)
+        return "/api/batch_bins_data", params
+
+    def random_sample(self):
+        rng = self.rng
+        params = {
+            "rows": rng.choice([100, 100, 500, 1000]),
+            "tokens": 10,
+            "price_type": "buy_price",
+            "seed": rng.randint(0, 1 << 30),
+        }
+        if rng.random() < 0.5:
+            params["price_bin"] = rng.randint(0, 5)
+            params["price_unit"] = "USD"
+        if rng.random() < 0.3:
+            params["stratify"] = "true"
+        return "/api/random_sample", params
+
+    def price_ranges(self):
+        rng = self.rng
+        return "/api/price_ranges", {"price_type": rng.choice(["buy_price", "sell_price"]), "price_unit": rng.choice(["USD", "SOL"])}
+
+    def top_tokens(self):
+        return "/api/top_tokens", {"top": self.rng.choice([10, 20, 50, 100])}
+
+    def histogram(self):
+        rng = self.rng
+        params = {"price_type": rng.choice(["buy_price", "sell_price"]), "price_unit": rng.choice(["USD", "SOL"])}
+        if rng.random() < 0.5:
+            params["log_buckets"] = rng.choice([20, 50, 200])
+        if self.tokens and rng.random() < 0.3:
+            params["token_list"] = self.token_list(rng.randint(1, 3))
+        return "/api/histogram", params
+
+    def make(self, endpoint):
+        return getattr(self, endpoint)()
+
+
+async def timed_get(client, path, params):
+    """返回 (秒, 是否成功)。讀完整個響應體才停表。"""
+    start = time.perf_counter()
+    try:
+        response = await client.get(path, params=params)
+        await response.aread()
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def run_sequential(client, scenario, endpoints, requests):
+    """每個端點逐個發 requests 個請求。"""
+    results = {}
+    for endpoint in endpoints:
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            path, params = scenario.make(endpoint)
+            elapsed, ok = await timed_get(client, path, params)
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        results[endpoint] = summarize(latencies, errors, time.perf_counter() - start)
+        logger.info(f"[sequential] {endpoint}: {results[endpoint]}")
+    return results
+
+
+async def run_concurrent(client, scenario, endpoints, requests, concurrency):
+    """各端點的請求打散混合，concurrency 個 worker 同時發送。"""
+    jobs = [(endpoint, *scenario.make(endpoint)) for endpoint in endpoints for _ in range(requests)]
+    scenario.rng.shuffle(jobs)
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    latencies = {endpoint: [] for endpoint in endpoints}
+    errors = {endpoint: 0 for endpoint in endpoints}
+
+    async def worker():
+        while not queue.empty():
+            endpoint, path, params = queue.get_nowait()
+            elapsed, ok = await timed_get(client, path, params)
+            if ok:
+                latencies[endpoint].append(elapsed)
+            else:
+                errors[endpoint] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    results = {endpoint: summarize(latencies[endpoint], errors[endpoint], wall) for endpoint in endpoints}
+    results[ALL] = summarize([x for values in latencies.values() for x in values], sum(errors.values()), wall)
+    logger.info(f"[concurrent x{concurrency}] {results[ALL]}")
+    return results
+
+
+def peak_rss_mb(pid=None):
+    """峰值 RSS（MB）：pid 為 None 時為本進程，否則讀 /proc/<pid>/status 的 VmHWM（僅 Linux）。"""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def wait_prefetch_idle(client, timeout=600):
+    """等啟動預熱等背景預取跑完，避免算進測量。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        health = (await client.get("/api/health")).json()
+        if not health.get("prefetch", {}).get("pending"):
+            return
+        await asyncio.sleep(0.1)
+
+
+async def run_bench(client, endpoints, requests, concurrency, seed):
+    tokens = []
+    response = await client.get("/api/top_tokens", params={"top": 50})
+    if response.status_code == 200:
+        tokens = [row["token_mint_address"] for row in response.json().get("data", [])]
+    await wait_prefetch_idle(client)
+    phases = {
+        "sequential": await run_sequential(client, Scenario(seed, tokens), endpoints, requests),
+        "concurrent": await run_concurrent(client, Scenario(seed + 1, tokens), endpoints, requests, concurrency),
+    }
+    await wait_prefetch_idle(client)
+    return phases
+
+
+async def bench_in_process(data, cache, **kwargs):
+    import engine
+    import result_cache
+    if data:
+        # 換成指定資料集的引擎（在 app 啟動前，get_engine 直接返回它）
+        engine._engine = engine.Engine(data)
+    if cache == "off":
+        result_cache._cache = result_cache.ResultCache(max_bytes=0)
+    import main
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return await run_bench(client, **kwargs)
+
+
+async def bench_url(url, **kwargs):
+    limits = httpx.Limits(max_connections=kwargs["concurrency"] + 4)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        return await run_bench(client, **kwargs)
+
+
+def compare(result, baseline, tolerance, min_delta_ms):
+    """
+    逐項比較 p95 延遲、吞吐與錯誤數，返回退化項列表。
+    p95 超過基準 (1+tolerance) 倍且絕對差超過 min_delta_ms 才算退化，避免毫秒級抖動誤報。
+    """
+    regressions = []
+    for phase, endpoints in result["phases"].items():
+        for endpoint, stats in endpoints.items():
+            base = baseline.get("phases", {}).get(phase, {}).get(endpoint)
+            if not base:
+                continue
+            label = f"{phase}/{endpoint}"
+            new_p95, old_p95 = stats["p95_ms"], base["p95_ms"]
+            if new_p95 is not None and old_p95 is not None and new_p95 > old_p95 * (1 + tolerance) and new_p95 - old_p95 > min_delta_ms:
+                regressions.append(f"{label}: p95 {old_p95}ms -> {new_p95}ms")
+            if phase == "concurrent" and endpoint == ALL and base["throughput"] and stats["throughput"] is not None \
+                    and stats["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{label}: throughput {base['throughput']}/s -> {stats['throughput']}/s")
+            if stats["errors"] > base["errors"]:
+                regressions.append(f"{label}: errors {base['errors']} -> {stats['errors']}")
+    return regressions
+
+
+def print_report(result, baseline=None):
+    header = f"{'phase/endpoint':<34}{'n':>6}{'err':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    for phase, endpoints in result["phases"].items():
+        for endpoint, stats in endpoints.items():
+            line = (f"{phase + '/' + endpoint:<34}{stats['count']:>6}{stats['errors']:>5}"
+                    + "".join(f"{'-' if stats[f'p{p}_ms'] is None else stats[f'p{p}_ms']:>10}" for p in PERCENTILES)
+                    + f"{'-' if stats['throughput'] is None else stats['throughput']:>9}")
+            base = (baseline or {}).get("phases", {}).get(phase, {}).get(endpoint)
+            if base and base["p95_ms"] and stats["p95_ms"] is not None:
+                line += f"{stats['p95_ms'] / base['p95_ms']:>12.2f}x"
+            print(line)
+    print(f"peak RSS: {result['peak_rss_mb']} MB ({result['rss_of']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢端點壓測：延遲百分位、吞吐、峰值 RSS，並與基準比較")
+    parser.add_argument("--data", default=None, help="進程內壓測用的 parquet 檔或資料集目錄（預設按 config）")
+    parser.add_argument("--url", default=None, help="改為壓測已啟動的服務，如 http://127.0.0.1:8000")
+    parser.add_argument("--server-pid", type=int, default=None, help="配合 --url：讀取該進程的峰值 RSS")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="逗號分隔的端點")
+    parser.add_argument("--requests", type=int, default=50, help="每個端點每輪的請求數")
+    parser.add_argument("--concurrency", type=int, default=8, help="並發輪的 worker 數")
+    parser.add_argument("--seed", type=int, default=0, help="請求參數的隨機種子")
+    parser.add_argument("--cache", choices=["on", "off"], default="on", help="進程內壓測時是否啟用結果快取")
+    parser.add_argument("--save-baseline", metavar="JSON", default=None, help="把結果保存為基準")
+    parser.add_argument("--baseline", metavar="JSON", default=None, help="與基準比較，有退化時退出碼 1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的相對退化（預設 20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="p95 的絕對差低於此值不算退化")
+    args = parser.parse_args(argv)
+    endpoints = [x.strip() for x in args.endpoints.split(",") if x.strip()]
+    unknown = [x for x in endpoints if x not in ENDPOINTS]
+    if unknown:
+        parser.error(f"未知端點: {','.join(unknown)}")
+    kwargs = dict(endpoints=endpoints, requests=args.requests, concurrency=args.concurrency, seed=args.seed)
+    if args.url:
+        phases = asyncio.run(bench_url(args.url, **kwargs))
+        rss, rss_of = peak_rss_mb(args.server_pid), "server" if args.server_pid else "n/a"
+    else:
+        phases = asyncio.run(bench_in_process(args.data, args.cache, **kwargs))
+        rss, rss_of = peak_rss_mb(), "process"
+    result = {
+        "meta": {
+            "target": args.url or args.data or "config",
+            "cache": None if args.url else args.cache,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "phases": phases,
+        "peak_rss_mb": rss,
+        "rss_of": rss_of,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    main()
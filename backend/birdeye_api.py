@@ -1,42 +1,200 @@
 import os
+import sqlite3
+import threading
+import time
 import requests
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
 
-# Load API Key from env file (absolute path)
-load_dotenv(r'N:/Windsurf/Hubble-QA/QA-20250411/Birdeye/.env')
+from ratelimit import TokenBucket
+
+from config import (
+    BIRDEYE_BACKOFF, BIRDEYE_BURST, BIRDEYE_CACHE_PATH, BIRDEYE_MAX_CONCURRENCY,
+    BIRDEYE_MAX_RETRIES, BIRDEYE_NEGATIVE_TTL, BIRDEYE_RATE_LIMIT, BIRDEYE_URL,
+)
+
+# API Key 取自環境變數（config 已載入 .env）
 BIRDEYE_API_KEY = os.getenv('BIRDEYE_API_KEY')
 
-BIRDEYE_URL = "https://public-api.birdeye.so/defi/history_price"
+# 需要重試的 HTTP 狀態碼
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def minute_bucket(trade_time: int) -> int:
+    """trade_time 为秒级Unix时间戳（GMT+8），返回对应 UTC 分钟起点的时间戳。"""
+    dt_utc = datetime.fromtimestamp(int(trade_time) - 8 * 3600, tz=timezone.utc)
+    return int(dt_utc.replace(second=0, microsecond=0).timestamp())
+
+
+class PriceCache:
+    """(address, minute) -> price 的 sqlite 磁碟快取；value 為 NULL 表示 Birdeye 無資料。"""
+
+    def __init__(self, path: str, negative_ttl: float = BIRDEYE_NEGATIVE_TTL):
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS birdeye_price ("
+            "address TEXT NOT NULL, minute INTEGER NOT NULL, value REAL, fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (address, minute))"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """返回 {key: value}，只包含命中且未過期的項。"""
+        found = {}
+        now = time.time()
+        with self.lock:
+            for address, minute in keys:
+                row = self.conn.execute(
+                    "SELECT value, fetched_at FROM birdeye_price WHERE address = ? AND minute = ?",
+                    (address, minute),
+                ).fetchone()
+                if row is None:
+                    continue
+                value, fetched_at = row
+                if value is None and now - fetched_at > self.negative_ttl:
+                    continue
+                found[(address, minute)] = value
+        return found
+
+    def put(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO birdeye_price (address, minute, value, fetched_at) VALUES (?, ?, ?, ?)",
+                (key[0], key[1], value, time.time()),
+            )
+            self.conn.commit()
+
+
+class BirdeyeClient:
+    """
+    Birdeye 历史价格客户端：连接池 + 并发请求 + 令牌桶限流 + 重试退避 + 磁盘缓存。
+    同一 (token, 分钟) 的多笔交易只请求一次。base_url 可指向本地 mock 服务。
+    """
+
+    def __init__(
+        self,
+        base_url: str = BIRDEYE_URL,
+        api_key: Optional[str] = BIRDEYE_API_KEY,
+        rate_limit: float = BIRDEYE_RATE_LIMIT,
+        burst: int = BIRDEYE_BURST,
+        max_concurrency: int = BIRDEYE_MAX_CONCURRENCY,
+        max_retries: int = BIRDEYE_MAX_RETRIES,
+        backoff: float = BIRDEYE_BACKOFF,
+        cache_path: Optional[str] = BIRDEYE_CACHE_PATH,
+        chain: str = "solana",
+        timeout: float = 10,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.chain = chain
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.cache = PriceCache(cache_path) if cache_path else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch_minute(self, address: str, minute: int) -> Any:
+        """请求某 token 某分钟的价格原始响应（带限流与重试）。"""
+        params = {
+            "address": address,
+            "address_type": "token",
+            "type": "1m",
+            "time_from": minute,
+            "time_to": minute + 59,
+        }
+        headers = {
+            "accept": "application/json",
+            "x-chain": self.chain,
+            "X-API-KEY": self.api_key or "",
+        }
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                resp = self.session.get(self.base_url, params=params, headers=headers, timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp.json()
+                retry_after = resp.headers.get("Retry-After")
+                error = requests.HTTPError(f"{resp.status_code} from Birdeye", response=resp)
+            except requests.RequestException as e:
+                # 4xx（非 429）属于请求本身的问题，重试无意义
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code not in RETRY_STATUS:
+                    raise
+                retry_after = None
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+            attempt += 1
+
+    def minute_price(self, address: str, minute: int) -> Optional[float]:
+        """单个 (token, 分钟) 的价格，无数据返回 None；成功的结果写入缓存。"""
+        data = self.fetch_minute(address, minute)
+        items = (data.get('data') or {}).get('items', [])
+        value = items[0]['value'] if items and isinstance(items, list) else None
+        if self.cache is not None:
+            self.cache.put((address, minute), value)
+        return value
+
+    def batch_prices(self, trades: List[Dict[str, Any]]) -> List[Any]:
+        """trades 为含 'token_mint_address'、'trade_time' 的 dict 列表，返回每笔价格（无则为 '-'）。"""
+        keys = []
+        for trade in trades:
+            try:
+                keys.append((trade['token_mint_address'], minute_bucket(trade['trade_time'])))
+            except Exception:
+                keys.append(None)
+        unique = list(dict.fromkeys(k for k in keys if k is not None))
+        prices = self.cache.get_many(unique) if self.cache is not None else {}
+        missing = [k for k in unique if k not in prices]
+
+        def fetch(key):
+            try:
+                return key, self.minute_price(*key)
+            except Exception:
+                return key, None
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(missing))) as pool:
+                for key, value in pool.map(fetch, missing):
+                    prices[key] = value
+        return [prices.get(k) if k is not None and prices.get(k) is not None else '-' for k in keys]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> BirdeyeClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BirdeyeClient()
+    return _client
 
 
 def get_birdeye_price(address: str, trade_time: int, chain: str = "solana") -> Any:
     """
     获取单笔交易的Birdeye价格，trade_time为秒级Unix时间戳（GMT+8），自动转为分钟区间（UTC）。
     """
-    # 转为 UTC
-    dt_utc = datetime.utcfromtimestamp(trade_time - 8 * 3600)
-    minute_start = dt_utc.replace(second=0, microsecond=0)
-    minute_end = dt_utc.replace(second=59, microsecond=0)
-    time_from = int(minute_start.timestamp())
-    time_to = int(minute_end.timestamp())
-
-    params = {
-        "address": address,
-        "address_type": "token",
-        "type": "1m",
-        "time_from": time_from,
-        "time_to": time_to,
-    }
-    headers = {
-        "accept": "application/json",
-        "x-chain": chain,
-        "X-API-KEY": BIRDEYE_API_KEY,
-    }
-    resp = requests.get(BIRDEYE_URL, params=params, headers=headers, timeout=10)
-    resp.raise_for_status()
-    return resp.json()
+    return get_client().fetch_minute(address, minute_bucket(trade_time))
 
 
 def batch_birdeye_prices(trades: List[Dict[str, Any]]) -> List[Any]:
@@ -44,21 +202,4 @@ def batch_birdeye_prices(trades: List[Dict[str, Any]]) -> List[Any]:
     批量获取Birdeye价格。trades为包含'token_mint_address'和'trade_time'的dict列表。
     返回每笔交易的价格（若无则为'-'）。
     """
-    import time
-    results = []
-    for idx, trade in enumerate(trades):
-        try:
-            address = trade['token_mint_address']
-            trade_time = int(trade['trade_time'])
-            data = get_birdeye_price(address, trade_time)
-            items = data.get('data', {}).get('items', [])
-            if items and isinstance(items, list) and len(items) > 0:
-                results.append(items[0]['value'])
-            else:
-                results.append('-')
-        except Exception as e:
-            results.append('-')
-        # 限流：每次请求后sleep 1秒，最后一条不sleep
-        if idx != len(trades) - 1:
-            time.sleep(1)
-    return results
+    return get_client().batch_prices(trades)
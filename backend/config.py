@@ -1,5 +1,109 @@
 # backend/config.py
 
+import os
+
+from dotenv import load_dotenv
+
+# backend/.env（或上層目錄的 .env）裡的環境變數，例如 BIRDEYE_API_KEY、BIRDEYE_RATE_LIMIT
+load_dotenv()
+
 CSV_PATH = "../SlotTest_with_header.csv"  # 已更新为带表头的新文件
 DEFAULT_SOL_PRICE = 133
 PARQUET_PATH = "../SlotTest_with_header.parquet"
+DATASET_PATH = "../dataset"  # hive 分區資料集目錄（ingest.py --dataset 生成），存在時優先於 PARQUET_PATH
+DATASET_PARTITION_BY = ["trade_date", "buy_price_bin"]  # 新建分區資料集時的分區欄位
+
+# DuckDB 引擎設定（engine.py）
+DUCKDB_THREADS = 4  # DuckDB 內部並行線程數，None 表示使用 DuckDB 預設（CPU 核數）
+DUCKDB_MEMORY_LIMIT = "4GB"  # DuckDB 記憶體上限，None 表示使用 DuckDB 預設
+DUCKDB_DATASET_MODE = "view"  # view: 以 view 掛載 parquet；table: 啟動時整份載入記憶體
+
+# Birdeye 客戶端設定（birdeye_api.py）
+BIRDEYE_URL = "https://public-api.birdeye.so/defi/history_price"
+# 限流按 API 方案設定，可用同名環境變數覆蓋。預設 1 次/秒（免費方案的額度），每個未快取的 (token, 分鐘)
+# 一次請求，200 筆各不相同的成交補價約需 200 秒；付費方案把 BIRDEYE_RATE_LIMIT / BIRDEYE_BURST 調到方案額度即可
+BIRDEYE_RATE_LIMIT = float(os.getenv("BIRDEYE_RATE_LIMIT", "1.0"))  # 每秒請求數（令牌桶速率）
+BIRDEYE_BURST = int(os.getenv("BIRDEYE_BURST", "1"))  # 令牌桶容量（允許的瞬時突發請求數）
+BIRDEYE_MAX_CONCURRENCY = 4  # 並發請求數（連接池大小）
+BIRDEYE_MAX_RETRIES = 3  # 429/5xx/網路錯誤的重試次數
+BIRDEYE_BACKOFF = 0.5  # 重試退避基數（秒），按 2^n 增長
+BIRDEYE_CACHE_PATH = "../birdeye_cache.sqlite"  # 價格磁碟快取，None 表示不使用
+BIRDEYE_NEGATIVE_TTL = 3600  # 「無價格」結果的快取秒數（有價格的結果永久快取）
+
+# Solana RPC slot 時間設定（solana_api.py）
+SOLANA_RPC_URL = "https://api.mainnet-beta.solana.com"
+SOLANA_RPC_BATCH_SIZE = 100  # 每個 JSON-RPC 批次請求包含的 slot 數
+SOLANA_RPC_MAX_CONCURRENCY = 4  # 並發批次數（連接池大小）
+SOLANA_RPC_RATE_LIMIT = 2.0  # 每秒批次請求數
+SOLANA_RPC_MAX_RETRIES = 3
+SOLANA_RPC_BACKOFF = 0.5
+SLOT_CACHE_PATH = "../slot_times.sqlite"  # slot→時間戳持久化存儲，None 表示不使用
+SLOT_INTERPOLATE_MAX_GAP = 10000  # 插值時兩側已知 slot 的最大距離（約 1 小時）
+SLOT_SECONDS = 0.4  # 只有單側已知 slot 時外推用的出塊間隔
+
+# 價格區間邊界（SOL/USD 共用，最後一個 1e20 表示無上界）
+PRICE_BINS = [0, 10, 100, 1000, 10000, 100000, 1e20]
+# 請求自訂區間（price_bins.py）：edges=邊界列表 或 log_buckets=N 個對數等距桶
+PRICE_BINS_MAX = 1000  # 自訂區間數上限
+LOG_BUCKETS_RANGE = (0.01, 1000000)  # log_buckets 未指定 log_min/log_max 時的預設範圍（與價格單位相同）
+
+# 資料導入設定（ingest.py）
+INGEST_ROW_GROUP_SIZE = 131072  # parquet row group 行數；按 token+時間排序後越小裁剪越細
+INGEST_COMPRESSION = "zstd"
+INGEST_MEMORY_LIMIT = "2GB"  # 導入時 DuckDB 記憶體上限，超出部分（排序）溢寫到臨時目錄
+INGEST_TEMP_DIR = "../.ingest_tmp"
+
+# 異常值標記（anomaly.py）：導入時算出 anomaly_flags，並把異常行另存一份供 abnormal_only / anomaly_flags 查詢
+ANOMALY_MEDIAN_WINDOW = 50  # 滾動中位數取同一 token 之前多少筆成交
+ANOMALY_MEDIAN_MIN_TRADES = 5  # 視窗內有效價格少於此數時不判斷中位數偏離
+ANOMALY_DEVIATION_FACTOR = 10  # 成交價高於中位數此倍數或低於其倒數倍時標記 median_deviation
+ANOMALY_SENTINEL = 1e20  # 不小於此值的價格視為上游的「無價格」哨兵值
+
+# 預聚合 cube（cube.py）
+CUBE_BUCKETS_PER_DECADE = 64  # 對數細分桶數（每十倍），越大則 USD 區間邊界需要回原始資料補算的行越少
+
+# 查詢結果快取（result_cache.py）
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 快取總大小上限（近似位元組），超出時按 LRU 淘汰
+RESULT_CACHE_TTL = None  # 秒；None 表示只在資料集變動時失效
+# 相同請求等待進行中計算的時限（秒），超過後自己計算；須明顯小於 QUERY_TIMEOUT，自己算仍來得及在請求超時前返回
+RESULT_CACHE_FOLLOWER_WAIT = 10
+
+# 查詢執行（executor.py）：查詢在有界線程池中執行，按端點限制並發與排隊長度
+QUERY_WORKERS = 8  # 查詢線程池大小，即同時執行的 DuckDB 查詢上限；QUERY_LIMITS 的並發上限之和可以超過它（超額訂閱）
+QUERY_TIMEOUT = 30  # 單個查詢的執行時限（秒），超時中斷 DuckDB 查詢
+QUERY_QUEUE_TIMEOUT = 10  # 排隊等待的時限（秒），超過返回 503
+QUERY_LIMITS = {  # 端點: (並發上限, 排隊上限)；未列出的端點用 default。滿載時名額多於線程，多出的查詢在線程池裡等，計入 QUERY_TIMEOUT
+    "filter_data": (4, 32),
+    "batch_bins_data": (4, 32),
+    "random_sample": (2, 8),
+    "top_tokens": (2, 16),
+    "price_ranges": (2, 16),
+    "histogram": (2, 16),
+    "anomalies": (2, 16),
+    "export": (2, 4),
+    "default": (2, 16),
+}
+
+# 串流導出（export.py）
+EXPORT_BATCH_ROWS = 65536  # 每個 record batch 的行數，即每次從 DuckDB 取出並編碼輸出的塊大小
+
+# 背景預取（prefetch.py）：batch_bins_data 返回後在背景把各區間後續幾頁算進分頁快取，啟動時預熱預設視圖
+PREFETCH_PAGES = 9  # 每個區間預取的後續頁數（前端按 5 頁一批翻頁，9 頁覆蓋首屏後的 2-10 頁）；0 表示關閉
+PREFETCH_WORKERS = 1  # 預取線程數
+PREFETCH_MAX_PENDING = 16  # 排隊中的預取任務上限，超出時丟棄新任務
+PREFETCH_IDLE_WAIT = 5  # 前台有查詢時預取最多等待的秒數，超過則放棄該任務
+WARMUP_VIEW = {  # 啟動時預熱的預設視圖（前端首屏的 mode=init 及之後 PREFETCH_PAGES 頁），None 表示不預熱
+    "price_type": "buy_price",
+    "price_unit": "USD",
+    "sol_price": DEFAULT_SOL_PRICE,
+    "bins": [2, 3, 4, 5, 1, 0],
+    "page_size": 20,
+}
+
+# 請求計時與指標（metrics.py）：Server-Timing 響應頭、每請求一行結構化日誌、/metrics
+METRICS_ROWS_SCANNED = True  # 開啟 DuckDB profiler 取得每個查詢的掃描/返回行數（約有幾個百分點的查詢開銷），False 則不統計
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # 延遲直方圖的桶上界（秒）
+
+# 近似統計（sketch.py）：approx_stats=true 時摘要附帶的分位數與不同 token/錢包數
+SKETCH_QUANTILES = (0.5, 0.9, 0.99)  # 輸出的分位數，欄位名為 p50/p90/p99
+SKETCH_HLL_BITS = 10  # HyperLogLog 暫存器數為 2^bits，標準誤差約 1.04/sqrt(2^bits)（10 位約 3%）
@@ -0,0 +1,178 @@
+# backend/cube.py
+# 預聚合 cube：導入時按 (token, type, trade_date, price_type, bin, bucket) 存 count/sum/min/max（SOL 計價），
+# 摘要查詢直接在 cube 上加總，USD 值在查詢時乘以 sol_price，因此 cube 與 sol_price 無關。
+#
+# bin 為導入時按價格區間邊界（PRICE_BINS）算出的粗區間，SOL 單位、邊界相同的查詢可精確命中；
+# bucket 為對數細分桶（每十倍 CUBE_BUCKETS_PER_DECADE 個），USD 區間換算成 SOL 後邊界會落在桶中間，
+# 完全落在區間內的桶直接用 cube，跨邊界的少數桶回原始資料補算（只掃這些桶對應的價格範圍）。
+#
+# 檔案：單檔資料集為 <parquet>.cube；分區資料集每批一個 <dataset>/_cube/<batch>.cube（只追加）。
+# 副檔名不是 .parquet，不會被資料集的 glob 讀到。
+
+import json
+import math
+import os
+
+import dataset
+from config import CUBE_BUCKETS_PER_DECADE
+
+CUBE_SUFFIX = ".cube"
+PRICE_TYPES = ["buy_price", "sell_price"]
+
+# 特殊桶：與 DuckDB 的比較語意對應（NaN 大於一切數值，inf 只落在無上界區間）
+NAN_BUCKET = -1000000
+NEG_BUCKET = -1000001
+ZERO_BUCKET = -1000002
+INF_BUCKET = 1000000
+# 正有限價格的桶編號落在 (NAN_BUCKET, INF_BUCKET) 之間（最小約 -324 * 每十倍桶數）
+POS_MIN, POS_MAX = NAN_BUCKET + 1, INF_BUCKET - 1
+
+# 判斷「桶完全在區間內」時的相對餘量，吸收 log10/pow 的浮點誤差
+EPS = 1e-9
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def bucket_expr(col, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """價格所在桶的編號；導入建 cube 與查詢補算時用同一個表達式，保證歸桶一致。"""
+    return (
+        f"CASE WHEN {col} IS NULL THEN NULL "
+        f"WHEN isnan({col}) THEN {NAN_BUCKET} "
+        f"WHEN {col} < 0 THEN {NEG_BUCKET} "
+        f"WHEN {col} = 0 THEN {ZERO_BUCKET} "
+        f"WHEN isinf({col}) THEN {INF_BUCKET} "
+        f"ELSE CAST(floor(log10({col}) * {int(per_decade)}) AS INTEGER) END"
+    )
+
+
+def bucket_bounds(bucket, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """正價格桶的名義範圍 [lo, hi)（SOL）。"""
+    return 10 ** (bucket / per_decade), 10 ** ((bucket + 1) / per_decade)
+
+
+def bin_expr(col, edges):
+    """粗區間編號（與 ingest.price_bin_expr 一致）：NaN/負數/NULL 為 NULL。"""
+    whens = []
+    for idx in range(len(edges) - 1):
+        if idx + 1 == len(edges) - 1:
+            whens.append(f"WHEN {col} >= {edges[idx]} THEN {idx}")
+        else:
+            whens.append(f"WHEN {col} >= {edges[idx]} AND {col} < {edges[idx+1]} THEN {idx}")
+    return f"CAST(CASE WHEN isnan({col}) THEN NULL {' '.join(whens)} END AS TINYINT)"
+
+
+def cube_path(path):
+    if dataset.is_dataset_dir(path):
+        return os.path.join(path, "_cube")
+    return path + CUBE_SUFFIX
+
+
+def cube_files(path):
+    target = cube_path(path)
+    if os.path.isdir(target):
+        return sorted(os.path.join(target, f) for f in os.listdir(target) if f.endswith(CUBE_SUFFIX))
+    return [target] if os.path.isfile(target) else []
+
+
+def build(con, source, target, token_col, edges, meta, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """
+    從 source（已寫好的資料檔）聚合出 cube 寫到 target；meta 寫進 parquet 的 key-value metadata，
+    用來判斷 cube 是否與資料一致。先寫臨時檔再替換。返回 cube 行數。
+    """
+    parts = []
+    for price_type in PRICE_TYPES:
+        col = f"{price_type}_sol"
+        valid = f"FILTER (WHERE NOT isnan({col}))"
+        parts.append(f"""
+            SELECT {token_col}, type, trade_date, '{price_type}' AS price_type,
+                   {bin_expr(col, edges)} AS bin, {bucket_expr(col, per_decade)} AS bucket,
+                   COUNT(*) AS n, COUNT({col}) {valid} AS n_num,
+                   SUM({col}) {valid} AS sum_sol, MIN({col}) {valid} AS min_sol, MAX({col}) {valid} AS max_sol
+            FROM {source}
+            GROUP BY ALL
+        """)
+    meta = dict(meta, bin_edges=list(edges), per_decade=int(per_decade), token_col=token_col)
+    kv = ", ".join(f"{k}: {sql_string(json.dumps(v))}" for k, v in meta.items())
+    tmp = target + ".tmp"
+    rows = con.execute(f"""
+        COPY ({' UNION ALL '.join(parts)} ORDER BY ALL)
+        TO {sql_string(tmp)} (FORMAT parquet, COMPRESSION zstd, KV_METADATA {{{kv}}})
+    """).fetchone()[0]
+    os.replace(tmp, target)
+    return rows
+
+
+def read_meta(con, files):
+    """{檔案: {key: value}}，讀各 cube 檔 footer 裡的 key-value metadata。"""
+    if not files:
+        return {}
+    file_list = "[" + ", ".join(sql_string(f) for f in files) + "]"
+    meta = {}
+    for file_name, key, value in con.execute(
+        f"SELECT file_name, decode(key), decode(value) FROM parquet_kv_metadata({file_list})"
+    ).fetchall():
+        try:
+            meta.setdefault(os.path.normpath(file_name), {})[key] = json.loads(value)
+        except ValueError:
+            continue
+    return meta
+
+
+def source_sql(files):
+    return "read_parquet([" + ", ".join(sql_string(f) for f in files) + "])"
+
+
+def plan_range(low, high, scale, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """
+    price_expr = price_sol * scale 落在 [low, high)（high 為 None 表示無上界）時：
+    返回 (cube 條件, 需要回原始資料補算的正價格桶集合, 是否需要補算負價格桶)。
+    """
+    conds = []
+    edge = set()
+    l_sol = low / scale
+    # 特殊桶：NaN >= low 恆真、NaN < high 恆假；inf 同理；0 與負數按值判斷
+    if high is None:
+        conds.append(f"bucket IN ({NAN_BUCKET}, {INF_BUCKET})")
+    if low <= 0 and (high is None or high > 0):
+        conds.append(f"bucket = {ZERO_BUCKET}")
+    neg_edge = low < 0
+    # 正價格桶：完全在範圍內的用 cube，與 low/high 相交的記為補算桶
+    if high is not None and high <= 0:
+        first, last = None, None
+    else:
+        first, last = POS_MIN, POS_MAX
+        if l_sol > 0:
+            b0 = math.floor(math.log10(l_sol) * per_decade)
+            near = [b for b in (b0 - 1, b0, b0 + 1)
+                    if bucket_bounds(b, per_decade)[0] < l_sol * (1 + EPS) and bucket_bounds(b, per_decade)[1] > l_sol * (1 - EPS)]
+            edge.update(near)
+            first = max(near) + 1
+        if high is not None:
+            h_sol = high / scale
+            b0 = math.floor(math.log10(h_sol) * per_decade)
+            near = [b for b in (b0 - 1, b0, b0 + 1)
+                    if bucket_bounds(b, per_decade)[0] < h_sol * (1 + EPS) and bucket_bounds(b, per_decade)[1] > h_sol * (1 - EPS)]
+            edge.update(near)
+            last = min(near) - 1
+    if first is not None and first <= last:
+        conds.append(f"bucket BETWEEN {first} AND {last}")
+    return (f"({' OR '.join(conds)})" if conds else "FALSE"), edge, neg_edge
+
+
+def edge_filter(col, buckets, neg_edge, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """
+    原始資料上只取補算桶的條件：先用價格範圍粗篩（可走統計、避免對每行算 log10），再用 bucket_expr 精確比對。
+    """
+    ranges, codes = [], []
+    for b in sorted(buckets):
+        lo, hi = bucket_bounds(b, per_decade)
+        ranges.append(f"({col} >= {lo * (1 - EPS)!r} AND {col} < {hi * (1 + EPS)!r})")
+        codes.append(str(b))
+    if neg_edge:
+        ranges.append(f"{col} < 0")
+        codes.append(str(NEG_BUCKET))
+    if not codes:
+        return None
+    return f"({' OR '.join(ranges)}) AND {bucket_expr(col, per_decade)} IN ({', '.join(codes)})"
@@ -0,0 +1,119 @@
+# backend/dataset.py
+# Hive 分區資料集（目錄）的佈局與清單：
+#   <dataset>/trade_date=2024-04-18/buy_price_bin=3/part-<batch>_0.parquet
+#   <dataset>/_manifest.json   分區欄位、分區用的價格區間邊界、每批導入的檔案
+# 每次導入只新增檔案，不改寫已有分區；分區欄位上的條件讓 DuckDB 在打開檔案前就裁剪掉不相關的目錄。
+
+import json
+import os
+from datetime import datetime, timezone
+
+MANIFEST_NAME = "_manifest.json"
+
+# 分區欄位的類型（不依賴 DuckDB 從目錄名推斷）
+PARTITION_TYPES = {
+    "trade_date": "DATE",
+    "buy_price_bin": "TINYINT",
+    "sell_price_bin": "TINYINT",
+}
+
+
+def is_dataset_dir(path):
+    return os.path.isdir(path)
+
+
+def manifest_path(path):
+    return os.path.join(path, MANIFEST_NAME)
+
+
+def read_manifest(path):
+    """讀取清單；目錄不存在或尚無清單時返回 None。"""
+    try:
+        with open(manifest_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path, manifest):
+    """先寫臨時檔再替換，讀取方不會看到寫了一半的清單。"""
+    tmp = manifest_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, manifest_path(path))
+
+
+def manifest_mtime(path):
+    try:
+        return os.path.getmtime(manifest_path(path))
+    except OSError:
+        return None
+
+
+def files_glob(path):
+    """資料集全部 parquet 檔的 glob（單檔資料集原樣返回）。"""
+    if is_dataset_dir(path):
+        return os.path.join(path, "**", "*.parquet")
+    return path
+
+
+def source_sql(path, files=None):
+    """
+    資料集的 read_parquet 表達式；目錄按 hive 分區讀，分區欄位作為普通欄位出現。
+    files 為檔案完整路徑列表時只讀這些檔案（欄位與讀整個資料集時相同）。
+    """
+    if files is not None:
+        target = "[" + ", ".join("'" + f.replace("'", "''") + "'" for f in files) + "]"
+    else:
+        target = "'" + files_glob(path).replace("'", "''") + "'"
+    if not is_dataset_dir(path):
+        return f"read_parquet({target})"
+    manifest = read_manifest(path) or {}
+    hive_types = ", ".join(
+        f"'{col}': {PARTITION_TYPES[col]}" for col in manifest.get("partition_by", []) if col in PARTITION_TYPES
+    )
+    if not hive_types:
+        return f"read_parquet({target}, hive_partitioning=true)"
+    return f"read_parquet({target}, hive_partitioning=true, hive_types={{{hive_types}}})"
+
+
+def utc_date(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).date().isoformat()
+
+
+def time_partition_filters(partition_by, start_time=None, end_time=None):
+    """trade_timestamp（毫秒）範圍對應的 trade_date 分區條件，與行級條件一起使用。"""
+    if "trade_date" not in partition_by:
+        return []
+    filters = []
+    if start_time is not None:
+        filters.append(f"trade_date >= DATE '{utc_date(start_time)}'")
+    if end_time is not None:
+        filters.append(f"trade_date <= DATE '{utc_date(end_time)}'")
+    return filters
+
+
+def bin_partition_filter(col, edges, ranges, eps=0.0):
+    """
+    SOL 價格落在任一 [low, high) 範圍（high 為 None 表示無上界）時可能所在的分區 bin 條件。
+    分區 bin 按導入時的 edges 計算，NaN/負數價格在 NULL 分區；
+    DuckDB 中 NaN 大於一切數值，所以無上界的範圍要帶上 NULL 分區。
+    eps 為相對放寬量，USD→SOL 換算時用來吸收浮點誤差，避免誤刪分區。
+    """
+    last = len(edges) - 2
+    keep, with_null = set(), False
+    for low, high in ranges:
+        with_null |= high is None or low < 0
+        for i in range(last + 1):
+            above_low = i == last or edges[i+1] > low - abs(low) * eps
+            below_high = high is None or edges[i] < high + abs(high) * eps
+            if above_low and below_high:
+                keep.add(i)
+    conds = []
+    if keep:
+        conds.append(f"{col} IN ({', '.join(str(i) for i in sorted(keep))})")
+    if with_null:
+        conds.append(f"{col} IS NULL")
+    if not conds:
+        return "FALSE"
+    return conds[0] if len(conds) == 1 else f"({' OR '.join(conds)})"
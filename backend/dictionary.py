@@ -0,0 +1,104 @@
+# backend/dictionary.py
+# 地址欄位的字典編碼：導入時為 token / 錢包地址分配緊湊的整數 ID，字典持久化在資料集旁。
+# 過濾、分組在整數欄位上做，只有真正返回的行才解碼回字串。
+#
+# 字典只追加、ID 永不改變：每次導入把新出現的值寫成一個新的分塊
+#   <dataset>/_dictionary/<column>/<batch>.dict     （單檔資料集為 <parquet>.dictionary/<column>/...）
+# 分塊是 (id INTEGER, value VARCHAR) 的 parquet，副檔名不是 .parquet，不會被資料集的 glob 讀到。
+# 導入是單寫者：同時跑兩個導入會分配出重複 ID。
+
+import os
+
+import dataset
+
+# 原始欄位 → ID 欄位。transaction_signature 幾乎每行唯一，編碼不省空間也不加速分組，保留字串。
+ENCODED_COLUMNS = {
+    "token_mint_address": "token_id",
+    "trader_wallet_address": "wallet_id",
+}
+
+CHUNK_SUFFIX = ".dict"
+
+EMPTY_SQL = "(SELECT CAST(NULL AS INTEGER) AS id, CAST(NULL AS VARCHAR) AS value WHERE FALSE)"
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def dictionary_dir(path):
+    if dataset.is_dataset_dir(path):
+        return os.path.join(path, "_dictionary")
+    return path + ".dictionary"
+
+
+def column_dir(path, column):
+    return os.path.join(dictionary_dir(path), column)
+
+
+def has_dictionary(path, column):
+    folder = column_dir(path, column)
+    return os.path.isdir(folder) and any(name.endswith(CHUNK_SUFFIX) for name in os.listdir(folder))
+
+
+def source_sql(path, column):
+    """字典的 (id, value) 來源；尚無任何分塊時為空表。"""
+    if not has_dictionary(path, column):
+        return EMPTY_SQL
+    return f"read_parquet({sql_string(os.path.join(column_dir(path, column), '*' + CHUNK_SUFFIX))})"
+
+
+def extend(con, path, column, values_sql, batch):
+    """
+    把 values_sql（含 column 欄位的查詢）中字典裡還沒有的值追加為新分塊，
+    ID 從現有最大值之後按字串順序連續分配。返回新增的值數。
+    """
+    folder = column_dir(path, column)
+    os.makedirs(folder, exist_ok=True)
+    existing = source_sql(path, column)
+    target = os.path.join(folder, batch + CHUNK_SUFFIX)
+    tmp = target + ".tmp"
+    count = con.execute(f"""
+        COPY (
+            SELECT (SELECT COALESCE(MAX(id), 0) FROM {existing}) + row_number() OVER (ORDER BY value) AS id, value
+            FROM (
+                SELECT DISTINCT {column} AS value FROM ({values_sql}) WHERE {column} IS NOT NULL
+                EXCEPT
+                SELECT value FROM {existing}
+            )
+            ORDER BY id
+        ) TO {sql_string(tmp)} (FORMAT parquet, COMPRESSION zstd)
+    """).fetchone()[0]
+    if count:
+        os.replace(tmp, target)
+    else:
+        os.remove(tmp)
+    return count
+
+
+def extend_all(con, path, source, batch):
+    """
+    一次掃描來源，取出各編碼欄位的不同值（GROUPING SETS），再逐欄追加到字典。返回 {欄位: 新增數}。
+    """
+    cols = list(ENCODED_COLUMNS)
+    con.execute(
+        f"CREATE OR REPLACE TEMP TABLE _dict_values AS SELECT {', '.join(cols)} FROM {source} "
+        f"GROUP BY GROUPING SETS ({', '.join(f'({c})' for c in cols)})"
+    )
+    try:
+        return {c: extend(con, path, c, f"SELECT {c} FROM _dict_values", batch) for c in cols}
+    finally:
+        con.execute("DROP TABLE IF EXISTS _dict_values")
+
+
+def encoded_select(source_alias="src", dataset_path=None):
+    """
+    導入時把 ID 欄位接到原始資料上的 (欄位表達式, JOIN 子句)：
+    每個編碼欄位 LEFT JOIN 一份字典，NULL 地址得到 NULL ID。
+    """
+    columns, joins = [], []
+    for i, (column, id_column) in enumerate(ENCODED_COLUMNS.items()):
+        alias = f"_d{i}"
+        columns.append(f"{alias}.id AS {id_column}")
+        joins.append(f"LEFT JOIN {source_sql(dataset_path, column)} {alias} ON {alias}.value = {source_alias}.{column}")
+    return ", ".join(columns), " ".join(joins)
@@ -0,0 +1,410 @@
+# backend/engine.py
+# 進程內共享的 DuckDB 引擎：整個進程只開一個資料庫，啟動時註冊一次資料集，
+# 每個工作線程複用自己的 cursor，避免每次請求都重新 connect + 解析 parquet footer。
+
+import json
+import logging
+import os
+import threading
+import time
+
+import duckdb
+
+import anomaly
+import cube
+import dataset
+import dictionary
+import token_index
+from config import (
+    DATASET_PATH, DUCKDB_DATASET_MODE, DUCKDB_MEMORY_LIMIT, DUCKDB_THREADS, METRICS_ROWS_SCANNED, PARQUET_PATH,
+)
+from metrics import current_trace, stage
+
+logger = logging.getLogger(__name__)
+
+# 所有查詢統一使用的資料集名稱
+TABLE_NAME = "trades"
+
+# 會產生結果集、可以 EXPLAIN ANALYZE 的語句
+_QUERY_PREFIXES = ("SELECT", "WITH", "FROM", "(")
+
+
+def query_rows(cur):
+    """cur 上一個查詢的 (掃描行數, 返回行數)，取自 DuckDB profiler；未開啟或取不到時為 (None, None)。"""
+    try:
+        info = json.loads(cur.get_profiling_information(format="json"))
+    except Exception:
+        return None, None
+    return info.get("cumulative_rows_scanned"), info.get("rows_returned")
+
+
+class TracedCursor:
+    """
+    DuckDB cursor 的薄包裝：在請求內（metrics.current_trace() 不為 None）時，execute 計入 sql 階段，
+    fetch*/to_arrow_table/df 計入 fetch 階段；結果取完後 DuckDB profiler 才有該查詢的統計，因此掃描/返回行數在 fetch 後補上。
+    請求要求 profile 時先跑一遍 EXPLAIN ANALYZE 留下計劃。其餘屬性原樣轉發給底層 cursor。
+    task 為正在使用這個 cursor 的查詢任務（見 executor.QueryTask）：每個語句前後呼叫 task.begin_statement /
+    task.end_statement，任務已取消時 begin_statement 直接拋出 InterruptException，不再執行新的語句。
+    """
+
+    __slots__ = ("_cur", "_query", "task")
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._query = None
+        self.task = None
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def _execute(self, sql, params):
+        task = self.task
+        if task is None:
+            return self._run(sql, params)
+        task.begin_statement()
+        try:
+            return self._run(sql, params)
+        finally:
+            task.end_statement()
+
+    def _run(self, sql, params):
+        if params is None:
+            return self._cur.execute(sql)
+        return self._cur.execute(sql, params)
+
+    def execute(self, sql, params=None):
+        self._query = None
+        trace = current_trace()
+        if trace is None:
+            self._execute(sql, params)
+            return self
+        if trace.profile and sql.lstrip().upper().startswith(_QUERY_PREFIXES):
+            # 在同一 cursor 上先跑（註冊的臨時表可見），不覆蓋稍後要取的結果；查詢因此會執行兩次
+            try:
+                plan = self._execute(f"EXPLAIN ANALYZE {sql}", params).fetchall()
+                trace.plans.append({"sql": sql, "plan": "\n".join(row[-1] for row in plan)})
+            except duckdb.InterruptException:
+                raise
+            except Exception as e:
+                trace.plans.append({"sql": sql, "error": str(e)})
+        start = time.perf_counter()
+        self._execute(sql, params)
+        self._query = trace.record_query(sql, time.perf_counter() - start)
+        return self
+
+    def _fetch(self, method, *args, **kwargs):
+        with stage("fetch"):
+            result = getattr(self._cur, method)(*args, **kwargs)
+        if self._query is not None:
+            if METRICS_ROWS_SCANNED:
+                self._query["rows_scanned"], self._query["rows_returned"] = query_rows(self._cur)
+            self._query = None
+        return result
+
+    def fetchone(self):
+        return self._fetch("fetchone")
+
+    def fetchall(self):
+        return self._fetch("fetchall")
+
+    def df(self, *args, **kwargs):
+        return self._fetch("df", *args, **kwargs)
+
+    def to_arrow_table(self, *args, **kwargs):
+        return self._fetch("to_arrow_table", *args, **kwargs)
+
+
+class Engine:
+    """
+    持有一個進程級 DuckDB 資料庫，並為每個線程分配一個 cursor。
+    cursor 共享同一個 catalog，因此資料集只需註冊一次。
+    """
+
+    def __init__(self, parquet_path=None, threads=DUCKDB_THREADS,
+                 memory_limit=DUCKDB_MEMORY_LIMIT, dataset_mode=DUCKDB_DATASET_MODE):
+        config = {}
+        if threads:
+            config["threads"] = int(threads)
+        if memory_limit:
+            config["memory_limit"] = str(memory_limit)
+        self.parquet_path = parquet_path
+        self.dataset_mode = dataset_mode
+        self._con = duckdb.connect(database=":memory:", config=config)
+        # 快取 parquet footer/metadata，view 模式下重複查詢不必再解析
+        self._con.execute("SET parquet_metadata_cache = true")
+        # 時間欄位統一按 UTC 輸出
+        self._con.execute("SET TimeZone = 'UTC'")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cursors = []
+        self._row_group_stats = None
+        self._columns = None
+        self._manifest = None
+        self._signature = None
+        self._token_index = None
+        self._cube = None
+        self._anomalies = None
+        if parquet_path is None:
+            # 有分區資料集目錄時優先使用，否則退回單一 parquet 檔
+            parquet_path = DATASET_PATH if DATASET_PATH and dataset.is_dataset_dir(DATASET_PATH) else PARQUET_PATH
+        self.register_dataset(parquet_path)
+
+    def register_dataset(self, parquet_path):
+        """
+        以 view（預設）或 table 形式註冊資料集，重複呼叫會覆蓋舊定義。
+        parquet_path 可以是單一 parquet 檔或 hive 分區資料集目錄（見 dataset.py）。
+        """
+        with self._lock:
+            self._register(parquet_path)
+
+    def _register(self, parquet_path):
+        """持 self._lock 呼叫。"""
+        source = dataset.source_sql(parquet_path)
+        if self.dataset_mode == "table":
+            self._con.execute(f"CREATE OR REPLACE TABLE {TABLE_NAME} AS SELECT * FROM {source}")
+        else:
+            self._con.execute(f"CREATE OR REPLACE VIEW {TABLE_NAME} AS SELECT * FROM {source}")
+        self.parquet_path = parquet_path
+        self._row_group_stats = None
+        self._columns = None
+        self._manifest = dataset.read_manifest(parquet_path) if dataset.is_dataset_dir(parquet_path) else None
+        self._cube = None
+        self._anomalies = None
+        # 舊索引不在這裡關閉：其他線程可能已取到它、正在查詢，換下後由 GC 回收連接
+        # table 模式資料已在記憶體，不需要按檔案裁剪
+        self._token_index = token_index.open_index(parquet_path) if self.dataset_mode != "table" else None
+        # 簽名最後更新：refresh 的無鎖快速路徑看到新簽名時，其餘狀態已經換好
+        self._signature = self._dataset_signature(parquet_path)
+        logger.info(f"engine registered dataset {TABLE_NAME} ({self.dataset_mode}): {parquet_path}")
+
+    @staticmethod
+    def _dataset_signature(path):
+        """分區資料集看清單的修改時間，單檔看檔案大小與修改時間。"""
+        if dataset.is_dataset_dir(path):
+            return dataset.manifest_mtime(path)
+        try:
+            return token_index.file_signature(path)
+        except OSError:
+            return None
+
+    def refresh(self):
+        """
+        資料集有變動（新一批導入完成、單檔被重新生成）時重新註冊，清掉欄位/統計快取並重新打開 token 索引；
+        table 模式順帶重新載入資料。返回是否有重新註冊。
+        """
+        if self._dataset_signature(self.parquet_path) == self._signature:
+            return False
+        with self._lock:
+            # 多個線程同時發現變動時只有第一個重新註冊
+            if self._dataset_signature(self.parquet_path) == self._signature:
+                return False
+            self._register(self.parquet_path)
+        return True
+
+    def data_version(self):
+        """目前資料的版本（路徑 + 簽名），結果快取以此判斷舊結果是否失效。"""
+        self.refresh()
+        return self.parquet_path, self._signature
+
+    def partitioning(self):
+        """分區資料集的 {'partition_by': [...], 'bin_edges': [...]}；單檔資料集返回 None。"""
+        self.refresh()
+        if not self._manifest:
+            return None
+        return {"partition_by": self._manifest.get("partition_by", []), "bin_edges": self._manifest.get("bin_edges")}
+
+    def dictionary_source(self, column):
+        """
+        column（如 token_mint_address）的字典 (id, value) 來源 SQL；
+        資料集沒有對應的 ID 欄位或沒有字典時返回 None，呼叫方退回字串欄位。
+        """
+        id_column = dictionary.ENCODED_COLUMNS.get(column)
+        if id_column is None or id_column not in {name for name, _ in self.columns()}:
+            return None
+        if not dictionary.has_dictionary(self.parquet_path, column):
+            return None
+        return dictionary.source_sql(self.parquet_path, column)
+
+    def encode(self, column, values):
+        """把字串值翻譯成字典 ID，返回 {value: id}（字典裡沒有的值不出現）；無字典時返回 None。"""
+        source = self.dictionary_source(column)
+        if source is None:
+            return None
+        values = list(dict.fromkeys(values))
+        if not values:
+            return {}
+        rows = self.cursor().execute(
+            f"SELECT value, id FROM {source} WHERE value IN (SELECT unnest(?::VARCHAR[]))", [values]
+        ).fetchall()
+        return dict(rows)
+
+    def cube_info(self):
+        """
+        與目前資料一致的預聚合 cube：{'source', 'bin_edges', 'per_decade', 'token_col'}；
+        沒有 cube 或 cube 過期（資料在 cube 之後變動過）時返回 None，摘要改從原始資料計算。
+        """
+        self.refresh()
+        if self._cube is None:
+            self._cube = self._load_cube() or False
+        return self._cube or None
+
+    def _load_cube(self):
+        files = cube.cube_files(self.parquet_path)
+        if not files:
+            return None
+        meta = cube.read_meta(self.cursor(), files)
+        metas = [meta.get(os.path.normpath(f), {}) for f in files]
+        shape = {(json.dumps(m.get("bin_edges")), m.get("per_decade"), m.get("token_col")) for m in metas}
+        if not self._sidecar_current(metas) or len(shape) != 1:
+            logger.warning(f"cube for {self.parquet_path} is stale, summaries fall back to raw data")
+            return None
+        first = metas[0]
+        return {
+            "source": cube.source_sql(files),
+            "bin_edges": first["bin_edges"],
+            "per_decade": first["per_decade"],
+            "token_col": first["token_col"],
+        }
+
+    def _sidecar_current(self, metas):
+        """
+        導入時從資料生成的旁路檔（cube、異常行）是否與目前資料一致：
+        分區資料集要求每個有行的批次各有一份，單檔要求記錄的資料檔大小/修改時間未變。
+        """
+        if dataset.is_dataset_dir(self.parquet_path):
+            batches = {b["batch"] for b in (self._manifest or {}).get("batches", []) if b.get("rows")}
+            return {m.get("batch") for m in metas} == batches
+        return metas[0].get("source_signature") == list(self._dataset_signature(self.parquet_path) or ())
+
+    def anomaly_source(self):
+        """
+        只含異常行（anomaly_flags 非 0）的 FROM 來源，欄位與 TABLE_NAME 相同；
+        沒有旁路檔或旁路檔過期時返回 None，呼叫方在全量資料上按旗標過濾。
+        """
+        self.refresh()
+        if self._anomalies is None:
+            files = anomaly.anomaly_files(self.parquet_path)
+            metas = cube.read_meta(self.cursor(), files) if files else {}
+            current = bool(files) and self._sidecar_current([metas.get(os.path.normpath(f), {}) for f in files])
+            if files and not current:
+                logger.warning(f"anomaly rows for {self.parquet_path} are stale, anomaly queries fall back to full scans")
+            self._anomalies = anomaly.source_sql(files) if current else False
+        return self._anomalies or None
+
+    def has_anomaly_flags(self):
+        """資料是否帶導入時算好的 anomaly_flags（舊資料沒有，abnormal_only 退回逐行條件）。"""
+        return anomaly.COLUMN in {name for name, _ in self.columns()}
+
+    def token_fragments(self, tokens):
+        """
+        token 所在的 {檔案完整路徑: {row_group_id}}；沒有可用的 token 索引時返回 None。
+        """
+        self.refresh()
+        index = self._token_index
+        if index is None:
+            return None
+        root = token_index.base_dir(self.parquet_path)
+        result = {}
+        for file, row_group, _, _ in index.fragments(tokens):
+            result.setdefault(os.path.normpath(os.path.join(root, file)), set()).add(row_group)
+        return result
+
+    def token_source(self, tokens):
+        """
+        帶 token 條件的查詢用的 FROM 來源：分區資料集有索引時只讀包含這些 token 的檔案，否則為 TABLE_NAME；
+        索引裡沒有任何一個 token 時為空來源，不掃描。
+        索引只裁剪到檔案：查詢仍需保留 token 條件，檔案內的其他 token 靠 row group 統計跳過
+        （資料按 token 排序，單檔資料集的裁剪全靠這一步）。
+        """
+        fragments = self.token_fragments(tokens) if tokens else None
+        if fragments is None:
+            return TABLE_NAME
+        if not fragments:
+            return f"(SELECT * FROM {TABLE_NAME} WHERE FALSE)"
+        if not dataset.is_dataset_dir(self.parquet_path):
+            return TABLE_NAME
+        return dataset.source_sql(self.parquet_path, sorted(fragments))
+
+    def cursor(self):
+        """返回當前線程專屬的 cursor（TracedCursor），首次呼叫時建立。"""
+        cur = getattr(self._local, "cursor", None)
+        if cur is None:
+            with self._lock:
+                raw = self._con.cursor()
+                self._cursors.append(raw)
+            if METRICS_ROWS_SCANNED:
+                # 只收集、不輸出；每個查詢結束後由 query_rows 讀取
+                raw.execute("SET enable_profiling = 'no_output'")
+            cur = TracedCursor(raw)
+            self._local.cursor = cur
+        return cur
+
+    def new_cursor(self):
+        """
+        獨立的 cursor（不綁定線程），給串流導出這類跨多個線程、長時間持有結果集的查詢用；
+        呼叫方用完自行 close。
+        """
+        with self._lock:
+            return self._con.cursor()
+
+    def execute(self, sql, params=None):
+        if params is None:
+            return self.cursor().execute(sql)
+        return self.cursor().execute(sql, params)
+
+    def columns(self):
+        """資料集欄位 [(name, type)]，快取到重新註冊資料集為止。"""
+        self.refresh()
+        if self._columns is None:
+            rows = self.cursor().execute(f"DESCRIBE {TABLE_NAME}").fetchall()
+            self._columns = [(r[0], r[1]) for r in rows]
+        return self._columns
+
+    def row_group_stats(self):
+        """
+        返回資料集每個 row group 的行數及各欄位 min/max 統計（parquet_metadata），
+        只讀 footer，結果快取到重新註冊資料集為止。
+        """
+        self.refresh()
+        if self._row_group_stats is None:
+            self._row_group_stats = self.cursor().execute(f"""
+                SELECT file_name, row_group_id, row_group_num_rows, path_in_schema,
+                       stats_min_value, stats_max_value
+                FROM parquet_metadata('{dataset.files_glob(self.parquet_path)}')
+            """).df()
+        return self._row_group_stats
+
+    def close(self):
+        with self._lock:
+            for cur in self._cursors:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+            self._cursors = []
+            self._con.close()
+            if self._token_index is not None:
+                self._token_index.close()
+                self._token_index = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """取得進程級引擎（惰性初始化，線程安全）。"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine()
+    return _engine
+
+
+def close_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
@@ -0,0 +1,344 @@
+# backend/executor.py
+# 查詢執行層：重查詢不再佔用 FastAPI 的預設線程池，而是送進有界的查詢線程池。
+# 每個端點有自己的並發上限與排隊上限（准入控制），排隊過長直接返回 503；
+# 執行超時或客戶端斷線時中斷該線程正在跑的 DuckDB 查詢，該任務之後的語句也不再執行；健康檢查等輕量端點不受重查詢影響。
+# 各端點並發上限之和大於線程數（超額訂閱）：滿載時各端點共用 QUERY_WORKERS 個線程，
+# 拿到名額但沒拿到線程的查詢在線程池佇列裡等，這段時間計入 QUERY_TIMEOUT。
+# 串流輸出（見 export.py）佔一個名額直到輸出結束，但只在取下一塊時才佔用線程。
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from config import QUERY_LIMITS, QUERY_QUEUE_TIMEOUT, QUERY_TIMEOUT, QUERY_WORKERS
+from engine import get_engine
+from metrics import add_stage
+
+logger = logging.getLogger(__name__)
+
+# 檢查客戶端是否斷線的間隔（秒）
+DISCONNECT_POLL = 0.2
+# 取消時語句可能還沒真正開始（interrupt 落空），每隔這麼久重發一次，直到語句結束
+INTERRUPT_RETRY = 0.05
+
+# 當前線程正在執行的 QueryTask（見 current_task）
+_current = threading.local()
+
+
+class QueryRejected(Exception):
+    """排隊已滿或排隊超時。"""
+
+
+class QueryTimeout(Exception):
+    """執行超過時限，查詢已被中斷。"""
+
+
+class QueryCancelled(Exception):
+    """客戶端已斷線，查詢已被中斷。"""
+
+
+class QueryTask:
+    """
+    一次提交到線程池的查詢；記下執行它的線程的 cursor，取消時用來中斷 DuckDB，
+    並把自己掛在 cursor 上，取消後 cursor 不再執行新的語句（見 engine.TracedCursor）。
+    queued 為開始排隊的時間，線程真正開始執行時把排隊耗時計入請求的 queue 階段。
+    """
+
+    def __init__(self, fn, queued=None):
+        self.fn = fn
+        self.queued = queued
+        self.lock = threading.Lock()
+        self.cursor = None
+        self.cancelled = False
+        self.executing = False
+
+    def run(self):
+        if self.queued is not None:
+            add_stage("queue", time.perf_counter() - self.queued)
+        with self.lock:
+            if self.cancelled:
+                # 還沒開始就被取消（排在線程池佇列裡時超時或斷線）
+                raise QueryCancelled()
+            self.cursor = get_engine().cursor()
+            self.cursor.task = self
+        _current.task = self
+        try:
+            return self.fn()
+        finally:
+            _current.task = None
+            with self.lock:
+                self.cursor.task = None
+                self.cursor = None
+
+    def raise_if_cancelled(self):
+        """已取消時拋出與被中斷的語句相同的異常（等待其他計算的地方用來及早放棄）。"""
+        if self.cancelled:
+            raise duckdb.InterruptException("INTERRUPT Error: Interrupted!")
+
+    def begin_statement(self):
+        """cursor 執行每個語句前呼叫：已取消時拋出與被中斷的語句相同的異常，否則標記正在執行。"""
+        with self.lock:
+            self.raise_if_cancelled()
+            self.executing = True
+
+    def end_statement(self):
+        with self.lock:
+            self.executing = False
+
+    def cancel(self):
+        """
+        標記取消並中斷正在執行的 DuckDB 查詢；之後的語句在 cursor 上直接失敗，結果被丟棄。
+        語句標記為執行中、但 DuckDB 還沒開始跑時 interrupt 會落空，因此在背景線程裡重發到語句結束為止。
+        """
+        with self.lock:
+            self.cancelled = True
+            if not self.executing:
+                return
+        threading.Thread(target=self._interrupt_until_idle, name="query-interrupt", daemon=True).start()
+
+    def _interrupt_until_idle(self):
+        while True:
+            with self.lock:
+                if not self.executing or self.cursor is None:
+                    return
+                self.cursor.interrupt()
+            time.sleep(INTERRUPT_RETRY)
+
+
+def current_task():
+    """當前線程正在執行的 QueryTask；不在查詢線程池裡（如背景預取）時為 None。"""
+    return getattr(_current, "task", None)
+
+
+class EndpointLimit:
+    """單個端點的准入控制：最多 concurrency 個查詢同時執行，最多 max_queue 個排隊。"""
+
+    def __init__(self, concurrency, max_queue):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    async def acquire(self, timeout):
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueryRejected("queue full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QueryRejected("queue timeout")
+        finally:
+            self.waiting -= 1
+        self.running += 1
+
+    def release(self):
+        self.running -= 1
+        self.semaphore.release()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+        }
+
+
+async def wait_disconnect(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL)
+
+
+class QueryExecutor:
+    """有界查詢線程池 + 各端點的 EndpointLimit；limits 為 {端點: (並發上限, 排隊上限)}。"""
+
+    def __init__(self, workers=QUERY_WORKERS, limits=QUERY_LIMITS,
+                 timeout=QUERY_TIMEOUT, queue_timeout=QUERY_QUEUE_TIMEOUT):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.limits_config = dict(limits)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.limits = {}
+
+    def limit(self, endpoint):
+        # 在事件循環線程上惰性建立（asyncio.Semaphore 綁定到使用它的事件循環）
+        if endpoint not in self.limits:
+            concurrency, max_queue = self.limits_config.get(endpoint, self.limits_config["default"])
+            self.limits[endpoint] = EndpointLimit(concurrency, max_queue)
+        return self.limits[endpoint]
+
+    async def run(self, endpoint, fn, request=None):
+        """
+        在查詢線程池中執行 fn() 並返回其結果。
+        名額要等線程真正結束才釋放，被中斷但還在收尾的查詢仍計入並發上限。
+        fn 在當前 context 的副本中執行，請求的計時（metrics.py）跟著進入查詢線程。
+        """
+        limit = self.limit(endpoint)
+        queued = time.perf_counter()
+        await limit.acquire(self.queue_timeout)
+        task = QueryTask(fn, queued)
+        future = asyncio.get_running_loop().run_in_executor(self.pool, contextvars.copy_context().run, task.run)
+        future.add_done_callback(lambda _: limit.release())
+        watcher = asyncio.ensure_future(wait_disconnect(request)) if request is not None else None
+        try:
+            waits = {future} if watcher is None else {future, watcher}
+            done, _ = await asyncio.wait(waits, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if future in done:
+                return future.result()
+            task.cancel()
+            # 結果不再需要，避免 "exception was never retrieved" 警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            if watcher is not None and watcher in done:
+                limit.cancelled += 1
+                raise QueryCancelled()
+            limit.timeouts += 1
+            raise QueryTimeout()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    async def stream(self, endpoint, chunks):
+        """
+        chunks 為同步的分塊迭代器，另有 open()（執行查詢）/cancel()（中斷）/close()（釋放 cursor），見 export.ExportStream。
+        佔名額並在線程池中 open，成功後返回逐塊產出的 async 迭代器（給 StreamingResponse）；
+        排隊被拒、open 出錯或超時在這裡直接拋出，調用方仍可返回錯誤狀態碼。
+        """
+        limit = self.limit(endpoint)
+        queued = time.perf_counter()
+        await limit.acquire(self.queue_timeout)
+        add_stage("queue", time.perf_counter() - queued)
+        future = None
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.pool, chunks.open)
+            await self._wait(limit, chunks, future)
+        except BaseException:
+            self._release_after(limit, chunks, future)
+            raise
+        return self._iterate(limit, chunks)
+
+    async def _iterate(self, limit, chunks):
+        # 每塊送出（客戶端收下）後才取下一塊，形成背壓；客戶端斷線時 Starlette 取消串流，
+        # 正在取的那一塊被中斷。中途出錯或超時向上拋出，連接被中斷，客戶端不會把截斷的輸出當成完整結果。
+        loop = asyncio.get_running_loop()
+        future = None
+        try:
+            while True:
+                future = loop.run_in_executor(self.pool, next, chunks, None)
+                chunk = await self._wait(limit, chunks, future)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._release_after(limit, chunks, future)
+
+    async def _wait(self, limit, chunks, future):
+        """等線程池中的一步完成；超時或被取消時中斷查詢（線程仍會跑完這一步）。"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            limit.timeouts += 1
+            chunks.cancel()
+            raise QueryTimeout()
+        except asyncio.CancelledError:
+            limit.cancelled += 1
+            chunks.cancel()
+            raise
+
+    @staticmethod
+    def _release_after(limit, chunks, future):
+        """等線程裡的那一步真正結束後再關閉 cursor、釋放名額。"""
+        def finish(_=None):
+            if future is not None and not future.cancelled():
+                future.exception()  # 已不需要結果，取走異常避免 "never retrieved" 警告
+            chunks.close()
+            limit.release()
+        if future is None or future.done():
+            finish()
+        else:
+            future.add_done_callback(finish)
+
+    def busy(self):
+        """正在執行或排隊的前台查詢數（背景預取據此讓路，可在任意線程呼叫）。"""
+        return sum(limit.running + limit.waiting for limit in list(self.limits.values()))
+
+    def stats(self):
+        return {endpoint: limit.stats() for endpoint, limit in self.limits.items()}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """取得進程級查詢執行器（惰性初始化，線程安全）。"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = QueryExecutor()
+    return _executor
+
+
+def close_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def error_response(endpoint, error):
+    """執行層異常對應的錯誤響應；不是執行層異常時返回 None。"""
+    if isinstance(error, QueryRejected):
+        logger.warning(f"/api/{endpoint} rejected: {error}")
+        return JSONResponse(content={"error": f"服务繁忙（{error}），请稍后重试"}, status_code=503)
+    if isinstance(error, QueryTimeout):
+        logger.warning(f"/api/{endpoint} timed out after {get_executor().timeout}s")
+        return JSONResponse(content={"error": "查询超时"}, status_code=504)
+    if isinstance(error, QueryCancelled):
+        logger.info(f"/api/{endpoint} cancelled: client disconnected")
+        return JSONResponse(content={"error": "客户端已断开"}, status_code=499)
+    return None
+
+
+def bounded(endpoint):
+    """
+    把同步的查詢端點包成 async 端點，在查詢線程池中執行。
+    簽名保留原參數並追加 request（用於偵測斷線），FastAPI 的參數解析不受影響。
+    """
+    def decorate(fn):
+        sig = inspect.signature(fn)
+        params = list(sig.parameters.values())
+        params.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        @functools.wraps(fn)
+        async def wrapper(*args, request: Request, **kwargs):
+            try:
+                return await get_executor().run(endpoint, functools.partial(fn, *args, **kwargs), request)
+            except (QueryRejected, QueryTimeout, QueryCancelled) as e:
+                return error_response(endpoint, e)
+
+        wrapper.__signature__ = sig.replace(parameters=params)
+        return wrapper
+    return decorate
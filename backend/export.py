@@ -0,0 +1,90 @@
+# backend/export.py
+# 串流導出：整個過濾結果按 DuckDB record batch 分塊取出、逐塊編碼輸出（NDJSON / CSV / Arrow IPC stream），
+# 任何時刻只持有一個 batch，記憶體佔用與導出總行數無關。執行與背壓由 executor.QueryExecutor.stream 負責。
+
+import io
+import threading
+
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+
+from config import EXPORT_BATCH_ROWS
+from engine import get_engine
+
+# 格式: (Content-Type, 副檔名)
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+class ExportStream:
+    """
+    一次導出。build_sql() 返回要導出的查詢（ndjson 格式時只有一個已編碼好的 JSON 字串欄位）；
+    open() 在查詢線程中執行，之後每次 next() 取一個 batch 並編碼成 bytes。
+    用專屬 cursor（Engine.new_cursor），前後各批可以在不同線程上取。
+    """
+
+    def __init__(self, build_sql, fmt, batch_rows=EXPORT_BATCH_ROWS):
+        self.build_sql = build_sql
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.lock = threading.Lock()
+        self.cursor = None
+        self.reader = None
+        self.sink = io.BytesIO()
+        self.writer = None
+        self.done = False
+
+    def open(self):
+        sql = self.build_sql()
+        with self.lock:
+            self.cursor = get_engine().new_cursor()
+        self.reader = self.cursor.execute(sql).fetch_record_batch(self.batch_rows)
+        # CSV 表頭、Arrow schema 在第一塊就輸出，結果為空時客戶端也能拿到欄位
+        if self.fmt == "csv":
+            self.writer = pa_csv.CSVWriter(self.sink, self.reader.schema)
+        elif self.fmt == "arrow":
+            self.writer = pa_ipc.new_stream(self.sink, self.reader.schema)
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        try:
+            batch = self.reader.read_next_batch()
+        except StopIteration:
+            self.done = True
+            if self.writer is not None:
+                self.writer.close()  # Arrow stream 的結束標記
+            tail = self.take()
+            if tail:
+                return tail
+            raise
+        if self.fmt == "ndjson":
+            lines = batch.column(0).to_pylist()
+            return ("\n".join(lines) + "\n").encode("utf-8") if lines else self.take()
+        self.writer.write_batch(batch)
+        return self.take()
+
+    def take(self):
+        """取出 sink 中已編碼的位元組並清空。"""
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def cancel(self):
+        with self.lock:
+            if self.cursor is not None:
+                self.cursor.interrupt()
+
+    def close(self):
+        with self.lock:
+            if self.cursor is not None:
+                self.cursor.close()
+                self.cursor = None
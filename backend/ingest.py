@@ -0,0 +1,302 @@
+# backend/ingest.py
+# 流式導入：無表頭 SlotTest.csv → 排序、壓縮後的 parquet。
+# 取代 auto_add_header.py + preprocess_parquet.py 兩步（後者會把整個 CSV 讀進 pandas）。
+# DuckDB 按塊讀 CSV，排序超出 memory_limit 時溢寫到臨時目錄，記憶體佔用有上界。
+#
+# 用法（在 backend 目錄下）：
+#   python ingest.py ../SlotTest.csv
+#   python ingest.py ../SlotTest_with_header.csv --header -o ../SlotTest_with_header.parquet
+#   python ingest.py ../SlotTest_0419.csv --dataset ../dataset   # 追加到 hive 分區資料集
+#   python ingest.py --reindex ../dataset                        # 重建 token 索引
+# 每次導入同時建立/追加 token → row group 的 sidecar 索引（見 token_index.py），
+# 並為 token / 錢包地址分配整數 ID（token_id / wallet_id，字典見 dictionary.py），
+# 最後從寫好的資料聚合出摘要用的 cube（見 cube.py），並把帶異常旗標的行另存一份（見 anomaly.py）。
+
+import argparse
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+
+import duckdb
+
+import anomaly
+import cube
+import dataset
+import dictionary
+import token_index
+from config import (
+    DATASET_PARTITION_BY,
+    DATASET_PATH,
+    DUCKDB_THREADS,
+    INGEST_COMPRESSION,
+    INGEST_MEMORY_LIMIT,
+    INGEST_ROW_GROUP_SIZE,
+    INGEST_TEMP_DIR,
+    PARQUET_PATH,
+    PRICE_BINS,
+)
+from schema import RAW_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# 輸出檔的排序鍵：同一 token 的資料集中在少數 row group，token_id 與時間範圍過濾都能靠 min/max 裁剪
+SORT_KEYS = ["token_id", "trade_timestamp", "transaction_slot", "transaction_signature"]
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def price_bin_expr(col, edges=PRICE_BINS):
+    """價格所在區間編號（與 main.bin_case_expr 語意一致），NULL/NaN/負數為 NULL。"""
+    whens = []
+    for idx in range(len(edges) - 1):
+        if idx + 1 == len(edges) - 1:
+            whens.append(f"WHEN {col} >= {edges[idx]} THEN {idx}")
+        else:
+            whens.append(f"WHEN {col} >= {edges[idx]} AND {col} < {edges[idx+1]} THEN {idx}")
+    return f"CAST(CASE WHEN isnan({col}) THEN NULL {' '.join(whens)} END AS TINYINT)"
+
+
+def derived_columns(edges=PRICE_BINS):
+    """導入時預先計算的衍生欄位（name, SQL 表達式）。原始價格以 SOL 計價。"""
+    return [
+        ("buy_price_sol", "buy_price"),
+        ("sell_price_sol", "sell_price"),
+        ("trade_datetime", "make_timestamp(trade_timestamp * 1000)"),
+        ("trade_date", "CAST(make_timestamp(trade_timestamp * 1000) AS DATE)"),
+        ("buy_price_bin", price_bin_expr("buy_price", edges)),
+        ("sell_price_bin", price_bin_expr("sell_price", edges)),
+        (anomaly.COLUMN, anomaly.flags_expr()),
+    ]
+
+
+def new_batch_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def read_csv_sql(csv_path, header=False):
+    """明確指定 68 欄的名稱與類型，關閉自動偵測，避免抽樣推斷出錯或逐列猜類型。"""
+    columns = ", ".join(f"{sql_string(name)}: {sql_string(dtype)}" for name, dtype in RAW_COLUMNS)
+    return (
+        f"read_csv({sql_string(csv_path)}, columns={{{columns}}}, header={'true' if header else 'false'}, "
+        f"auto_detect=false, delim=',', quote='\"', escape='\"', nullstr='')"
+    )
+
+
+def select_sql(source_sql, dataset_path, edges=PRICE_BINS):
+    """原始欄位 + 衍生欄位 + 從 dataset_path 的字典接上的 ID 欄位。"""
+    raw = ", ".join(f"src.{name}" for name, _ in RAW_COLUMNS)
+    derived = ", ".join(f"{expr} AS {name}" for name, expr in derived_columns(edges))
+    ids, joins = dictionary.encoded_select("src", dataset_path)
+    return f"SELECT {raw}, {derived}, {ids} FROM {source_sql} src {joins}"
+
+
+def connect(memory_limit=INGEST_MEMORY_LIMIT, threads=DUCKDB_THREADS, temp_dir=INGEST_TEMP_DIR):
+    config = {}
+    if threads:
+        config["threads"] = int(threads)
+    if memory_limit:
+        config["memory_limit"] = str(memory_limit)
+    con = duckdb.connect(database=":memory:", config=config)
+    if temp_dir:
+        os.makedirs(temp_dir, exist_ok=True)
+        con.execute(f"SET temp_directory = {sql_string(temp_dir)}")
+    # 不要求保持輸入順序，讓讀取/轉換按塊並行流式執行
+    con.execute("SET preserve_insertion_order = false")
+    con.execute("SET TimeZone = 'UTC'")
+    return con
+
+
+def ingest_csv(csv_path, parquet_path=PARQUET_PATH, header=False,
+               row_group_size=INGEST_ROW_GROUP_SIZE, compression=INGEST_COMPRESSION,
+               memory_limit=INGEST_MEMORY_LIMIT, temp_dir=INGEST_TEMP_DIR):
+    """
+    把 CSV 轉為按 SORT_KEYS 排序的 parquet，先寫臨時檔再原子替換，
+    避免服務正在讀的檔案被寫到一半。返回寫入行數。
+    """
+    start = time.time()
+    con = connect(memory_limit=memory_limit, temp_dir=temp_dir)
+    tmp_path = f"{parquet_path}.tmp"
+    try:
+        source = read_csv_sql(csv_path, header)
+        dictionary.extend_all(con, parquet_path, source, new_batch_id())
+        sql = (
+            f"COPY ({select_sql(source, parquet_path)} ORDER BY {', '.join(SORT_KEYS)}) "
+            f"TO {sql_string(tmp_path)} "
+            f"(FORMAT parquet, COMPRESSION {compression}, ROW_GROUP_SIZE {int(row_group_size)})"
+        )
+        logger.info(f"[ingest] {csv_path} -> {parquet_path}")
+        rows = con.execute(sql).fetchone()[0]
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        con.close()
+    os.replace(tmp_path, parquet_path)
+    reindex(parquet_path, memory_limit=memory_limit, temp_dir=temp_dir)
+    con = connect(memory_limit=memory_limit, temp_dir=temp_dir)
+    try:
+        signature = {"source_signature": list(token_index.file_signature(parquet_path))}
+        cube.build(con, f"read_parquet({sql_string(parquet_path)})", cube.cube_path(parquet_path), "token_id", PRICE_BINS,
+                   signature)
+        anomaly.build(con, f"read_parquet({sql_string(parquet_path)})", anomaly.anomaly_path(parquet_path), SORT_KEYS,
+                      signature)
+    finally:
+        con.close()
+    logger.info(f"[ingest] wrote {rows} rows in {time.time() - start:.1f}s")
+    return rows
+
+
+def reindex(path, files=None, memory_limit=INGEST_MEMORY_LIMIT, temp_dir=INGEST_TEMP_DIR):
+    """重建（files 為 None）或追加資料集的 token 索引。"""
+    con = connect(memory_limit=memory_limit, temp_dir=temp_dir)
+    try:
+        return token_index.build_index(con, path, files)
+    finally:
+        con.close()
+
+
+def source_info(csv_path):
+    st = os.stat(csv_path)
+    return {"path": os.path.abspath(csv_path), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def check_columns(con, dataset_path, manifest, select):
+    """
+    新一批的欄位須與資料集已有的檔案相同：DuckDB 以第一個檔案的 schema 讀整個資料集，
+    欄位不一致（例如舊版導入的資料）時整個資料集都讀不了。不一致時拋出 ValueError。
+    """
+    existing = next((f for b in reversed(manifest["batches"]) for f in b["files"]), None)
+    if existing is None:
+        return
+    path = os.path.join(dataset_path, existing)
+    partition = set(manifest["partition_by"])
+    have = {d[0] for d in con.execute(f"SELECT * FROM read_parquet({sql_string(path)}) LIMIT 0").description} - partition
+    want = {d[0] for d in con.execute(f"SELECT * FROM ({select}) LIMIT 0").description} - partition
+    if have != want:
+        raise ValueError(
+            f"資料集欄位與本次導入不一致（缺少 {sorted(want - have)}，多出 {sorted(have - want)}），"
+            f"請用新版 ingest.py 重新導入整個資料集"
+        )
+
+
+def move_tree(src, dst):
+    """把 src 下的檔案按相對路徑移到 dst，返回相對路徑列表（同一檔案系統內為 rename）。"""
+    moved = []
+    for root, _, files in os.walk(src):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), src)
+            target = os.path.join(dst, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(root, name), target)
+            moved.append(rel.replace(os.sep, "/"))
+    return sorted(moved)
+
+
+def append_csv(csv_path, dataset_path=DATASET_PATH, header=False, partition_by=None,
+               row_group_size=INGEST_ROW_GROUP_SIZE, compression=INGEST_COMPRESSION,
+               memory_limit=INGEST_MEMORY_LIMIT, temp_dir=INGEST_TEMP_DIR, force=False):
+    """
+    把一份 CSV 作為新的一批追加到 hive 分區資料集，已有分區的檔案不動。
+    先寫到資料集旁的暫存目錄，全部寫完再移入並更新清單；清單更新後服務端才會重新註冊資料集。
+    同一來源檔（路徑+大小+修改時間）已導入過時跳過，force=True 時照樣追加。返回寫入行數。
+    """
+    manifest = dataset.read_manifest(dataset_path)
+    if manifest is None:
+        manifest = {"partition_by": list(partition_by or DATASET_PARTITION_BY), "bin_edges": list(PRICE_BINS), "batches": []}
+    elif partition_by and list(partition_by) != manifest["partition_by"]:
+        raise ValueError(f"資料集已按 {manifest['partition_by']} 分區，不能改用 {list(partition_by)}")
+    unknown = [col for col in manifest["partition_by"] if col not in dataset.PARTITION_TYPES]
+    if unknown:
+        raise ValueError(f"不支援的分區欄位: {unknown}")
+    source = source_info(csv_path)
+    if not force and any(b.get("source") == source for b in manifest["batches"]):
+        logger.info(f"[ingest] {csv_path} already ingested, skipped")
+        return 0
+
+    start = time.time()
+    batch = new_batch_id()
+    staging = f"{os.path.normpath(dataset_path)}.staging-{batch}"
+    os.makedirs(dataset_path, exist_ok=True)
+    con = connect(memory_limit=memory_limit, temp_dir=temp_dir)
+    try:
+        csv_sql = read_csv_sql(csv_path, header)
+        dictionary.extend_all(con, dataset_path, csv_sql, batch)
+        select = select_sql(csv_sql, dataset_path, manifest['bin_edges'])
+        check_columns(con, dataset_path, manifest, select)
+        sql = (
+            f"COPY ({select} ORDER BY {', '.join(SORT_KEYS)}) "
+            f"TO {sql_string(staging)} "
+            f"(FORMAT parquet, PARTITION_BY ({', '.join(manifest['partition_by'])}), "
+            f"FILENAME_PATTERN {sql_string('part-' + batch + '_{i}')}, "
+            f"COMPRESSION {compression}, ROW_GROUP_SIZE {int(row_group_size)})"
+        )
+        logger.info(f"[ingest] {csv_path} -> {dataset_path} (batch {batch})")
+        rows = con.execute(sql).fetchone()[0]
+        files = move_tree(staging, dataset_path)
+        # 索引、cube 與異常旁路檔先於清單更新，服務端重新註冊時看到的已包含新檔案
+        token_index.build_index(con, dataset_path, files)
+        if rows:
+            os.makedirs(cube.cube_path(dataset_path), exist_ok=True)
+            full = [os.path.join(dataset_path, f) for f in files]
+            cube.build(con, dataset.source_sql(dataset_path, full),
+                       os.path.join(cube.cube_path(dataset_path), batch + cube.CUBE_SUFFIX),
+                       "token_id", manifest["bin_edges"], {"batch": batch})
+            os.makedirs(anomaly.anomaly_path(dataset_path), exist_ok=True)
+            anomaly.build(con, dataset.source_sql(dataset_path, full),
+                          os.path.join(anomaly.anomaly_path(dataset_path), batch + anomaly.ANOMALY_SUFFIX),
+                          SORT_KEYS, {"batch": batch})
+    finally:
+        con.close()
+        shutil.rmtree(staging, ignore_errors=True)
+    manifest["batches"].append({
+        "batch": batch,
+        "source": source,
+        "rows": rows,
+        "files": files,
+        "ingested_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    })
+    dataset.write_manifest(dataset_path, manifest)
+    logger.info(f"[ingest] appended {rows} rows in {len(files)} files in {time.time() - start:.1f}s")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SlotTest CSV → 排序壓縮的 parquet（流式、記憶體有上界）")
+    parser.add_argument("csv", nargs="?", help="輸入 CSV 路徑（預設無表頭）")
+    parser.add_argument("-o", "--output", default=PARQUET_PATH, help="輸出 parquet 路徑")
+    parser.add_argument("--dataset", nargs="?", const=DATASET_PATH, default=None,
+                        help=f"追加到 hive 分區資料集目錄（不帶值時為 {DATASET_PATH}），而不是寫單一 parquet")
+    parser.add_argument("--partition-by", default=None,
+                        help=f"新建資料集的分區欄位，逗號分隔（預設 {','.join(DATASET_PARTITION_BY)}）")
+    parser.add_argument("--force", action="store_true", help="來源檔已導入過也照樣追加")
+    parser.add_argument("--reindex", metavar="PATH", default=None, help="只重建 parquet 檔或資料集目錄的 token 索引")
+    parser.add_argument("--header", action="store_true", help="CSV 第一行是表頭（如 SlotTest_with_header.csv）")
+    parser.add_argument("--row-group-size", type=int, default=INGEST_ROW_GROUP_SIZE)
+    parser.add_argument("--compression", default=INGEST_COMPRESSION)
+    parser.add_argument("--memory-limit", default=INGEST_MEMORY_LIMIT)
+    parser.add_argument("--temp-dir", default=INGEST_TEMP_DIR)
+    args = parser.parse_args(argv)
+    if args.reindex:
+        reindex(args.reindex, memory_limit=args.memory_limit, temp_dir=args.temp_dir)
+        return
+    if not args.csv:
+        parser.error("需要輸入 CSV 路徑")
+    if args.dataset:
+        partition_by = [x.strip() for x in args.partition_by.split(",") if x.strip()] if args.partition_by else None
+        append_csv(args.csv, args.dataset, header=args.header, partition_by=partition_by,
+                   row_group_size=args.row_group_size, compression=args.compression,
+                   memory_limit=args.memory_limit, temp_dir=args.temp_dir, force=args.force)
+        return
+    ingest_csv(args.csv, args.output, header=args.header, row_group_size=args.row_group_size,
+               compression=args.compression, memory_limit=args.memory_limit, temp_dir=args.temp_dir)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    main()
@@ -1,57 +1,39 @@
-from fastapi import FastAPI, Query
+from fastapi import Depends, FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
-import duckdb
 import pandas as pd
-from config import CSV_PATH, DEFAULT_SOL_PRICE, PARQUET_PATH
-import time
+from config import DEFAULT_SOL_PRICE, PREFETCH_PAGES, PRICE_BINS, SKETCH_QUANTILES, WARMUP_VIEW
+import os
 import numpy as np
 import logging
-from fastapi.responses import JSONResponse
-from fastapi import Request
-import datetime
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi import Header, Request
+import base64
+import json
 from birdeye_api import batch_birdeye_prices
-from solana_api import get_slot_timestamps
+from solana_api import get_resolver
+import anomaly
+import cube
+import dataset
+import sketch
+from engine import TABLE_NAME, close_engine, get_engine
+from metrics import end_trace, get_metrics, log_record, render_prometheus, stage, start_trace
+from executor import QueryCancelled, QueryRejected, QueryTimeout, bounded, close_executor, error_response, get_executor
+from export import FORMATS as EXPORT_FORMATS, ExportStream
+from prefetch import close_prefetcher, get_prefetcher
+from price_bins import BinSpec, bin_bounds, bin_index_expr, bin_label, bin_spec, check_bin, resolve_edges, sql_number
+from result_cache import get_cache, make_key
+from schema import ABNORMAL_CONDITION
+from sampling import new_seed, sample_sql as build_sample_sql, stratified_sample_sql
+from serialize import (
+    ArrowResponse, FastJSONResponse, RawJSON, arrow_ipc, dumps_json, json_columns_expr, json_struct_expr,
+    negotiate_layout, safe_json, scrubbed_select,
+)
 
 # 日志配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
-# 共用函式
-def to_gmt8(ts):
-    try:
-        ts = float(ts)
-        # 自動判斷單位：10位數為秒，13位數為毫秒
-        if ts < 1e10:  # 秒
-            dt = datetime.datetime.utcfromtimestamp(ts) + datetime.timedelta(hours=8)
-        else:  # 毫秒
-            dt = datetime.datetime.utcfromtimestamp(ts / 1000) + datetime.timedelta(hours=8)
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-    except Exception:
-        return None
-
-def to_gmt0(ts):
-    try:
-        ts = float(ts)
-        if ts < 1e10:
-            dt = datetime.datetime.utcfromtimestamp(ts)
-        else:
-            dt = datetime.datetime.utcfromtimestamp(ts / 1000)
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-    except Exception:
-        return None
-
-_cache = {}
-
-def cache_with_expiry(key, value, ttl=300):
-    _cache[key] = (value, time.time() + ttl)
-
-def get_cache(key):
-    v = _cache.get(key)
-    if v and v[1] > time.time():
-        return v[0]
-    return None
-
 app = FastAPI()
 
 # 允许跨域，方便前端本地开发调试
@@ -63,152 +45,250 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
+@app.on_event("startup")
+def startup_engine():
+    # 啟動時建立共享 DuckDB 引擎並註冊資料集，失敗時留待首次請求重試
     try:
-        response = await call_next(request)
-        logger.info(f"Response status: {response.status_code}")
-        return response
+        get_engine()
     except Exception as e:
-        logger.error(f"Unhandled error: {e}", exc_info=True)
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        logger.error(f"engine init failed: {e}", exc_info=True)
+        return
+    warm_up()
+
+@app.on_event("shutdown")
+def shutdown_engine():
+    close_prefetcher()
+    close_executor()
+    close_engine()
+
+class RequestLogMiddleware:
+    """
+    請求/響應日誌、分段計時與未處理異常兜底。寫成純 ASGI 中介層而不是 @app.middleware("http")：
+    BaseHTTPMiddleware 會攔住 receive，下游的 request.is_disconnected() 永遠看不到斷線，查詢無法及時取消。
+    每個請求建立一個 RequestTrace（metrics.py），響應頭帶 Server-Timing，結束時寫一行結構化日誌並計入 /metrics。
+    帶 profile=1 時不讀結果快取，JSON 響應末尾追加 profile 欄位（各查詢的耗時、行數與 EXPLAIN ANALYZE 計劃）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        logger.info(f"Request: {scope['method']} {request.url}")
+        trace, token = start_trace(profile=request.query_params.get("profile") == "1")
+        status = None
+        held = None
+        body = []
+
+        async def send_with_timing(message):
+            nonlocal status, held
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(k, v) for k, v in message.get("headers", []) if not (trace.profile and k == b"content-length")]
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+                if trace.profile and dict(message["headers"]).get(b"content-type", b"").startswith(b"application/json"):
+                    # 等整個 body 到齊後再追加 profile
+                    held = message
+                    return
+            elif message["type"] == "http.response.body" and held is not None:
+                body.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                content = attach_profile(b"".join(body), trace)
+                held["headers"].append((b"content-length", str(len(content)).encode("latin-1")))
+                await send(held)
+                message = {"type": "http.response.body", "body": content}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            logger.error(f"Unhandled error: {e}", exc_info=True)
+            if status is None:
+                status = 500
+                await JSONResponse(content={"error": str(e)}, status_code=500)(scope, receive, send)
+        finally:
+            end_trace(token)
+            elapsed = trace.elapsed()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            logger.info(log_record(scope["method"], scope["path"], endpoint, status, elapsed, trace))
+            if trace.profile and held is None and trace.plans:
+                # 非 JSON 響應（arrow、導出）無法內嵌，計劃只寫日誌
+                logger.info("profile " + dumps_json(profile_record(trace)))
+            get_metrics().observe(endpoint, status, elapsed, trace)
+
+def profile_record(trace):
+    """profile=1 的輸出：各階段耗時、各查詢的 SQL/耗時/行數，以及 EXPLAIN ANALYZE 計劃。"""
+    plans = {p["sql"]: p for p in trace.plans}
+    queries = []
+    for q in trace.queries:
+        plan = plans.get(q["sql"], {})
+        queries.append({**q, **{k: v for k, v in plan.items() if k != "sql"}})
+    return {**trace.summary(), "queries": queries}
+
+def attach_profile(content, trace):
+    """在 JSON 物件響應末尾追加 "profile" 欄位（不重新解析原 body）；不是 JSON 物件時原樣返回。"""
+    stripped = content.rstrip()
+    if not stripped.startswith(b"{") or not stripped.endswith(b"}"):
+        return content
+    separator = b"," if stripped[:-1].strip() != b"{" else b""
+    return stripped[:-1] + separator + b'"profile":' + dumps_json(profile_record(trace)).encode("utf-8") + b"}"
+
+app.add_middleware(RequestLogMiddleware)
 
 @app.get("/api/random_sample")
+@bounded("random_sample")
 def random_sample(
     rows: int = Query(100, gt=0, le=10000),
     tokens: int = Query(10, gt=0, le=1000),
     sol_price: float = Query(DEFAULT_SOL_PRICE, gt=0),
     token_list: Optional[str] = Query(None),
-    price_type: str = Query(None, regex="^(buy_price|sell_price)$"),
+    price_type: str = Query(None, pattern="^(buy_price|sell_price)$"),
     price_bin: Optional[int] = Query(None),
-    price_unit: str = Query("SOL", regex="^(SOL|USD)$")
+    price_unit: str = Query("SOL", pattern="^(SOL|USD)$"),
+    fields: Optional[str] = Query(None),
+    seed: Optional[int] = Query(None, ge=0),
+    method: str = Query("reservoir", pattern="^(reservoir|block)$"),
+    stratify: bool = Query(False),
+    weighted: bool = Query(False),
+    format: Optional[str] = Query(None, pattern="^(rows|columns|arrow)$"),
+    approx_stats: bool = Query(False),
+    spec: BinSpec = Depends(bin_spec),
+    accept: Optional[str] = Header(None)
 ):
+    """
+    隨機抽樣（二級篩選）：
+    - method=reservoir（默认）: 单次扫描的蓄水池抽样；method=block: 先按数据块抽样再截取，读的数据更少但样本按块聚集
+    - stratify=true: 先抽 tokens 个不同 token，再在这些 token 内抽 rows 条；weighted=true 时按成交笔数加权选 token
+    - seed: 随机种子，相同 seed + 条件可重现同一批样本；不传时随机生成并在响应中返回
+    - format: 明细布局 rows（默认）| columns | arrow，同 filter_data
+    - approx_stats: 样本 summary 另含近似分位数与不同 token/钱包数，同 filter_data
+    - edges/log_buckets: price_bin 所用的区间，同 filter_data
+    """
     try:
-        con = duckdb.connect()
+        try:
+            field_list = resolve_fields(fields)
+            bins = resolve_edges(spec)
+            check_bin(price_bin, bins)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        layout = negotiate_layout(format, accept)
+        con = get_engine().cursor()
         # 構建 where 條件
         where_clauses = []
         if price_type:
             where_clauses.append(f"{price_type}_sol IS NOT NULL")
-        if token_list:
-            token_items = [f"'{x.strip()}'" for x in token_list.split(",") if x.strip()]
-            if token_items:
-                where_clauses.append(f"token_mint_address IN ({','.join(token_items)})")
+        tokens_parsed = parse_token_list(token_list)
+        if tokens_parsed:
+            where_clauses.append(token_filter(tokens_parsed))
+        # 有 token 條件時只讀 token 索引指出的檔案
+        source = get_engine().token_source(tokens_parsed)
         if price_bin is not None:
-            bins = [0, 10, 100, 1000, 10000, 100000, 1e20]
-            low = bins[price_bin]
-            high = bins[price_bin+1] if price_bin+1 < len(bins) else 1e20
+            low, high = bin_bounds(price_bin, bins)
             if price_type:
                 price_col = price_type if price_unit == 'SOL' else f"{price_type}_sol*{sol_price}"
-                where_clauses.append(f"{price_col} >= {low}")
-                if high != 1e20:
-                    where_clauses.append(f"{price_col} < {high}")
+                where_clauses.append(f"{price_col} >= {sql_number(low)}")
+                if high is not None:
+                    where_clauses.append(f"{price_col} < {sql_number(high)}")
+                where_clauses += partition_filters(price_type, price_unit, sol_price, [(low, high)])
         where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
         logger.info(f"random_sample where_sql: {where_sql}")
         # 先查 count
-        count_sql = f"SELECT COUNT(*) AS total FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql};"
+        count_sql = f"SELECT COUNT(*) AS total FROM {source} WHERE {where_sql};"
         logger.info(f"random_sample count_sql: {count_sql}")
         total = con.execute(count_sql).fetchone()[0]
         logger.info(f"random_sample total: {total}")
         if total == 0:
             logger.warning(f"random_sample no data found for where_sql: {where_sql}")
             # 返回结构与 filter_data 保持一致
-            return {"data": [], "total": 0, "page": 1, "page_size": rows, "summary": {"count": 0, "avg": None, "min": None, "max": None}}
-        # 用 ORDER BY RANDOM() + LIMIT 取代 SAMPLE，保證能返回足夠 rows 條數據
-        sql = f"SELECT * FROM (SELECT * FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql}) ORDER BY RANDOM() LIMIT {rows};"
-        logger.info(f"random_sample sample_sql: {sql}")
-        df = con.execute(sql).df()
-        logger.info(f"random_sample sample result rows: {len(df)}")
-        # summary 統計
-        if price_type and not df.empty:
-            # 新增：同時計算 SOL 和 USD 統計
-            if price_type in ['buy_price', 'sell_price']:
-                sol_col = f"{price_type}_sol"
-                usd_col = f"{price_type}_usd"
-                # 補全 usd 欄位
-                if usd_col not in df.columns:
-                    if sol_col in df.columns:
-                        df[usd_col] = df[sol_col].astype(float) * float(sol_price)
-                summary = {
-                    "count": len(df),
-                    "avg_sol": df[sol_col].mean(),
-                    "min_sol": df[sol_col].min(),
-                    "max_sol": df[sol_col].max(),
-                    "avg_usd": df[usd_col].mean(),
-                    "min_usd": df[usd_col].min(),
-                    "max_usd": df[usd_col].max(),
-                }
-            else:
-                summary = {
-                    "count": len(df),
-                    "avg": df[price_type].mean(),
-                    "min": df[price_type].min(),
-                    "max": df[price_type].max()
-                }
+            result = {"total": 0, "page": 1, "page_size": rows, "summary": {"count": 0, "avg": None, "min": None, "max": None}}
+            if layout == "arrow":
+                return ArrowResponse(arrow_ipc(empty_detail_table(con, sol_price, field_list), result))
+            data = {name: [] for name, _ in detail_columns(field_list)} if layout == "columns" else []
+            return {"data": data, **result}
+        if seed is None:
+            seed = new_seed()
+        # 草圖要用的 token/錢包欄位不一定在投影裡，隨樣本帶上（不輸出）
+        carried = list(sketch_columns()) if approx_stats and field_list is not None else []
+        select_expr = detail_select_expr(sol_price, None if field_list is None else field_list + carried)
+        if stratify:
+            token_col = "token_id" if get_engine().dictionary_source("token_mint_address") else "token_mint_address"
+            sample_sql = stratified_sample_sql(select_expr, where_sql, rows, tokens, seed, weighted=weighted, source=source, token_col=token_col)
+        else:
+            sample_sql = build_sample_sql(select_expr, where_sql, rows, seed, method=method, total=total, source=source)
+        # 樣本的 JSON 與 summary 統計在同一個聚合裡完成
+        if price_type in ['buy_price', 'sell_price']:
+            stats_exprs = price_stats_exprs(price_type, sol_price, approx=approx_stats)
+        else:
+            stats_exprs = {"count": "COUNT(*)", **(sketch_exprs() if approx_stats else {})}
+        agg_cols = ", ".join(f"{expr} AS {name}" for name, expr in stats_exprs.items())
+        logger.info(f"random_sample sample_sql: {sample_sql}")
+        if layout == "arrow":
+            # 樣本只抽一次：取回 Arrow 後再在引擎內對它算統計、投影輸出欄位
+            sample = con.execute(sample_sql).to_arrow_table()
+            con.register("_sample", sample)
+            try:
+                rec = fetch_records(con, f"SELECT {agg_cols} FROM _sample")[0]
+                data = con.execute(f"SELECT {scrubbed_select(detail_columns(field_list))} FROM _sample").to_arrow_table()
+            finally:
+                con.unregister("_sample")
         else:
-            summary = {"count": len(df), "avg": None, "min": None, "max": None}
-        # 補全欄位（solscan_link, gmgn_link, 時間欄位）
-        def safe_json(obj):
-            if isinstance(obj, dict):
-                return {k: safe_json(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [safe_json(x) for x in obj]
-            elif isinstance(obj, float):
-                # 统一处理所有非法JSON float
-                if obj == float('inf') or obj == float('-inf') or obj == 1e20 or obj == -1e20:
-                    return None
-                if obj != obj:  # NaN
-                    return None
-                return float(obj)
-            return obj
-        def enrich_row(row):
-            row = dict(row)
-            ts = row.get("trade_timestamp")
-            row["trade_time_gmt8"] = to_gmt8(ts) if ts else None
-            row["trade_time_gmt0"] = to_gmt0(ts) if ts else None
-            row["solscan_link"] = f"https://solscan.io/tx/{row.get('transaction_signature','')}" if row.get("transaction_signature") else ""
-            row["gmgn_link"] = f"https://www.gmgn.ai/sol/token/{row.get('token_mint_address','')}" if row.get("token_mint_address") else ""
-            # 保證 buy_price_usd/sell_price_usd 欄位補全
-            if "buy_price_sol" in row and "buy_price_usd" not in row:
-                try:
-                    row["buy_price_usd"] = float(row["buy_price_sol"]) * float(sol_price) if row["buy_price_sol"] not in [None, '', 'nan'] else None
-                except Exception:
-                    row["buy_price_usd"] = None
-            if "sell_price_sol" in row and "sell_price_usd" not in row:
-                try:
-                    row["sell_price_usd"] = float(row["sell_price_sol"]) * float(sol_price) if row["sell_price_sol"] not in [None, '', 'nan'] else None
-                except Exception:
-                    row["sell_price_usd"] = None
-            return row
-        data = [enrich_row(row) for _, row in df.iterrows()]
-        safe_data = safe_json(data)
-        safe_summary = safe_json(summary)
-        return {"data": safe_data, "total": total, "page": 1, "page_size": rows, "summary": safe_summary}
+            sql = f"SELECT {data_json_agg(field_list, layout)} AS _data, {agg_cols} FROM ({sample_sql})"
+            rec = fetch_records(con, sql)[0]
+            data = RawJSON(rec.pop("_data"))
+        logger.info(f"random_sample sample result rows: {rec['count']}")
+        rec = summary_record(rec, stats_exprs)
+        if price_type and rec["count"]:
+            summary = finish_summary(rec, sol_price)
+        else:
+            summary = finish_summary({"count": rec["count"], "avg": None, "min": None, "max": None,
+                                      **{key: rec[key] for key in SKETCH_DISTINCT if key in rec}}, sol_price)
+        result = {"total": total, "page": 1, "page_size": rows, "summary": summary, "seed": seed, "method": "stratified" if stratify else method}
+        if layout == "arrow":
+            return ArrowResponse(arrow_ipc(data, result))
+        return FastJSONResponse({"data": data, **result})
     except Exception as e:
         logger.error(f"/api/random_sample error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 @app.get("/api/top_tokens")
+@bounded("top_tokens")
 def top_tokens(top: int = Query(20, gt=0, le=1000)):
     try:
-        cache_key = f"top_tokens_{top}"
-        cached = get_cache(cache_key)
-        if cached:
-            return {"data": cached}
-        con = duckdb.connect()
-        query = f"""
-            SELECT token_mint_address, COUNT(*) as count
-            FROM read_csv_auto('{CSV_PATH}')
-            GROUP BY token_mint_address
-            ORDER BY count DESC
-            LIMIT {top}
-        """
-        df = con.execute(query).df()
-        result = [
-            {"token_mint_address": row["token_mint_address"], "count": int(row["count"])}
-            for _, row in df.iterrows()
-        ]
-        cache_with_expiry(cache_key, result, ttl=300)
+        def compute():
+            con = get_engine().cursor()
+            token_dict = get_engine().dictionary_source("token_mint_address")
+            if token_dict:
+                # 在整數 token_id 上分組，只把前 top 名解碼回地址
+                query = f"""
+                    SELECT d.value AS token_mint_address, t.count
+                    FROM (
+                        SELECT token_id, COUNT(*) AS count
+                        FROM {TABLE_NAME}
+                        GROUP BY token_id
+                        ORDER BY count DESC
+                        LIMIT {top}
+                    ) t
+                    LEFT JOIN {token_dict} d ON d.id = t.token_id
+                    ORDER BY t.count DESC
+                """
+            else:
+                query = f"""
+                    SELECT token_mint_address, COUNT(*) as count
+                    FROM {TABLE_NAME}
+                    GROUP BY token_mint_address
+                    ORDER BY count DESC
+                    LIMIT {top}
+                """
+            return fetch_records(con, query)
+
+        # 同時到達的相同請求只算一次（single-flight），之後命中快取
+        result = get_cache().get_or_compute(make_key("top_tokens", top=top), get_engine().data_version(), compute)
         if not result:
             return {"data": result, "message": "无数据"}
         return {"data": result}
@@ -216,210 +296,846 @@ def top_tokens(top: int = Query(20, gt=0, le=1000)):
         logger.error(f"/api/top_tokens error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+def price_histogram(
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    edges: list,
+    token_list: Optional[str] = None,
+    buy_price_filter: Optional[str] = None,
+    abnormal_only: bool = False,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    positive_only: bool = False,
+    anomaly_mask: int = 0
+):
+    """
+    各區間的行數與占比：區間編號在引擎內算出（見 price_bins.bin_index_expr），一次掃描 GROUP BY，不把價格拉回 Python。
+    NULL/NaN 價格不計入；低於第一個邊界、高於有上界的最後一個邊界的行數另列為 below/above，與各區間一起構成 total。
+    """
+    con = get_engine().cursor()
+    sol_col = f"{price_type}_sol"
+    price_expr = sol_col if price_unit == "SOL" else f"{sol_col}*{sol_price}"
+    abnormal_condition = anomaly_filter(abnormal_only, anomaly_mask)
+    where_sql = build_where(
+        price_type=price_type, price_unit=price_unit, sol_price=sol_price, token_list=token_list,
+        buy_price_filter=buy_price_filter, abnormal_only=bool(abnormal_condition), abnormal_condition=abnormal_condition,
+        start_time=start_time, end_time=end_time
+    )
+    if positive_only:
+        where_sql += f" AND {sol_col} > 0"
+    source = row_source(parse_token_list(token_list), anomalies=bool(abnormal_condition))
+    sql = f"""
+        SELECT _bin, COUNT(*) AS count
+        FROM (SELECT {bin_index_expr(price_expr, edges)} AS _bin FROM {source} WHERE {where_sql})
+        WHERE _bin IS NOT NULL
+        GROUP BY _bin
+    """
+    counts = {rec["_bin"]: rec["count"] for rec in fetch_records(con, sql)}
+    n = len(edges) - 1
+    total = sum(counts.values())
+    bins = []
+    for idx in range(n):
+        low, high = bin_bounds(idx, edges)
+        count = counts.get(idx, 0)
+        bins.append({
+            "label": bin_label(low, high),
+            "low": low,
+            "high": high,
+            "count": count,
+            "percent": round(100 * count / total, 2) if total > 0 else 0
+        })
+    return safe_json({"bins": bins, "unit": price_unit, "total": total, "below": counts.get(-1, 0), "above": counts.get(n, 0)})
+
+def cached_histogram(**args):
+    """price_histogram 的快取版本，參數須給全；price_ranges 與等價的 /api/histogram 請求共用同一份結果。"""
+    key = make_key("histogram", **{**args, "token_list": token_key(args["token_list"])})
+    return get_cache().get_or_compute(key, get_engine().data_version(), lambda: price_histogram(**args))
+
+@app.get("/api/histogram")
+@bounded("histogram")
+def histogram(
+    price_type: str = Query("buy_price", pattern="^(buy_price|sell_price)$"),
+    price_unit: str = Query("USD", pattern="^(SOL|USD)$"),
+    sol_price: float = Query(DEFAULT_SOL_PRICE, gt=0),
+    token_list: Optional[str] = Query(None),
+    buy_price_filter: Optional[str] = Query(None),
+    abnormal_only: bool = Query(False),
+    start_time: Optional[int] = Query(None, ge=0),
+    end_time: Optional[int] = Query(None, ge=0),
+    positive_only: bool = Query(False),
+    anomaly_flags: Optional[str] = Query(None),
+    spec: BinSpec = Depends(bin_spec)
+):
+    """
+    價格分佈直方圖：edges=任意遞增邊界（最後一個可為 inf）或 log_buckets=N（[log_min, log_max) 對數等距），默認 PRICE_BINS。
+    過濾條件同 filter_data；positive_only=true 時只統計價格大於 0 的行（同 price_ranges）。
+    """
+    try:
+        try:
+            edges = resolve_edges(spec)
+            anomaly_mask = anomaly.parse_flags(anomaly_flags)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        args = dict(
+            price_type=price_type, price_unit=price_unit, sol_price=sol_price, edges=edges, token_list=token_list,
+            buy_price_filter=buy_price_filter, abnormal_only=abnormal_only, start_time=start_time, end_time=end_time,
+            positive_only=positive_only, anomaly_mask=anomaly_mask
+        )
+        return {"data": cached_histogram(**args)}
+    except Exception as e:
+        logger.error(f"/api/histogram error: {e}", exc_info=True)
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
 @app.get("/api/price_ranges")
+@bounded("price_ranges")
 def price_ranges(
-    price_type: str = Query("buy_price", regex="^(buy_price|sell_price)$"),
-    price_unit: str = Query("USD", regex="^(SOL|USD)$"),
-    sol_price: float = Query(133, gt=0)
+    price_type: str = Query("buy_price", pattern="^(buy_price|sell_price)$"),
+    price_unit: str = Query("USD", pattern="^(SOL|USD)$"),
+    sol_price: float = Query(133, gt=0),
+    spec: BinSpec = Depends(bin_spec)
 ):
+    """價格大於 0 的成交在各區間的分佈，即 positive_only 的 /api/histogram（默認六個區間）。"""
     try:
-        # 固定6个区间（单位USD）
-        bins = [0, 10, 100, 1000, 10000, 100000, 1e20]
-        labels = [
-            "0-10",
-            "10-100",
-            "100-1K",
-            "1K-10K",
-            "10K-100K",
-            "100K以上"
-        ]
-        cache_key = f"price_ranges_{price_type}_{price_unit}_{sol_price}_v2"
-        cached = get_cache(cache_key)
-        if cached:
-            return {"data": cached}
-        con = duckdb.connect()
-        query = f"SELECT {price_type}_sol FROM read_csv_auto('{CSV_PATH}') WHERE {price_type}_sol IS NOT NULL AND {price_type}_sol > 0"
-        df = con.execute(query).df()
-        prices = df[price_type + "_sol"].sort_values().to_list()
-        n = len(prices)
-        if price_unit == "SOL":
-            prices_usd = prices
-        else:
-            prices_usd = [p * sol_price for p in prices]
-        total = len(prices_usd)
-        bin_ranges = []
-        for i in range(len(bins)):
-            low = bins[i]
-            high = bins[i+1] if i+1 < len(bins) else 1e20
-            count = sum(1 for p in prices_usd if low <= p < high) if high != 1e20 else sum(1 for p in prices_usd if p >= low)
-            percent = round(100 * count / total, 2) if total > 0 else 0
-            bin_ranges.append({
-                "label": labels[i],
-                "low": low,
-                "high": None if i+1 == len(bins) else high,
-                "count": count,
-                "percent": percent
-            })
-        result = {"bins": bin_ranges, "unit": "USD", "total": total}
-        def safe_json(obj):
-            if isinstance(obj, dict):
-                return {k: safe_json(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [safe_json(x) for x in obj]
-            elif isinstance(obj, float):
-                # 统一处理所有非法JSON float
-                if obj == float('inf') or obj == float('-inf') or obj == 1e20 or obj == -1e20:
-                    return None
-                if obj != obj:  # NaN
-                    return None
-                return float(obj)
-            return obj
-        safe_result = safe_json(result)
-        cache_with_expiry(cache_key, safe_result, ttl=300)
+        try:
+            edges = resolve_edges(spec)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        safe_result = cached_histogram(
+            price_type=price_type, price_unit=price_unit, sol_price=sol_price, edges=edges, token_list=None,
+            buy_price_filter=None, abnormal_only=False, start_time=None, end_time=None, positive_only=True, anomaly_mask=0
+        )
         return {"data": safe_result}
     except Exception as e:
         logger.error(f"/api/price_ranges error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-# 共用查詢+欄位補全函式（支援 return_detail 決定回傳明細或統計）
-def query_and_enrich(
+@app.get("/api/anomalies")
+@bounded("anomalies")
+def anomalies(
+    token_list: Optional[str] = Query(None),
+    start_time: Optional[int] = Query(None, ge=0),
+    end_time: Optional[int] = Query(None, ge=0)
+):
+    """
+    各異常旗標（見 anomaly.FLAGS）的行數，有異常旁路檔時只讀異常行；一行可帶多個旗標，total 為帶任一旗標的行數。
+    明細用 filter_data / export 的 anomaly_flags=<旗標名> 查詢。
+    """
+    try:
+        if not get_engine().has_anomaly_flags():
+            return JSONResponse(content={"error": "资料未包含 anomaly_flags，请用 ingest.py 重新导入"}, status_code=400)
+
+        def compute():
+            con = get_engine().cursor()
+            tokens = parse_token_list(token_list)
+            filters = [f"{anomaly.COLUMN} <> 0"] + ([token_filter(tokens)] if tokens else []) + time_filters(start_time, end_time)
+            counts = ", ".join(
+                f"COUNT(*) FILTER (WHERE {anomaly.condition(bit)}) AS {name}" for name, (bit, _) in anomaly.FLAGS.items()
+            )
+            rec = fetch_records(con, f"SELECT COUNT(*) AS total, {counts} FROM {row_source(tokens, anomalies=True)} WHERE {' AND '.join(filters)}")[0]
+            flags = [
+                {"name": name, "bit": bit, "description": description, "count": rec[name]}
+                for name, (bit, description) in anomaly.FLAGS.items()
+            ]
+            return {"flags": flags, "total": rec["total"]}
+
+        key = make_key("anomalies", tokens=token_key(token_list), start_time=start_time, end_time=end_time)
+        return {"data": get_cache().get_or_compute(key, get_engine().data_version(), compute)}
+    except Exception as e:
+        logger.error(f"/api/anomalies error: {e}", exc_info=True)
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+@app.get("/api/health")
+async def health():
+    """不碰資料庫，查詢線程池滿載時也能即時響應；附帶各端點的並發/排隊/拒絕計數與背景預取計數。"""
+    return {"status": "ok", "queries": get_executor().stats(), "prefetch": get_prefetcher().stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式：各端點延遲直方圖、請求數、分段耗時、掃描/返回行數，以及快取、查詢執行層與預取計數。"""
+    text = render_prometheus(get_metrics(), cache=get_cache().stats(),
+                             queries=get_executor().stats(), prefetch=get_prefetcher().stats())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache_stats")
+def cache_stats():
+    """結果快取的命中/未命中/淘汰/失效計數與目前大小。"""
+    return get_cache().stats()
+
+# 分頁的穩定排序鍵
+ORDER_COLUMNS = ["trade_timestamp", "transaction_slot", "transaction_signature"]
+
+def sql_literal(v):
+    if v is None:
+        return "NULL"
+    if isinstance(v, str):
+        return "'" + v.replace("'", "''") + "'"
+    return repr(v)
+
+def encode_cursor(row):
+    """用當頁最後一行的排序鍵生成不透明 cursor。"""
+    keys = [row.get(col) for col in ORDER_COLUMNS]
+    return base64.urlsafe_b64encode(json.dumps(keys).encode()).decode()
+
+def decode_cursor(cursor):
+    """解析 cursor，格式不合法時拋出 ValueError。"""
+    try:
+        keys = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError("cursor 参数不合法")
+    if not isinstance(keys, list) or len(keys) != len(ORDER_COLUMNS):
+        raise ValueError("cursor 参数不合法")
+    return keys
+
+def keyset_condition(cursor_values):
+    """
+    (trade_timestamp, transaction_slot, transaction_signature) > cursor 的展開寫法。
+    排序鍵可能為 NULL，排序時 NULL 在最後（DuckDB 預設 NULLS LAST）：cursor 值為 NULL 時沒有更大的值，
+    相等一步改用 IS NULL；不為 NULL 時 NULL 也算「更大」。
+    """
+    cond = None
+    for col, v in reversed(list(zip(ORDER_COLUMNS, cursor_values))):
+        if v is None:
+            greater, equal = None, f"{col} IS NULL"
+        else:
+            greater, equal = f"({col} > {sql_literal(v)} OR {col} IS NULL)", f"{col} = {sql_literal(v)}"
+        if cond is None:
+            cond = greater or "FALSE"
+        elif greater is None:
+            cond = f"({equal} AND {cond})"
+        else:
+            cond = f"({greater} OR ({equal} AND {cond}))"
+    return cond
+
+
+def bin_case_expr(price_expr, bins_edges, bins_idx):
+    """
+    依 bins_edges 生成區間編號的 CASE 表達式，只為 bins_idx 中的區間賦值，其餘為 NULL。
+    無上界的最後一個區間（見 price_bins.bin_bounds）只比較下界。
+    """
+    whens = []
+    for idx in bins_idx:
+        low, high = bin_bounds(idx, bins_edges)
+        if high is None:
+            whens.append(f"WHEN {price_expr} >= {sql_number(low)} THEN {idx}")
+        else:
+            whens.append(f"WHEN {price_expr} >= {sql_number(low)} AND {price_expr} < {sql_number(high)} THEN {idx}")
+    return f"CASE {' '.join(whens)} END"
+
+def price_stats_exprs(price_type, sol_price, approx=False):
+    """
+    SOL/USD 的 count/avg/min/max 聚合表達式（略過 NaN，與 pandas 行為一致）。
+    approx=True 時另加分位數與不同 token/錢包數的草圖（見 sketch_exprs），與其他聚合在同一次掃描裡算出。
+    """
+    sol_col = f"{price_type}_sol"
+    usd_expr = f"{sol_col}*{sol_price}"
+    exprs = {"count": "COUNT(*)"}
+    for unit, expr in (("sol", sol_col), ("usd", usd_expr)):
+        for fn in ("avg", "min", "max"):
+            exprs[f"{fn}_{unit}"] = f"{fn.upper()}({expr}) FILTER (WHERE NOT isnan({expr}))"
+    if approx:
+        exprs.update(sketch_exprs(price_type))
+    return exprs
+
+# approx_stats 草圖在摘要中的鍵（輸出前由 finish_summary 換成估計值）
+SKETCH_HISTOGRAM = "_price_sketch"
+SKETCH_DISTINCT = {"_token_sketch": "distinct_tokens", "_wallet_sketch": "distinct_wallets"}
+
+def sketch_columns():
+    """不同值草圖用的 (token 欄, 錢包欄)：有字典 ID 時用整數欄位，hash 更快。"""
+    names = {name for name, _ in get_engine().columns()}
+    return tuple(
+        col if col in names else fallback
+        for col, fallback in (("token_id", "token_mint_address"), ("wallet_id", "trader_wallet_address"))
+    )
+
+def sketch_exprs(price_type=None):
+    """價格（SOL）的對數桶直方圖與 token/錢包的 HyperLogLog 聚合（sketch.py）；不指定 price_type 時只有後兩者。"""
+    exprs = {}
+    if price_type:
+        exprs[SKETCH_HISTOGRAM] = sketch.histogram_expr(f"{price_type}_sol")
+    for key, col in zip(SKETCH_DISTINCT, sketch_columns()):
+        exprs[key] = sketch.hll_expr(col)
+    return exprs
+
+def summary_record(rec, stats_exprs):
+    """從查詢結果取出摘要欄位；HyperLogLog 位圖壓成暫存器後再快取。"""
+    return {name: sketch.hll_registers(rec[name]) if name in SKETCH_DISTINCT else rec[name] for name in stats_exprs}
+
+def finish_summary(summary, sol_price):
+    """草圖狀態換成 p50/p90/p99（SOL/USD）與 distinct_tokens/distinct_wallets；沒有草圖的摘要原樣返回。"""
+    if not any(key in summary for key in SKETCH_DISTINCT):
+        return summary
+    result = {name: value for name, value in summary.items() if name != SKETCH_HISTOGRAM and name not in SKETCH_DISTINCT}
+    if SKETCH_HISTOGRAM in summary:
+        values = sketch.quantiles(summary[SKETCH_HISTOGRAM], SKETCH_QUANTILES, summary.get("min_sol"), summary.get("max_sol"))
+        for q, value in zip(SKETCH_QUANTILES, values):
+            result[f"p{q * 100:g}_sol"] = value
+        for q, value in zip(SKETCH_QUANTILES, values):
+            result[f"p{q * 100:g}_usd"] = None if value is None else value * sol_price
+    for key, name in SKETCH_DISTINCT.items():
+        result[name] = sketch.distinct_count(summary[key])
+    return result
+
+# 明細補全欄位（USD 價格、GMT+8/GMT0 時間、solscan/gmgn 鏈接）全部在 SQL 內按列計算
+DETAIL_EXTRA_COLUMNS = [
+    ("buy_price_usd", "DOUBLE"),
+    ("sell_price_usd", "DOUBLE"),
+    ("trade_time_gmt8", "VARCHAR"),
+    ("trade_time_gmt0", "VARCHAR"),
+    ("solscan_link", "VARCHAR"),
+    ("gmgn_link", "VARCHAR"),
+]
+
+# 欄位預設集：table 為 PriceTable 實際用到的欄位，full 為全部欄位
+COLUMN_PRESETS = {
+    "table": [
+        "type", "trade_timestamp", "transaction_slot", "trader_wallet_address", "token_mint_address",
+        "buy_amount", "buy_sol_amount", "buy_price", "buy_price_sol",
+        "sell_amount", "sell_sol_amount", "sell_price", "sell_price_sol",
+        "arbitrage_profit_loss", "arbitrage_price_change", "arbitrage_volume",
+        "transaction_signature",
+        "buy_price_usd", "sell_price_usd", "trade_time_gmt8", "trade_time_gmt0", "solscan_link", "gmgn_link",
+    ],
+    "full": None,
+}
+DEFAULT_FIELDS = "table"
+# 不論投影哪些欄位，明細查詢都要帶上的來源欄位（排序鍵、價格統計、補全欄位依賴）
+CARRIED_COLUMNS = ORDER_COLUMNS + ["token_mint_address", "buy_price_sol", "sell_price_sol"]
+
+def output_columns():
+    """明細可輸出的全部欄位 [(name, type)]：資料集欄位 + 補全欄位。"""
+    return get_engine().columns() + DETAIL_EXTRA_COLUMNS
+
+def resolve_fields(fields):
+    """
+    fields 為預設集名稱（table/full）或逗號分隔的欄位名，返回要輸出的欄位名列表，None 表示全部。
+    預設集中資料集沒有的欄位直接略過；明確指定了未知欄位時拋出 ValueError。
+    """
+    fields = (fields or DEFAULT_FIELDS).strip()
+    available = [name for name, _ in output_columns()]
+    if fields in COLUMN_PRESETS:
+        names = COLUMN_PRESETS[fields]
+        if names is None:
+            return None
+    else:
+        names = [x.strip() for x in fields.split(",") if x.strip()]
+        unknown = [x for x in names if x not in available]
+        if unknown:
+            raise ValueError(f"fields 参数包含未知欄位: {','.join(unknown)}")
+    wanted = set(names)
+    return [name for name in available if name in wanted]
+
+def detail_select_expr(sol_price, fields=None):
+    """明細查詢的欄位：原始欄位（按 fields 投影，下推到 parquet 讀取）+ DETAIL_EXTRA_COLUMNS。"""
+    if fields is None:
+        base = "*"
+    else:
+        wanted = set(fields) | set(CARRIED_COLUMNS)
+        base = ", ".join(f'"{name}"' for name, _ in get_engine().columns() if name in wanted)
+    # 自動判斷單位：10位數為秒，13位數為毫秒；0/NULL/NaN 時間戳返回 NULL
+    ts_sec = "CASE WHEN trade_timestamp < 1e10 THEN trade_timestamp ELSE trade_timestamp / 1000 END"
+    ts_utc = f"make_timestamp(CAST(({ts_sec}) * 1000000 AS BIGINT))"
+    ts_valid = "trade_timestamp <> 0 AND NOT isnan(trade_timestamp)"
+    fmt = "'%Y-%m-%d %H:%M:%S'"
+    return (
+        f"{base}, buy_price_sol*{sol_price} AS buy_price_usd, sell_price_sol*{sol_price} AS sell_price_usd, "
+        f"CASE WHEN {ts_valid} THEN strftime({ts_utc} + INTERVAL 8 HOUR, {fmt}) END AS trade_time_gmt8, "
+        f"CASE WHEN {ts_valid} THEN strftime({ts_utc}, {fmt}) END AS trade_time_gmt0, "
+        "CASE WHEN coalesce(transaction_signature, '') <> '' THEN 'https://solscan.io/tx/' || transaction_signature ELSE '' END AS solscan_link, "
+        "CASE WHEN coalesce(token_mint_address, '') <> '' THEN 'https://www.gmgn.ai/sol/token/' || token_mint_address ELSE '' END AS gmgn_link"
+    )
+
+def detail_columns(fields=None):
+    """明細輸出的欄位 [(name, type)]，按 fields 投影。"""
+    columns = output_columns()
+    if fields is not None:
+        wanted = set(fields)
+        columns = [(name, typ) for name, typ in columns if name in wanted]
+    return columns
+
+def detail_row_struct(fields=None):
+    """明細行的 STRUCT 表達式（浮點欄位已清洗、只含 fields），供 to_json(list(...)) 直接編碼。"""
+    return json_struct_expr(detail_columns(fields))
+
+def data_json_agg(fields=None, layout="rows", order_sql=None):
+    """明細的 JSON 聚合表達式：rows 佈局為物件陣列，columns 佈局為 {欄名: 陣列}（欄名只出現一次）。"""
+    if layout == "columns":
+        return f"to_json({json_columns_expr(detail_columns(fields), order_sql)})"
+    order = f" ORDER BY {order_sql}" if order_sql else ""
+    return f"to_json(list({detail_row_struct(fields)}{order}))"
+
+def page_json_aggs(fields=None, layout="rows"):
+    """一頁資料的聚合：JSON 陣列、行數、最後一行的排序鍵（生成 next_cursor 用）。"""
+    order_sql = ", ".join(ORDER_COLUMNS)
+    last_cols = ", ".join(f"last({col} ORDER BY {order_sql}) AS _last_{col}" for col in ORDER_COLUMNS)
+    return f"{data_json_agg(fields, layout, order_sql)} AS _data, COUNT(*) AS _page_rows, {last_cols}"
+
+def fetch_arrow_rows(con, rows_sql, fields=None, keep=()):
+    """
+    arrow 佈局：rows_sql 的結果按 keep + ORDER_COLUMNS 排序後直接轉成 Arrow 表（浮點清洗同 JSON），
+    keep 為額外輸出的欄位（如 _bin/_page）。返回 (輸出表, 排序鍵表)，排序鍵只用來生成 next_cursor。
+    """
+    keys = ", ".join(f"{col} AS _key_{col}" for col in ORDER_COLUMNS)
+    extra = "".join(f", {col}" for col in keep)
+    order_sql = ", ".join(list(keep) + ORDER_COLUMNS)
+    table = con.execute(
+        f"SELECT {scrubbed_select(detail_columns(fields))}{extra}, {keys} FROM ({rows_sql}) ORDER BY {order_sql}"
+    ).to_arrow_table()
+    key_names = [f"_key_{col}" for col in ORDER_COLUMNS]
+    return table.drop_columns(key_names), table.select(key_names)
+
+def empty_detail_table(con, sol_price, fields=None):
+    """沒有明細行時的 Arrow 表：欄位與類型同 fetch_arrow_rows 的輸出，客戶端照樣拿到 schema。"""
+    return con.execute(
+        f"SELECT {scrubbed_select(detail_columns(fields))} FROM (SELECT {detail_select_expr(sol_price, fields)} FROM {TABLE_NAME} LIMIT 0)"
+    ).to_arrow_table()
+
+def arrow_page_recs(table, keys, group_cols=()):
+    """按 group_cols 分組的 {分組值元組: rec}，rec 與 page_json_aggs 的 _page_rows/_last_* 相同（給 page_cursor）。"""
+    groups = list(zip(*(table.column(col).to_pylist() for col in group_cols))) if group_cols else [()] * table.num_rows
+    key_values = [keys.column(i).to_pylist() for i in range(keys.num_columns)]
+    recs = {}
+    for i, group in enumerate(groups):
+        rec = recs.setdefault(group, {"_page_rows": 0})
+        rec["_page_rows"] += 1
+        for col, values in zip(ORDER_COLUMNS, key_values):
+            rec[f"_last_{col}"] = values[i]
+    return recs
+
+def page_cursor(rec, page_size):
+    # 只有整頁時才可能還有下一頁
+    if rec and rec["_page_rows"] >= page_size:
+        return encode_cursor({col: rec[f"_last_{col}"] for col in ORDER_COLUMNS})
+    return None
+
+def fetch_records(con, sql):
+    """執行查詢並以 dict 列表返回（原生 Python 類型，不經 pandas）。"""
+    cur = con.execute(sql)
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+def parse_token_list(token_list):
+    if not token_list:
+        return []
+    return [x.strip() for x in token_list.split(",") if x.strip()]
+
+def token_key(token_list):
+    """快取 key 用的 token 集合（順序、重複、空白不影響查詢結果）。"""
+    return tuple(sorted(set(parse_token_list(token_list))))
+
+def encode_payload(result, layout="rows"):
+    """rows/columns 佈局編碼成 RawJSON；arrow 佈局的 result 為 (信封, Arrow 表)，編碼成 Arrow IPC 位元組。"""
+    with stage("encode"):
+        if layout == "arrow":
+            envelope, table = result
+            return arrow_ipc(table, envelope)
+        return RawJSON(dumps_json(result))
+
+def payload_response(payload):
+    if isinstance(payload, bytes):
+        return ArrowResponse(payload)
+    return FastJSONResponse(payload)
+
+def cached_payload(namespace, compute, layout="rows", **params):
+    """
+    以正規化後的參數（含佈局）為 key 快取編碼好的響應；compute() 返回交給 encode_payload 的結果。
+    資料集變動後舊結果自動失效（見 result_cache.py）。
+    """
+    return get_cache().get_or_compute(
+        make_key(namespace, layout=layout, **params), get_engine().data_version(),
+        lambda: encode_payload(compute(), layout)
+    )
+
+def token_filter(tokens):
+    """token 條件：有字典時翻譯成整數 token_id 比較（字典裡沒有的 token 不可能命中），否則比較字串。"""
+    ids = get_engine().encode("token_mint_address", tokens)
+    if ids is None:
+        return f"token_mint_address IN ({','.join(sql_literal(x) for x in tokens)})"
+    if not ids:
+        return "FALSE"
+    return f"token_id IN ({','.join(str(int(x)) for x in sorted(ids.values()))})"
+
+def anomaly_filter(abnormal_only=False, anomaly_mask=0):
+    """
+    異常值條件：abnormal_only 為舊語意（成交價 NULL/0/NaN），anomaly_mask 為 anomaly_flags 旗標組合，兩者取聯集；不過濾時為 ""。
+    資料帶 anomaly_flags 時按位比較，否則（舊導入）退回 ABNORMAL_CONDITION，此時不支援按旗標過濾（ValueError）。
+    """
+    mask = anomaly_mask | (anomaly.ABNORMAL_MASK if abnormal_only else 0)
+    if not mask:
+        return ""
+    if get_engine().has_anomaly_flags():
+        return anomaly.condition(mask)
+    if anomaly_mask:
+        raise ValueError("资料未包含 anomaly_flags，请用 ingest.py 重新导入后再按旗标查询")
+    return ABNORMAL_CONDITION
+
+def row_source(tokens, anomalies=False):
+    """明細的 FROM 來源：只看異常行且有異常旁路檔時讀旁路檔（只含異常行，見 anomaly.py），否則同 token_source。"""
+    if anomalies:
+        source = get_engine().anomaly_source()
+        if source is not None:
+            return source
+    return get_engine().token_source(tokens)
+
+def partition_filters(price_type, price_unit, sol_price, ranges=None, start_time=None, end_time=None):
+    """
+    分區資料集上與行級條件等價（或更寬）的分區欄位條件，讓 DuckDB 在打開檔案前裁剪目錄。
+    ranges 為 price_unit 單位下的 [(low, high)]；單檔資料集返回空列表。
+    """
+    part = get_engine().partitioning()
+    if not part:
+        return []
+    filters = dataset.time_partition_filters(part["partition_by"], start_time, end_time)
+    bin_col = f"{price_type}_bin"
+    if ranges and bin_col in part["partition_by"] and part["bin_edges"]:
+        scale = 1 if price_unit == "SOL" else sol_price
+        sol_ranges = [(low / scale, None if high is None else high / scale) for low, high in ranges]
+        filters.append(dataset.bin_partition_filter(bin_col, part["bin_edges"], sol_ranges, eps=0.0 if scale == 1 else 1e-9))
+    return filters
+
+def time_filters(start_time=None, end_time=None):
+    """trade_timestamp（毫秒）範圍條件，end_time 不含。"""
+    filters = []
+    if start_time is not None:
+        filters.append(f"trade_timestamp >= {int(start_time)}")
+    if end_time is not None:
+        filters.append(f"trade_timestamp < {int(end_time)}")
+    return filters
+
+def build_where(
     price_type: str,
     price_unit: str,
     sol_price: float,
     token_list: Optional[str] = None,
     price_bin: Optional[int] = None,
-    page: int = 1,
-    page_size: int = 20,
     buy_price_filter: Optional[str] = None,
     bins: Optional[list] = None,
-    fetch_all: bool = False,
-    return_detail: bool = True,
     abnormal_only: bool = False,
-    abnormal_condition: str = ""
+    abnormal_condition: str = "",
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None
 ):
-    con = duckdb.connect()
-    # 處理 price_col 與 where 條件
-    def col_expr(col):
-        if col == 'buy_price_usd':
-            return f"buy_price_sol*{sol_price}"
-        elif col == 'sell_price_usd':
-            return f"sell_price_sol*{sol_price}"
-        else:
-            # 兼容旧逻辑，buy_price/sell_price直接映射为buy_price_sol/sell_price_sol
-            if col == 'buy_price':
-                return 'buy_price_sol'
-            elif col == 'sell_price':
-                return 'sell_price_sol'
-            return col
+    # buy_price/sell_price 對應 *_sol 欄位，USD 單位時按 sol_price 換算
+    sol_col = f"{price_type}_sol"
+    price_expr = sol_col if price_unit == "SOL" else f"{sol_col}*{sol_price}"
     where_clauses = []
-    if token_list:
-        tokens = [f"'{x.strip()}'" for x in token_list.split(",") if x.strip()]
-        tokens_str = ",".join(tokens)
-        where_clauses.append(f"token_mint_address IN ({tokens_str})")
+    tokens = parse_token_list(token_list)
+    if tokens:
+        where_clauses.append(token_filter(tokens))
     if buy_price_filter == 'gt0':
         where_clauses.append("buy_price_sol > 0")
     elif buy_price_filter == 'eq0':
         where_clauses.append("buy_price_sol = 0")
     if abnormal_only:
         where_clauses.append(abnormal_condition)
-    if price_unit == "SOL":
-        # 兼容前端传buy_price/sell_price
-        if price_type == 'buy_price':
-            price_col = 'buy_price_sol'
-        elif price_type == 'sell_price':
-            price_col = 'sell_price_sol'
-        else:
-            price_col = price_type
-    else:
-        price_col = price_type + "_usd"
     # bins 過濾
-    if bins is not None and price_bin is not None and 0 <= price_bin < len(bins)-1:
-        low = bins[price_bin]
-        high = bins[price_bin+1] if price_bin+1 < len(bins) else 1e20
-        where_clauses.append(f"{col_expr(price_col)} >= {low}")
-        if high != 1e20:
-            where_clauses.append(f"{col_expr(price_col)} < {high}")
-    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-    # 明細查詢
-    if return_detail:
-        # 只查當頁資料
-        select_cols = "*"
-        select_expr = f"{select_cols}, buy_price_sol, sell_price_sol, buy_price_sol*{sol_price} AS buy_price_usd, sell_price_sol*{sol_price} AS sell_price_usd"
-        sql = f"SELECT {select_expr} FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql} LIMIT {page_size} OFFSET {(page-1)*page_size}"
-        df = con.execute(sql).df()
-        # 統計總數
-        count_sql = f"SELECT COUNT(*) AS total FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql}"
-        total = con.execute(count_sql).fetchone()[0]
-        def enrich_time_fields(row):
-            row = dict(row)
-            ts = row.get("trade_timestamp")
-            return {
-                **row,
-                "trade_time_gmt8": to_gmt8(ts) if ts else None,
-                "trade_time_gmt0": to_gmt0(ts) if ts else None,
-                "solscan_link": f"https://solscan.io/tx/{row.get('transaction_signature','')}" if row.get("transaction_signature") else "",
-                "gmgn_link": f"https://www.gmgn.ai/sol/token/{row.get('token_mint_address','')}" if row.get("token_mint_address") else ""
-            }
-        data = df.to_dict(orient='records')
-        enriched = [enrich_time_fields(r) for r in data]
-        def safe_json(obj):
-            if isinstance(obj, dict):
-                return {k: safe_json(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [safe_json(x) for x in obj]
-            elif isinstance(obj, float):
-                # 统一处理所有非法JSON float
-                if obj == float('inf') or obj == float('-inf') or obj == 1e20 or obj == -1e20:
-                    return None
-                if obj != obj:  # NaN
-                    return None
-                return float(obj)
-            return obj
-        return safe_json(enriched), total
+    bounds = bin_bounds(price_bin, bins)
+    if bounds:
+        low, high = bounds
+        where_clauses.append(f"{price_expr} >= {sql_number(low)}")
+        if high is not None:
+            where_clauses.append(f"{price_expr} < {sql_number(high)}")
+    where_clauses += time_filters(start_time, end_time)
+    where_clauses += partition_filters(price_type, price_unit, sol_price, [bounds] if bounds else None, start_time, end_time)
+    return " AND ".join(where_clauses) if where_clauses else "1=1"
+
+DAY_MS = 86400000
+CUBE_AGGS = ["n", "n_num", "sum_sol", "min_sol", "max_sol"]
+
+def cube_partial_aggs(key, cond, price_col=None):
+    """
+    一個範圍的部分聚合 _<key>_n/n_num/sum_sol/min_sol/max_sol：
+    price_col 為 None 時在 cube 上合併已聚合的欄位，否則直接在原始資料的 price_col 上聚合。
+    """
+    if price_col is None:
+        exprs = ["SUM(n)", "SUM(n_num)", "SUM(sum_sol)", "MIN(min_sol)", "MAX(max_sol)"]
+        conds = [cond] * 5
     else:
-        # 只做統計（同時計算 SOL 和 USD 統計）
-        if price_type in ['buy_price', 'sell_price']:
-            sol_col = 'buy_price_sol' if price_type == 'buy_price' else 'sell_price_sol'
-            usd_col = f"{price_type}_usd"
-            # 補全 usd 欄位
-            try:
-                sql_tmp = f"SELECT {sol_col}, {sol_col}*{sol_price} AS {usd_col} FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql}"
-                df_tmp = con.execute(sql_tmp).df()
-                sol_vals = df_tmp[sol_col]
-                usd_vals = df_tmp[usd_col]
-                stats = {
-                    "count": len(sol_vals),
-                    "avg_sol": sol_vals.mean(),
-                    "min_sol": sol_vals.min(),
-                    "max_sol": sol_vals.max(),
-                    "avg_usd": usd_vals.mean(),
-                    "min_usd": usd_vals.min(),
-                    "max_usd": usd_vals.max(),
-                }
-            except Exception as e:
-                logger.error(f"query_and_enrich stats error: {e}", exc_info=True)
-                stats = {"count": 0, "avg_sol": None, "min_sol": None, "max_sol": None, "avg_usd": None, "min_usd": None, "max_usd": None}
+        valid = f"{cond} AND NOT isnan({price_col})"
+        exprs = ["COUNT(*)", f"COUNT({price_col})", f"SUM({price_col})", f"MIN({price_col})", f"MAX({price_col})"]
+        conds = [cond] + [valid] * 4
+    return ", ".join(
+        f"{expr} FILTER (WHERE {c}) AS _{key}_{name}" for expr, c, name in zip(exprs, conds, CUBE_AGGS)
+    )
+
+def cube_summaries(
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    ranges: dict,
+    token_list: Optional[str] = None,
+    buy_price_filter: Optional[str] = None,
+    abnormal_only: bool = False,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    bins: Optional[list] = None
+):
+    """
+    從預聚合 cube 算摘要：ranges 為 {key: (low, high) 或 None（不限價格）}，單位為 price_unit。
+    cube 以 SOL 計價，USD 值按 sol_price 換算，因此 sol_price 變化不必重算；
+    USD 區間邊界所在的少數細分桶回原始資料補算。條件 cube 表達不了時返回 None（呼叫方走原始資料）。
+    返回 {key: summary}，欄位與 price_stats_exprs 相同。
+    """
+    info = get_engine().cube_info()
+    if info is None or abnormal_only:
+        return None
+    if buy_price_filter in ('gt0', 'eq0') and price_type != 'buy_price':
+        return None
+    # cube 只到天，時間條件必須對齊 UTC 零點
+    if any(t is not None and t % DAY_MS for t in (start_time, end_time)):
+        return None
+    dims = [f"price_type = '{price_type}'"]
+    tokens = parse_token_list(token_list)
+    if tokens:
+        ids = get_engine().encode("token_mint_address", tokens)
+        if info["token_col"] == "token_id":
+            if ids is None:
+                return None
+            dims.append(f"token_id IN ({','.join(str(int(x)) for x in sorted(ids.values()))})" if ids else "FALSE")
+        else:
+            dims.append(f"{info['token_col']} IN ({','.join(sql_literal(x) for x in tokens)})")
+    if buy_price_filter == 'gt0':
+        dims.append(f"bucket IS NOT NULL AND bucket NOT IN ({cube.ZERO_BUCKET}, {cube.NEG_BUCKET})")
+    elif buy_price_filter == 'eq0':
+        dims.append(f"bucket = {cube.ZERO_BUCKET}")
+    for t, op in ((start_time, ">="), (end_time, "<")):
+        if t is not None:
+            dims.append(f"trade_date {op} DATE '{dataset.utc_date(t)}'")
+
+    sol_col = f"{price_type}_sol"
+    scale = 1 if price_unit == "SOL" else sol_price
+    edges = info["bin_edges"]
+    cube_aggs, raw_aggs, raw_conds = [], [], []
+    for key, bounds in ranges.items():
+        if bounds is None:
+            cond = "TRUE"
+        else:
+            low, high = bounds
+            idx = edges.index(low) if price_unit == "SOL" and low in edges else None
+            coarse = idx is not None and idx < len(edges) - 1 and (
+                (high is None and idx == len(edges) - 2) or (high is not None and edges[idx+1] == high)
+            )
+            if coarse:
+                # SOL 單位且與導入時的區間一致：粗區間精確命中（NaN 只屬於最後一個無上界區間）
+                cond = f"(bin = {idx} OR bucket = {cube.NAN_BUCKET})" if high is None else f"bin = {idx}"
+            else:
+                cond, edge_buckets, neg_edge = cube.plan_range(low, high, scale, info["per_decade"])
+                edge = cube.edge_filter(sol_col, edge_buckets, neg_edge, info["per_decade"])
+                if edge:
+                    price_expr = sol_col if price_unit == "SOL" else f"{sol_col}*{sol_price}"
+                    in_range = f"{price_expr} >= {sql_number(low)}" + (f" AND {price_expr} < {sql_number(high)}" if high is not None else "")
+                    raw_conds.append(f"({in_range} AND {edge})")
+                    raw_aggs.append(cube_partial_aggs(key, raw_conds[-1], sol_col))
+        cube_aggs.append(cube_partial_aggs(key, cond))
+
+    con = get_engine().cursor()
+    rec = fetch_records(con, f"SELECT {', '.join(cube_aggs)} FROM {info['source']} WHERE {' AND '.join(dims)}")[0]
+    if raw_aggs:
+        where_sql = build_where(price_type=price_type, price_unit=price_unit, sol_price=sol_price, token_list=token_list,
+                                buy_price_filter=buy_price_filter, start_time=start_time, end_time=end_time)
+        source = get_engine().token_source(tokens)
+        raw = fetch_records(
+            con, f"SELECT {', '.join(raw_aggs)} FROM {source} WHERE {where_sql} AND ({' OR '.join(raw_conds)})"
+        )[0]
+        for name, value in raw.items():
+            if value is None:
+                continue
+            if rec[name] is None:
+                rec[name] = value
+            elif name.endswith("_min_sol"):
+                rec[name] = min(rec[name], value)
+            elif name.endswith("_max_sol"):
+                rec[name] = max(rec[name], value)
+            else:
+                rec[name] += value
+
+    result = {}
+    for key in ranges:
+        n, n_num = rec[f"_{key}_n"] or 0, rec[f"_{key}_n_num"] or 0
+        avg = rec[f"_{key}_sum_sol"] / n_num if n_num else None
+        lo, hi = (rec[f"_{key}_min_sol"], rec[f"_{key}_max_sol"]) if n_num else (None, None)
+        result[key] = {
+            "count": int(n),
+            "avg_sol": avg, "min_sol": lo, "max_sol": hi,
+            "avg_usd": None if avg is None else avg * sol_price,
+            "min_usd": None if lo is None else lo * sol_price,
+            "max_usd": None if hi is None else hi * sol_price,
+        }
+    return result
+
+def approx_total_from_stats(
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    token_list: Optional[str] = None,
+    price_bin: Optional[int] = None,
+    buy_price_filter: Optional[str] = None,
+    bins: Optional[list] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None
+):
+    """
+    用 parquet row group 的 min/max 統計估算命中行數（不掃描資料）：
+    累加所有「可能」命中的 row group 行數，因此是上界估計；
+    無法用統計判斷的條件（如異常值）不參與裁剪。
+    """
+    stats = get_engine().row_group_stats()
+    keys = ["file_name", "row_group_id"]
+    num_rows = stats.groupby(keys)["row_group_num_rows"].first()
+    keep = pd.Series(True, index=num_rows.index)
+
+    def col_range(col, numeric=True):
+        sub = stats[stats["path_in_schema"] == col].set_index(keys).reindex(num_rows.index)
+        lo, hi = sub["stats_min_value"], sub["stats_max_value"]
+        if numeric:
+            lo, hi = pd.to_numeric(lo, errors="coerce"), pd.to_numeric(hi, errors="coerce")
+        return lo, hi
+
+    tokens = parse_token_list(token_list)
+    fragments = get_engine().token_fragments(tokens) if tokens else None
+    if fragments is not None:
+        # token 索引精確指出包含這些 token 的 row group
+        hit = pd.Series([rg in fragments.get(os.path.normpath(f), ()) for f, rg in num_rows.index], index=num_rows.index, dtype=bool)
+        keep &= hit
+    elif tokens:
+        ids = get_engine().encode("token_mint_address", tokens)
+        if ids is not None:
+            lo, hi = col_range("token_id")
+            values = ids.values()
         else:
-            agg_sql = f"SELECT COUNT(*) AS count, AVG({col_expr(price_col)}) AS avg, MIN({col_expr(price_col)}) AS min, MAX({col_expr(price_col)}) AS max FROM read_parquet('{PARQUET_PATH}') WHERE {where_sql}"
-            stats = con.execute(agg_sql).fetchdf().to_dict('records')[0]
-            if not isinstance(stats, dict):
-                stats = dict(stats)
-        def safe_json(obj):
-            if isinstance(obj, dict):
-                return {k: safe_json(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [safe_json(x) for x in obj]
-            elif isinstance(obj, float):
-                # 统一处理所有非法JSON float
-                if obj == float('inf') or obj == float('-inf') or obj == 1e20 or obj == -1e20:
-                    return None
-                if obj != obj:  # NaN
-                    return None
-                return float(obj)
-            return obj
-        return safe_json(stats), None
+            lo, hi = col_range("token_mint_address", numeric=False)
+            values = tokens
+        hit = pd.Series(False, index=num_rows.index)
+        for t in values:
+            hit |= (lo <= t) & (hi >= t)
+        keep &= hit | lo.isna() | hi.isna()
+    if buy_price_filter in ('gt0', 'eq0'):
+        lo, hi = col_range("buy_price_sol")
+        hit = (hi > 0) if buy_price_filter == 'gt0' else ((lo <= 0) & (hi >= 0))
+        keep &= hit | lo.isna() | hi.isna()
+    bounds = bin_bounds(price_bin, bins)
+    if bounds:
+        low, high = bounds
+        scale = 1 if price_unit == "SOL" else sol_price
+        lo, hi = col_range(f"{price_type}_sol")
+        hit = hi * scale >= low
+        if high is not None:
+            hit &= lo * scale < high
+        keep &= hit | lo.isna() | hi.isna()
+    if start_time is not None or end_time is not None:
+        lo, hi = col_range("trade_timestamp")
+        hit = pd.Series(True, index=num_rows.index)
+        if start_time is not None:
+            hit &= hi >= start_time
+        if end_time is not None:
+            hit &= lo < end_time
+        keep &= hit | lo.isna() | hi.isna()
+    return int(num_rows[keep].sum())
+
+# 共用查詢+欄位補全函式：一條 SQL 同時返回當頁明細、總數與 SOL/USD 統計
+def query_and_enrich(
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    token_list: Optional[str] = None,
+    price_bin: Optional[int] = None,
+    page: int = 1,
+    page_size: int = 20,
+    buy_price_filter: Optional[str] = None,
+    bins: Optional[list] = None,
+    abnormal_only: bool = False,
+    abnormal_condition: str = "",
+    approx_total: bool = False,
+    cursor_values: Optional[list] = None,
+    fields: Optional[list] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    layout: str = "rows",
+    approx_stats: bool = False
+):
+    """
+    返回 (data, total, summary, next_cursor)，data 為引擎編碼好的 RawJSON（rows/columns 佈局）
+    或 pyarrow.Table（arrow 佈局；此時統計與分頁分成兩個查詢，統計照樣快取）。
+    分頁按 ORDER_COLUMNS 穩定排序；傳入 cursor_values 時改用 keyset 條件定位，不再 OFFSET。
+    統計子查詢與分頁子查詢在同一個計劃內執行，均為串流聚合，不把整列價格拉回 Python。
+    approx_total=True 時不做全量聚合，total 改由 parquet row group 統計估算，summary 只含估算的 count。
+    有預聚合 cube 且條件可由 cube 回答時，統計改從 cube 加總（結果精確），不再掃描全量明細；
+    統計按過濾條件快取，翻頁時不重算。
+    approx_stats=True 時統計另含近似分位數與不同 token/錢包數（cube 沒有錢包維度，此時統計走原始資料）。
+    """
+    con = get_engine().cursor()
+    filter_args = dict(
+        price_type=price_type,
+        price_unit=price_unit,
+        sol_price=sol_price,
+        token_list=token_list,
+        price_bin=price_bin,
+        buy_price_filter=buy_price_filter,
+        bins=bins,
+        start_time=start_time,
+        end_time=end_time
+    )
+    where_sql = build_where(abnormal_only=abnormal_only, abnormal_condition=abnormal_condition, **filter_args)
+    source = row_source(parse_token_list(token_list), anomalies=abnormal_only)
+    approx_stats = approx_stats and not approx_total
+    stats_exprs = price_stats_exprs(price_type, sol_price, approx=approx_stats)
+    order_sql = ", ".join(ORDER_COLUMNS)
+    if cursor_values is not None:
+        page_where = f"{where_sql} AND {keyset_condition(cursor_values)}"
+        limit_sql = f"LIMIT {page_size}"
+    else:
+        page_where = where_sql
+        limit_sql = f"LIMIT {page_size} OFFSET {(page-1)*page_size}"
+    page_sql = f"SELECT {detail_select_expr(sol_price, fields)} FROM {source} WHERE {page_where} ORDER BY {order_sql} {limit_sql}"
+    # 當頁資料在引擎內直接編碼成 JSON 陣列
+    page_agg_sql = f"SELECT {page_json_aggs(fields, layout)} FROM ({page_sql})"
+    # 統計與頁碼無關：翻頁時沿用快取的統計，或由 cube 給出，只需跑分頁查詢
+    summary = None
+    if not approx_total:
+        summary_key = make_key(
+            "summary", price_type=price_type, price_unit=price_unit, sol_price=sol_price, tokens=token_key(token_list),
+            bounds=bin_bounds(price_bin, bins), buy_price_filter=buy_price_filter,
+            abnormal=abnormal_condition if abnormal_only else None, start_time=start_time, end_time=end_time, approx_stats=approx_stats
+        )
+        version = get_engine().data_version()
+        found, summary = get_cache().get(summary_key, version)
+        if not found and not approx_stats:
+            summary = cube_summaries(
+                price_type, price_unit, sol_price, {"s": bin_bounds(price_bin, bins)}, token_list=token_list,
+                buy_price_filter=buy_price_filter, abnormal_only=abnormal_only, start_time=start_time, end_time=end_time
+            )
+            summary = summary and summary["s"]
+            if summary is not None:
+                get_cache().put(summary_key, summary, version)
+    agg_cols = ", ".join(f"{expr} AS {name}" for name, expr in stats_exprs.items())
+    if approx_total:
+        summary = {name: None for name in stats_exprs}
+        summary["count"] = approx_total_from_stats(**filter_args)
+    elif summary is None and layout == "arrow":
+        summary = summary_record(fetch_records(con, f"SELECT {agg_cols} FROM {source} WHERE {where_sql}")[0], stats_exprs)
+        get_cache().put(summary_key, summary, version)
+    if layout == "arrow":
+        data, keys = fetch_arrow_rows(con, page_sql, fields)
+        page_rec = arrow_page_recs(data, keys).get(())
+    elif summary is not None:
+        page_rec = fetch_records(con, page_agg_sql)[0]
+        data = RawJSON(page_rec["_data"])
+    else:
+        sql = f"""
+            SELECT s.*, p.*
+            FROM (SELECT {agg_cols} FROM {source} WHERE {where_sql}) s
+            CROSS JOIN ({page_agg_sql}) p
+        """
+        page_rec = fetch_records(con, sql)[0]
+        data = RawJSON(page_rec["_data"])
+        summary = summary_record(page_rec, stats_exprs)
+        get_cache().put(summary_key, summary, version)
+    total = summary["count"]
+    return data, total, safe_json(finish_summary(summary, sol_price)), page_cursor(page_rec, page_size)
 
 @app.get("/api/filter_data")
+@bounded("filter_data")
 def filter_data(
     price_type: str = Query("buy_price", pattern="^(buy_price|sell_price)$"),
     price_unit: str = Query("USD", pattern="^(SOL|USD)$"),
@@ -429,51 +1145,323 @@ def filter_data(
     page: int = Query(1, gt=0),
     page_size: int = Query(20, gt=0, le=200),
     buy_price_filter: Optional[str] = Query(None),
-    abnormal_only: bool = Query(False)
+    abnormal_only: bool = Query(False),
+    approx_total: bool = Query(False),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    start_time: Optional[int] = Query(None, ge=0),
+    end_time: Optional[int] = Query(None, ge=0),
+    format: Optional[str] = Query(None, pattern="^(rows|columns|arrow)$"),
+    approx_stats: bool = Query(False),
+    anomaly_flags: Optional[str] = Query(None),
+    spec: BinSpec = Depends(bin_spec),
+    accept: Optional[str] = Header(None)
 ):
+    """
+    start_time/end_time: trade_timestamp 毫秒範圍 [start_time, end_time)，分區資料集上按 trade_date 裁剪目錄
+    approx_stats: summary 另含近似分位數 p50/p90/p99（SOL/USD）與不同 token/錢包數 distinct_tokens/distinct_wallets
+    format: 明細佈局 rows（默认）| columns（每欄一個陣列）| arrow（Arrow IPC stream，信封在 schema metadata）；
+    不傳時 Accept 為 application/vnd.apache.arrow.stream 也返回 arrow
+    edges/log_buckets/log_min/log_max: price_bin 所用的區間（見 price_bins.py），默認 PRICE_BINS
+    anomaly_flags: 逗號分隔的異常旗標（見 anomaly.FLAGS），只返回帶其中任一旗標的行；與 abnormal_only 同時給出時取聯集
+    """
     try:
-        bins = [0, 10, 100, 1000, 10000, 100000, 1e20]
-        # 新增異常值過濾條件
-        abnormal_condition = "((type = 'buy_token' AND (buy_price_sol IS NULL OR buy_price_sol = 0 OR isnan(buy_price_sol))) OR (type = 'sell_token' AND (sell_price_sol IS NULL OR sell_price_sol = 0 OR isnan(sell_price_sol))))"
-        # 查詢明細
-        data, total = query_and_enrich(
-            price_type=price_type,
-            price_unit=price_unit,
-            sol_price=sol_price,
-            token_list=token_list,
-            price_bin=price_bin,
-            page=page,
-            page_size=page_size,
-            buy_price_filter=buy_price_filter,
-            bins=bins,
-            abnormal_only=abnormal_only,
-            abnormal_condition=abnormal_condition,
-            return_detail=True
-        )
-        # 查詢統計
-        summary, _ = query_and_enrich(
-            price_type=price_type,
-            price_unit=price_unit,
-            sol_price=sol_price,
-            token_list=token_list,
-            price_bin=price_bin,
-            page=page,
-            page_size=page_size,
-            buy_price_filter=buy_price_filter,
-            bins=bins,
-            abnormal_only=abnormal_only,
-            abnormal_condition=abnormal_condition,
-            return_detail=False
-        )
-        return {"data": data, "total": total, "page": page, "page_size": page_size, "summary": summary}
+        try:
+            cursor_values = decode_cursor(cursor) if cursor else None
+            field_list = resolve_fields(fields)
+            bins = resolve_edges(spec)
+            check_bin(price_bin, bins)
+            anomaly_mask = anomaly.parse_flags(anomaly_flags)
+            # 異常值過濾條件：有導入時算好的旗標時按位過濾，並只讀異常旁路檔
+            abnormal_condition = anomaly_filter(abnormal_only, anomaly_mask)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        layout = negotiate_layout(format, accept)
+
+        def compute():
+            data, total, summary, next_cursor = query_and_enrich(
+                price_type=price_type,
+                price_unit=price_unit,
+                sol_price=sol_price,
+                token_list=token_list,
+                price_bin=price_bin,
+                page=page,
+                page_size=page_size,
+                buy_price_filter=buy_price_filter,
+                bins=bins,
+                abnormal_only=bool(abnormal_condition),
+                abnormal_condition=abnormal_condition,
+                approx_total=approx_total,
+                cursor_values=cursor_values,
+                fields=field_list,
+                start_time=start_time,
+                end_time=end_time,
+                layout=layout,
+                approx_stats=approx_stats
+            )
+            result = {"total": total, "page": page, "page_size": page_size, "summary": summary, "next_cursor": next_cursor}
+            if approx_total:
+                result["total_approximate"] = True
+            if layout == "arrow":
+                return result, data
+            return {"data": data, **result}
+
+        return payload_response(cached_payload(
+            "filter_data", compute, layout, price_type=price_type, price_unit=price_unit, sol_price=sol_price,
+            tokens=token_key(token_list), bounds=bin_bounds(price_bin, bins), page=page, page_size=page_size,
+            buy_price_filter=buy_price_filter, abnormal_only=abnormal_only, anomaly_mask=anomaly_mask, approx_total=approx_total,
+            cursor=cursor_values, fields=field_list, start_time=start_time, end_time=end_time, approx_stats=approx_stats
+        ))
     except Exception as e:
         logger.error(f"/api/filter_data error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+def export_sql(
+    fmt: str,
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    token_list: Optional[str] = None,
+    price_bin: Optional[int] = None,
+    buy_price_filter: Optional[str] = None,
+    abnormal_only: bool = False,
+    fields: Optional[list] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    bins: Optional[list] = None,
+    anomaly_mask: int = 0
+):
+    """
+    導出查詢：條件與 filter_data 相同，欄位與明細相同（按 fields 投影）。
+    按資料存儲順序輸出（token、時間），不做全量排序，DuckDB 可以邊掃描邊吐出結果。
+    ndjson 時每行在引擎內編碼成一個 JSON 字串（浮點已清洗），其餘格式保留原始類型。
+    """
+    abnormal_condition = anomaly_filter(abnormal_only, anomaly_mask)
+    where_sql = build_where(
+        price_type=price_type, price_unit=price_unit, sol_price=sol_price, token_list=token_list, price_bin=price_bin,
+        buy_price_filter=buy_price_filter, bins=bins if bins is not None else PRICE_BINS,
+        abnormal_only=bool(abnormal_condition), abnormal_condition=abnormal_condition,
+        start_time=start_time, end_time=end_time
+    )
+    source = row_source(parse_token_list(token_list), anomalies=bool(abnormal_condition))
+    if fmt == "ndjson":
+        select = f"to_json({detail_row_struct(fields)}) AS line"
+    else:
+        names = [name for name, _ in output_columns() if fields is None or name in fields]
+        select = ", ".join(f'"{name}"' for name in names)
+    return f"SELECT {select} FROM (SELECT {detail_select_expr(sol_price, fields)} FROM {source} WHERE {where_sql})"
+
+@app.get("/api/export")
+async def export_data(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|arrow)$"),
+    price_type: str = Query("buy_price", pattern="^(buy_price|sell_price)$"),
+    price_unit: str = Query("USD", pattern="^(SOL|USD)$"),
+    sol_price: float = Query(133, gt=0),
+    token_list: Optional[str] = Query(None),
+    price_bin: Optional[int] = Query(None),
+    buy_price_filter: Optional[str] = Query(None),
+    abnormal_only: bool = Query(False),
+    fields: Optional[str] = Query(None),
+    start_time: Optional[int] = Query(None, ge=0),
+    end_time: Optional[int] = Query(None, ge=0),
+    anomaly_flags: Optional[str] = Query(None),
+    spec: BinSpec = Depends(bin_spec)
+):
+    """
+    串流導出整個過濾結果（條件同 filter_data，不分頁）：format=ndjson|csv|arrow（Arrow IPC stream）。
+    逐個 record batch 取出輸出，記憶體佔用與行數無關；客戶端讀得慢時查詢隨之暫停，斷線時中斷查詢。
+    """
+    try:
+        field_list = resolve_fields(fields)
+        bins = resolve_edges(spec)
+        check_bin(price_bin, bins)
+        anomaly_mask = anomaly.parse_flags(anomaly_flags)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    stream = ExportStream(lambda: export_sql(
+        format, price_type, price_unit, sol_price, token_list=token_list, price_bin=price_bin,
+        buy_price_filter=buy_price_filter, abnormal_only=abnormal_only, fields=field_list,
+        start_time=start_time, end_time=end_time, bins=bins, anomaly_mask=anomaly_mask
+    ), format)
+    try:
+        chunks = await get_executor().stream("export", stream)
+    except (QueryRejected, QueryTimeout, QueryCancelled) as e:
+        return error_response("export", e)
+    except Exception as e:
+        logger.error(f"/api/export error: {e}", exc_info=True)
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    media_type, ext = EXPORT_FORMATS[format]
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="trades.{ext}"'})
+
+# 分頁快取中「該頁沒有行」的記錄
+EMPTY_PAGE = {"_data": None, "_page_rows": 0}
+
+def query_bins(
+    price_type: str,
+    price_unit: str,
+    sol_price: float,
+    bins_idx: list,
+    bins_edges: list,
+    page_start: int = 1,
+    page_end: int = 1,
+    page_size: int = 20,
+    return_detail: bool = True,
+    cursor_values: Optional[list] = None,
+    fields: Optional[list] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    layout: str = "rows",
+    approx_stats: bool = False
+):
+    """
+    單次掃描完成多個價格區間的分組統計與分頁：
+    區間編號由 CASE 表達式一次算出，統計用 window 聚合（有快取或 cube 時省去），分頁用 row_number() 視窗。
+    傳入 cursor_values 時頁碼從 cursor 之後重新計數（page_start 為第一頁）。
+    返回 {idx: {'pages': {page: rows}, 'total', 'low', 'high', 'summary', 'next_cursor'}}。
+    arrow 佈局返回 (上述 dict, pyarrow.Table)：所有頁的行在同一張表裡，以 _bin/_page 欄區分，
+    dict 中 pages 為頁碼列表；統計沒有快取或 cube 時先用 GROUP BY 單獨算。
+    rows/columns 佈局的每一頁另外單獨快取，所需的頁都已快取（翻過或背景預取過，見 prefetch_bins）時不再掃描明細。
+    approx_stats=True 時統計另含草圖（見 price_stats_exprs），不走 cube，也不放進視窗聚合（草圖狀態不必複製到每一行），先用 GROUP BY 單獨算。
+    """
+    con = get_engine().cursor()
+    sol_col = f"{price_type}_sol"
+    price_expr = sol_col if price_unit == "SOL" else f"{sol_col}*{sol_price}"
+    bin_expr = bin_case_expr(price_expr, bins_edges, bins_idx)
+    ranges = [bin_bounds(idx, bins_edges) for idx in bins_idx]
+    scan_filters = time_filters(start_time, end_time) + partition_filters(price_type, price_unit, sol_price, ranges, start_time, end_time)
+    scan_where = " AND ".join(scan_filters) if scan_filters else "TRUE"
+    stats_exprs = price_stats_exprs(price_type, sol_price, approx=approx_stats)
+    # 各區間統計先查快取、再試 cube，拿到時明細查詢只需行號分頁；否則在同一次掃描裡用視窗聚合
+    version = get_engine().data_version()
+    summary_keys = {
+        idx: make_key("bin_summary", price_type=price_type, price_unit=price_unit, sol_price=sol_price,
+                      bounds=bounds, start_time=start_time, end_time=end_time, approx_stats=approx_stats)
+        for idx, bounds in zip(bins_idx, ranges)
+    }
+    summaries = {}
+    for idx, key in summary_keys.items():
+        found, summary = get_cache().get(key, version)
+        if not found:
+            break
+        summaries[idx] = summary
+    cached = len(summaries) == len(bins_idx)
+    if not cached and not approx_stats:
+        cube_result = cube_summaries(
+            price_type, price_unit, sol_price, {f"b{idx}": bounds for idx, bounds in zip(bins_idx, ranges)},
+            start_time=start_time, end_time=end_time
+        )
+        summaries = {} if cube_result is None else {idx: cube_result[f"b{idx}"] for idx in bins_idx}
+    # 分頁快取（rows/columns 佈局、不帶 cursor）：每頁單獨快取，翻過或預取過的頁不再掃描
+    pages = {idx: {} for idx in bins_idx}
+    page_keys = {}
+    if return_detail and cursor_values is None and layout != "arrow":
+        page_keys = {
+            (idx, p): make_key("bin_page", price_type=price_type, price_unit=price_unit, sol_price=sol_price, bounds=bounds,
+                               start_time=start_time, end_time=end_time, page=p, page_size=page_size, fields=fields, layout=layout)
+            for idx, bounds in zip(bins_idx, ranges) for p in range(page_start, page_end + 1)
+        }
+    for (idx, p), key in page_keys.items():
+        summary = summaries.get(idx)
+        if summary is not None and (p - 1) * page_size >= summary["count"]:
+            pages[idx][p] = EMPTY_PAGE  # 超出區間總行數的頁必定為空
+            continue
+        found, rec = get_cache().get(key, version)
+        if not found:
+            break
+        pages[idx][p] = rec
+    pages_cached = bool(page_keys) and all(p in pages[idx] for idx, p in page_keys)
+    if not summaries and (not return_detail or layout == "arrow" or pages_cached or approx_stats):
+        agg_cols = ", ".join(f"{expr} AS {name}" for name, expr in stats_exprs.items())
+        sql = f"SELECT {bin_expr} AS _bin, {agg_cols} FROM {TABLE_NAME} WHERE _bin IS NOT NULL AND {scan_where} GROUP BY _bin"
+        for rec in fetch_records(con, sql):
+            summaries[rec["_bin"]] = summary_record(rec, stats_exprs)
+        # 全部區間都沒有行時 summaries 仍為空，但統計已經算過
+        summaries = {idx: summaries.get(idx) for idx in bins_idx}
+    have_summaries = bool(summaries)
+    table = None
+    if return_detail and not pages_cached:
+        # 有 cursor 時只對 cursor 之後的行編號（_after），統計仍覆蓋整個區間
+        lo = 0 if cursor_values is not None else (page_start - 1) * page_size
+        hi = lo + (page_end - page_start + 1) * page_size
+        after_expr = keyset_condition(cursor_values) if cursor_values is not None else "TRUE"
+        order_sql = ", ".join(ORDER_COLUMNS)
+        if not have_summaries:
+            window_cols = ", " + ", ".join(f"{expr} OVER w AS _{name}" for name, expr in stats_exprs.items())
+            stat_cols = ", " + ", ".join(f"any_value(_{name}) AS {name}" for name in stats_exprs)
+            window_sql = "WINDOW w AS (PARTITION BY _bin)"
+            stats_row = " OR _rn = 1"
+        else:
+            window_cols = stat_cols = window_sql = stats_row = ""
+        # 內層：視窗統計 + 行號 + 頁碼；_page 為 NULL 的行只攜帶統計（每個 bin 的第一行）
+        rows_sql = f"""
+            SELECT *, CASE WHEN _after AND _rn > {lo} THEN (_rn - 1 - {lo}) // {page_size} + {page_start} END AS _page
+            FROM (
+                SELECT *{window_cols}, row_number() OVER (PARTITION BY _bin, _after ORDER BY {order_sql}) AS _rn
+                FROM (
+                    SELECT {detail_select_expr(sol_price, fields)}, {bin_expr} AS _bin, {after_expr} AS _after
+                    FROM {TABLE_NAME}
+                    WHERE {scan_where}
+                )
+                WHERE _bin IS NOT NULL
+                {window_sql}
+                QUALIFY (_after AND _rn > {lo} AND _rn <= {hi}){stats_row}
+            )
+        """
+        if layout == "arrow":
+            table, keys = fetch_arrow_rows(con, rows_sql, fields, keep=("_bin", "_page"))
+            for (idx, page), rec in arrow_page_recs(table, keys, ("_bin", "_page")).items():
+                pages[idx][page] = rec
+        else:
+            # 外層：按 (bin, 頁) 分組，每頁在引擎內編碼成 JSON
+            sql = f"SELECT _bin, _page{stat_cols}, {page_json_aggs(fields, layout)} FROM ({rows_sql}) GROUP BY _bin, _page"
+            for rec in fetch_records(con, sql):
+                idx = rec["_bin"]
+                if not have_summaries:
+                    summaries[idx] = {name: rec[name] for name in stats_exprs}
+                if rec["_page"] is not None:
+                    pages[idx][rec["_page"]] = rec
+    empty_summary = {name: None for name in stats_exprs}
+    empty_summary["count"] = 0
+    if not cached:
+        for idx, key in summary_keys.items():
+            get_cache().put(key, summaries.get(idx) or empty_summary, version)
+    result = {}
+    for (idx, p), key in page_keys.items():
+        if not pages_cached:
+            rec = pages[idx].get(p)
+            get_cache().put(key, {k: v for k, v in rec.items() if k.startswith(("_data", "_page_rows", "_last_"))} if rec else EMPTY_PAGE, version)
+    empty_page = RawJSON(dumps_json({name: [] for name, _ in detail_columns(fields)}) if layout == "columns" else None)
+    for idx in bins_idx:
+        summary = safe_json(finish_summary(summaries.get(idx) or empty_summary, sol_price))
+        if return_detail and layout == "arrow":
+            bin_pages = list(range(page_start, page_end + 1))
+            total = summary["count"]
+            cursor = page_cursor(pages[idx].get(page_end), page_size)
+        elif return_detail:
+            bin_pages = {p: RawJSON(pages[idx][p]["_data"]) if pages[idx].get(p, EMPTY_PAGE)["_page_rows"] else empty_page for p in range(page_start, page_end + 1)}
+            total = summary["count"]
+            cursor = page_cursor(pages[idx].get(page_end), page_size)
+        else:
+            # 只要統計時沿用舊行為：pages 內放統計結果、total 為 None
+            bin_pages = {p: summary for p in range(page_start, page_end + 1)}
+            total = None
+            cursor = None
+        low, high = bin_bounds(idx, bins_edges)
+        json_low, json_high = float(low), None if high is None else float(high)
+        result[idx] = {'pages': bin_pages, 'total': total, 'low': json_low, 'high': json_high, 'summary': summary, 'next_cursor': cursor}
+    if layout == "arrow":
+        if table is None:
+            # 只要統計時沒有明細，給一張只有欄位的空表
+            table = empty_detail_table(con, sol_price, fields)
+        return result, table
+    return result
+
 @app.get('/api/batch_bins_data')
+@bounded("batch_bins_data")
 def batch_bins_data(
-    price_type: str = Query("buy_price", regex="^(buy_price|sell_price)$"),
-    price_unit: str = Query("USD", regex="^(SOL|USD)$"),
+    price_type: str = Query("buy_price", pattern="^(buy_price|sell_price)$"),
+    price_unit: str = Query("USD", pattern="^(SOL|USD)$"),
     sol_price: float = Query(133, gt=0),
     bins: str = Query("3,4,5"),
     page: Optional[int] = Query(None, gt=0),
@@ -481,7 +1469,15 @@ def batch_bins_data(
     page_start: Optional[int] = Query(None, gt=0),
     page_end: Optional[int] = Query(None, gt=0),
     mode: Optional[str] = Query(None),
-    return_detail: bool = Query(True)
+    return_detail: bool = Query(True),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    start_time: Optional[int] = Query(None, ge=0),
+    end_time: Optional[int] = Query(None, ge=0),
+    format: Optional[str] = Query(None, pattern="^(rows|columns|arrow)$"),
+    approx_stats: bool = Query(False),
+    spec: BinSpec = Depends(bin_spec),
+    accept: Optional[str] = Header(None)
 ):
     """
     多模式 batch_bins_data：
@@ -489,106 +1485,82 @@ def batch_bins_data(
     - page_start/page_end: 返回某 bin 的多页（如1-5页）
     - page: 返回某 bin 的单页
     支持 bins=2,3,4,5,1,0
+    所有模式都只做一次掃描（見 query_bins）。
+    cursor: 上次返回的 next_cursor（只能配合单个 bin 使用），从该位置继续翻页
+    fields: 返回欄位，预设集 table（默认）/full 或逗号分隔的欄位名
+    start_time/end_time: trade_timestamp 毫秒范围 [start_time, end_time)
+    format: 明细布局 rows（默认）| columns | arrow（所有页的行在一张 Arrow 表里，以 _bin/_page 区分），同 filter_data
+    approx_stats: 各区间 summary 另含近似分位数与不同 token/钱包数，同 filter_data
+    edges/log_buckets: 区间边界（默认六个 USD 区间），bins 为其中的区间编号
     """
     try:
+        try:
+            bins_edges = resolve_edges(spec)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
         bins_idx = [int(x) for x in bins.split(",") if x.strip().isdigit()]
-        bins_edges = [0, 10, 100, 1000, 10000, 100000, 1e20]
-        result = {}
+        bins_idx = [idx for idx in dict.fromkeys(bins_idx) if idx < len(bins_edges) - 1]
+        if not bins_idx:
+            return JSONResponse(content={"error": "bins 参数不合法"}, status_code=400)
+        try:
+            cursor_values = decode_cursor(cursor) if cursor else None
+            field_list = resolve_fields(fields)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        if cursor_values is not None and len(bins_idx) != 1:
+            return JSONResponse(content={"error": "cursor 只能配合单个 bin 使用"}, status_code=400)
+        query_args = dict(
+            price_type=price_type,
+            price_unit=price_unit,
+            sol_price=sol_price,
+            bins_edges=bins_edges,
+            page_size=page_size,
+            return_detail=return_detail,
+            cursor_values=cursor_values,
+            fields=field_list,
+            start_time=start_time,
+            end_time=end_time,
+            layout=negotiate_layout(format, accept),
+            approx_stats=approx_stats
+        )
         # 模式A：mode=init，所有 bins 的第一页
         if mode == 'init':
-            for idx in bins_idx:
-                data, total = query_and_enrich(
-                    price_type=price_type,
-                    price_unit=price_unit,
-                    sol_price=sol_price,
-                    price_bin=idx,
-                    bins=bins_edges,
-                    page=1,
-                    page_size=page_size,
-                    return_detail=return_detail
-                )
-                summary, _ = query_and_enrich(
-                    price_type=price_type,
-                    price_unit=price_unit,
-                    sol_price=sol_price,
-                    price_bin=idx,
-                    bins=bins_edges,
-                    page=1,
-                    page_size=1000000,
-                    return_detail=False
-                )
-                json_high = None if idx+1 == len(bins_edges)-1 else float(bins_edges[idx+1])
-                json_low = float(bins_edges[idx])
-                result[idx] = {'pages': {1: data}, 'total': total, 'low': json_low, 'high': json_high, 'summary': summary}
-            return result
+            bin_args = dict(bins_idx=bins_idx, page_start=1, page_end=1)
         # 模式B：批量多页
         elif page_start and page_end:
-            idx = bins_idx[0]  # 只支持单bin批量多页
-            pages = {}
-            total = 0
-            # 修复：对每一页单独查询数据，确保每页正确的记录数
-            for p in range(page_start, page_end+1):
-                # 确保每页使用正确的page参数，并指定正确的page_size
-                data, t = query_and_enrich(
-                    price_type=price_type,
-                    price_unit=price_unit,
-                    sol_price=sol_price,
-                    price_bin=idx,
-                    bins=bins_edges,
-                    page=p,  # 关键修复：确保每页使用正确的页码
-                    page_size=page_size,  # 使用指定的page_size
-                    return_detail=return_detail
-                )
-                # 记录该页的数据，每页应有page_size条（除非最后一页可能少于page_size）
-                pages[p] = data
-                total = t  # 保留总记录数
-            summary, _ = query_and_enrich(
-                price_type=price_type,
-                price_unit=price_unit,
-                sol_price=sol_price,
-                price_bin=idx,
-                bins=bins_edges,
-                page=1,
-                page_size=1000000,
-                return_detail=False
-            )
-            json_high = None if idx+1 == len(bins_edges)-1 else float(bins_edges[idx+1])
-            json_low = float(bins_edges[idx])
-            result[idx] = {'pages': pages, 'total': total, 'low': json_low, 'high': json_high, 'summary': summary}
-            return result
+            bin_args = dict(bins_idx=bins_idx[:1], page_start=page_start, page_end=page_end)  # 只支持单bin批量多页
         # 模式C：单页
         elif page:
-            for idx in bins_idx:
-                data, total = query_and_enrich(
-                    price_type=price_type,
-                    price_unit=price_unit,
-                    sol_price=sol_price,
-                    price_bin=idx,
-                    bins=bins_edges,
-                    page=page,
-                    page_size=page_size,
-                    return_detail=return_detail
-                )
-                summary, _ = query_and_enrich(
-                    price_type=price_type,
-                    price_unit=price_unit,
-                    sol_price=sol_price,
-                    price_bin=idx,
-                    bins=bins_edges,
-                    page=1,
-                    page_size=1000000,
-                    return_detail=False
-                )
-                json_high = None if idx+1 == len(bins_edges)-1 else float(bins_edges[idx+1])
-                json_low = float(bins_edges[idx])
-                result[idx] = {'pages': {page: data}, 'total': total, 'low': json_low, 'high': json_high, 'summary': summary}
-            return result
+            bin_args = dict(bins_idx=bins_idx, page_start=page, page_end=page)
         else:
             return {"error": "参数不合法，需指定 mode=init 或 page_start/page_end 或 page"}
+        payload = cached_payload("batch_bins_data", lambda: query_bins(**bin_args, **query_args), **bin_args, **query_args)
+        # 使用者接下來多半往後翻頁：在背景把各區間之後的幾頁算進分頁快取
+        if return_detail and cursor_values is None and query_args["layout"] != "arrow":
+            prefetch_bins(bin_args["bins_idx"], bin_args["page_end"] + 1, **query_args)
+        return payload_response(payload)
     except Exception as e:
         logger.error(f"/api/batch_bins_data error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+def prefetch_bins(bins_idx, page_start, pages=PREFETCH_PAGES, **query_args):
+    """在背景把各區間從 page_start 起的 pages 頁算進分頁快取（見 query_bins），已快取的頁不重算。"""
+    if pages <= 0:
+        return
+    page_end = page_start + pages - 1
+    key = make_key("prefetch_bins", bins_idx=bins_idx, page_start=page_start, page_end=page_end, **query_args)
+    get_prefetcher().submit(key, lambda: query_bins(bins_idx=bins_idx, page_start=page_start, page_end=page_end, **query_args))
+
+def warm_up(view=WARMUP_VIEW):
+    """啟動預熱：預設視圖（前端首屏 mode=init）各區間的統計與前 1+PREFETCH_PAGES 頁在背景算進快取。"""
+    if not view:
+        return
+    prefetch_bins(
+        view["bins"], 1, pages=1 + PREFETCH_PAGES, price_type=view["price_type"], price_unit=view["price_unit"],
+        sol_price=view["sol_price"], bins_edges=list(PRICE_BINS), page_size=view["page_size"], return_detail=True,
+        cursor_values=None, fields=resolve_fields(None), start_time=None, end_time=None, layout="rows"
+    )
+
 @app.post("/api/birdeye_prices")
 def birdeye_prices(trades: List[dict]):
     """
@@ -602,18 +1574,47 @@ def birdeye_prices(trades: List[dict]):
         logger.error(f"/api/birdeye_prices error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+def dataset_slot_timestamps(slots):
+    """從資料集的 trade_timestamp 取各 slot 的最早成交時間（秒），作為 RPC 查不到時的後備。"""
+    if not slots:
+        return {}
+    slot_list = ",".join(str(int(x)) for x in slots)
+    sql = f"""
+        SELECT transaction_slot, MIN(trade_timestamp) AS ts
+        FROM {TABLE_NAME}
+        WHERE transaction_slot IN ({slot_list})
+        GROUP BY transaction_slot
+    """
+    result = {}
+    for rec in fetch_records(get_engine().cursor(), sql):
+        ts = rec["ts"]
+        if ts is not None:
+            # 13位數為毫秒
+            result[int(rec["transaction_slot"])] = int(ts // 1000) if ts >= 1e10 else int(ts)
+    return result
+
 @app.post("/api/slot_timestamps")
 def slot_timestamps_api(req: dict):
     """
-    批量获取Solana slot的区块时间戳。POST: {slots: [slot1, slot2, ...]}
-    返回: {timestamps: {slot: timestamp, ...}}
+    批量获取Solana slot的区块时间戳。POST: {slots: [slot1, slot2, ...], interpolate: false, fallback: false}
+    - interpolate: 未缓存的 slot 先用最近的已知 slot 插值估算，估不出来的再走 RPC
+    - fallback: RPC 仍查不到时，用数据集中该 slot 的 trade_timestamp
+    返回: {timestamps: {slot: timestamp, ...}, sources: {slot: cache|interpolated|rpc|dataset, ...}}
     """
     try:
         slots = req.get("slots", [])
         if not isinstance(slots, list):
             return JSONResponse(content={"error": "slots参数必须为列表"}, status_code=400)
-        timestamps = get_slot_timestamps(slots)
-        return {"timestamps": timestamps}
+        try:
+            slots = [int(x) for x in slots]
+        except (TypeError, ValueError):
+            return JSONResponse(content={"error": "slots参数必须为整数列表"}, status_code=400)
+        timestamps, sources = get_resolver().resolve(slots, interpolate=bool(req.get("interpolate", False)))
+        if req.get("fallback", False):
+            unresolved = [x for x in timestamps if timestamps[x] is None]
+            for slot, ts in dataset_slot_timestamps(unresolved).items():
+                timestamps[slot], sources[slot] = ts, "dataset"
+        return {"timestamps": timestamps, "sources": sources}
     except Exception as e:
         logger.error(f"/api/slot_timestamps error: {e}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
@@ -0,0 +1,243 @@
+# backend/metrics.py
+# 請求級計時與進程級指標。
+# 每個請求在 RequestLogMiddleware（main.py）裡建立一個 RequestTrace，放在 contextvar 中；查詢線程池（executor.py）
+# 以複製的 context 執行，同一請求的排隊、SQL 執行、結果轉換、編碼各階段耗時都記在同一個 trace 上，
+# 響應時以 Server-Timing 頭返回並寫一行結構化日誌，同時累加到進程級的 Metrics，由 /metrics 以 Prometheus 文本格式輸出。
+
+import contextvars
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import METRICS_LATENCY_BUCKETS
+
+# Server-Timing / 日誌中各階段的順序：
+# queue 等待查詢名額與線程，sql DuckDB 執行，fetch 結果轉成 Python/Arrow，encode 編碼成 JSON 或 Arrow IPC
+STAGES = ("queue", "sql", "fetch", "encode")
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """一次請求的分段耗時（秒）與執行過的查詢；profile 為 True 時另存每個查詢的 EXPLAIN ANALYZE 輸出。"""
+
+    def __init__(self, profile=False):
+        self.started = time.perf_counter()
+        self.profile = profile
+        self.stages = {}
+        self.queries = []
+        self.plans = []
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def record_query(self, sql, seconds, rows_scanned=None, rows_returned=None):
+        """記下一個查詢，返回其記錄（行數可在結果取完後再補上）。"""
+        self.add("sql", seconds)
+        query = {"sql": sql, "ms": round(seconds * 1000, 2), "rows_scanned": rows_scanned, "rows_returned": rows_returned}
+        self.queries.append(query)
+        return query
+
+    def rows(self, key):
+        values = [q[key] for q in self.queries if q[key] is not None]
+        return sum(values) if values else None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        """Server-Timing 頭的值（毫秒）；沒有發生的階段不出現。"""
+        parts = []
+        for name in STAGES:
+            if name not in self.stages:
+                continue
+            part = f"{name};dur={self.stages[name] * 1000:.1f}"
+            if name == "sql":
+                part += f';desc="{len(self.queries)} queries"'
+            parts.append(part)
+        parts.append(f"total;dur={(self.elapsed() if total is None else total) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self):
+        """結構化日誌用的摘要（毫秒）。"""
+        return {
+            "stages_ms": {name: round(self.stages[name] * 1000, 2) for name in STAGES if name in self.stages},
+            "queries": len(self.queries),
+            "rows_scanned": self.rows("rows_scanned"),
+            "rows_returned": self.rows("rows_returned"),
+        }
+
+
+def start_trace(profile=False):
+    """為當前請求建立 trace，返回 (trace, token)；請求結束後以 token 呼叫 end_trace。"""
+    trace = RequestTrace(profile)
+    return trace, _trace.set(trace)
+
+
+def end_trace(token):
+    _trace.reset(token)
+
+
+def current_trace():
+    """當前請求的 trace；不在請求內（啟動預熱、背景預取）時為 None。"""
+    return _trace.get()
+
+
+def add_stage(name, seconds):
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """把區塊耗時累加到當前請求的 name 階段；不在請求內時不計時。"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+class Histogram:
+    """Prometheus 風格的直方圖：各桶計數（輸出時再累加成 le 累計值）、總數與總和。"""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(le 標籤, 累計數)]，最後一個為 +Inf。"""
+        result, total = [], 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((bound if bound == "+Inf" else format_value(bound), total))
+        return result
+
+
+class Metrics:
+    """進程級請求指標，按端點（路由模板）累計；所有方法線程安全。"""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.stage_seconds = {}
+        self.queries = {}
+        self.rows_scanned = {}
+        self.rows_returned = {}
+
+    def observe(self, endpoint, status, seconds, trace=None):
+        with self.lock:
+            key = (endpoint, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(endpoint, Histogram(self.buckets)).observe(seconds)
+            if trace is None:
+                return
+            for name, value in trace.stages.items():
+                self.stage_seconds[(endpoint, name)] = self.stage_seconds.get((endpoint, name), 0.0) + value
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + len(trace.queries)
+            for counter, key in ((self.rows_scanned, "rows_scanned"), (self.rows_returned, "rows_returned")):
+                rows = trace.rows(key)
+                if rows is not None:
+                    counter[endpoint] = counter.get(endpoint, 0) + rows
+
+    def render(self):
+        """請求相關指標的 Prometheus 文本行。"""
+        lines = []
+        with self.lock:
+            metric(lines, "pricechecker_requests_total", "counter", "HTTP requests by endpoint and status",
+                   [({"endpoint": e, "status": s}, n) for (e, s), n in sorted(self.requests.items())])
+            name = "pricechecker_request_duration_seconds"
+            lines.append(f"# HELP {name} Request latency by endpoint")
+            lines.append(f"# TYPE {name} histogram")
+            for endpoint, hist in sorted(self.latency.items()):
+                for le, count in hist.cumulative():
+                    lines.append(sample(f"{name}_bucket", {"endpoint": endpoint, "le": le}, count))
+                lines.append(sample(f"{name}_sum", {"endpoint": endpoint}, hist.sum))
+                lines.append(sample(f"{name}_count", {"endpoint": endpoint}, hist.count))
+            metric(lines, "pricechecker_stage_seconds_total", "counter", "Time spent per request stage",
+                   [({"endpoint": e, "stage": s}, v) for (e, s), v in sorted(self.stage_seconds.items())])
+            metric(lines, "pricechecker_queries_total", "counter", "DuckDB queries executed for requests",
+                   [({"endpoint": e}, n) for e, n in sorted(self.queries.items())])
+            metric(lines, "pricechecker_rows_scanned_total", "counter", "Rows scanned by DuckDB for requests",
+                   [({"endpoint": e}, n) for e, n in sorted(self.rows_scanned.items())])
+            metric(lines, "pricechecker_rows_returned_total", "counter", "Result rows returned by DuckDB for requests",
+                   [({"endpoint": e}, n) for e, n in sorted(self.rows_returned.items())])
+        return lines
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+def sample(name, labels, value):
+    if labels:
+        label_text = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+        return f"{name}{{{label_text}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+
+def metric(lines, name, kind, help_text, samples):
+    """追加一個指標族（HELP/TYPE + 樣本）；samples 為 [(labels, value)]，值為 None 的樣本略過。"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        if value is not None:
+            lines.append(sample(name, labels, value))
+
+
+def render_prometheus(metrics, cache=None, queries=None, prefetch=None):
+    """
+    /metrics 的完整文本：請求指標 + 結果快取（result_cache.stats）、查詢執行層（executor.stats）、
+    背景預取（prefetch.stats）的計數與當前值。
+    """
+    lines = metrics.render()
+    if cache is not None:
+        for key in ("hits", "misses", "evictions", "invalidations", "expirations", "coalesced"):
+            metric(lines, f"pricechecker_cache_{key}_total", "counter", f"Result cache {key}", [({}, cache[key])])
+        for key in ("entries", "bytes", "max_bytes", "inflight"):
+            metric(lines, f"pricechecker_cache_{key}", "gauge", f"Result cache {key}", [({}, cache[key])])
+    if queries is not None:
+        for key, kind in (("running", "gauge"), ("waiting", "gauge"), ("rejected", "counter"),
+                          ("timeouts", "counter"), ("cancelled", "counter")):
+            name = f"pricechecker_query_{key}" + ("_total" if kind == "counter" else "")
+            metric(lines, name, kind, f"Query executor {key} by endpoint",
+                   [({"endpoint": e}, s[key]) for e, s in sorted(queries.items())])
+    if prefetch is not None:
+        metric(lines, "pricechecker_prefetch_pending", "gauge", "Queued prefetch tasks", [({}, prefetch["pending"])])
+        metric(lines, "pricechecker_prefetch_tasks_total", "counter", "Prefetch tasks by outcome",
+               [({"outcome": k}, v) for k, v in prefetch.items() if k != "pending"])
+    return "\n".join(lines) + "\n"
+
+
+def log_record(method, path, endpoint, status, seconds, trace):
+    """每請求一行的結構化日誌（JSON）。"""
+    record = {"event": "request", "method": method, "path": path, "endpoint": endpoint,
+              "status": status, "ms": round(seconds * 1000, 2)}
+    if trace is not None:
+        record.update(trace.summary())
+    return json.dumps(record, ensure_ascii=False)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
@@ -0,0 +1,101 @@
+# backend/prefetch.py
+# 背景預取：前台請求返回後，把接下來大概率會翻到的頁在背景算進結果快取（分頁快取見 main.query_bins），
+# 啟動時預熱預設視圖。預取在獨立的小線程池裡執行，前台有查詢在跑或排隊時讓路，等太久就放棄，不與前台搶 DuckDB。
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREFETCH_IDLE_WAIT, PREFETCH_MAX_PENDING, PREFETCH_WORKERS
+from executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+# 等前台空閒時的輪詢間隔（秒）
+IDLE_POLL = 0.05
+
+
+class Prefetcher:
+    """預取任務佇列：同一 key 同時只排一個，排隊數達到 max_pending 時丟棄新任務。"""
+
+    def __init__(self, workers=PREFETCH_WORKERS, max_pending=PREFETCH_MAX_PENDING, idle_wait=PREFETCH_IDLE_WAIT):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.max_pending = max_pending
+        self.idle_wait = idle_wait
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.counts = {"submitted": 0, "completed": 0, "dropped": 0, "skipped": 0, "failed": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def submit(self, key, fn):
+        """排入一個預取任務 fn()；已有同 key 任務或佇列已滿時返回 False。"""
+        with self.lock:
+            if key in self.pending or len(self.pending) >= self.max_pending:
+                self.counts["dropped"] += 1
+                return False
+            self.pending.add(key)
+            self.counts["submitted"] += 1
+        try:
+            self.pool.submit(self._run, key, fn)
+        except RuntimeError:
+            # 已關閉（進程退出中）
+            with self.lock:
+                self.pending.discard(key)
+            return False
+        return True
+
+    def _wait_idle(self):
+        """等到前台沒有查詢在執行或排隊；超過 idle_wait 返回 False。"""
+        deadline = time.monotonic() + self.idle_wait
+        while get_executor().busy():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(IDLE_POLL)
+        return True
+
+    def _run(self, key, fn):
+        try:
+            if not self._wait_idle():
+                self._count("skipped")
+                return
+            fn()
+            self._count("completed")
+        except Exception as e:
+            self._count("failed")
+            logger.warning(f"prefetch {key[0]} failed: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return {"pending": len(self.pending), **self.counts}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """取得進程級預取器（惰性初始化，線程安全）。"""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def close_prefetcher():
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is not None:
+            _prefetcher.shutdown()
+            _prefetcher = None
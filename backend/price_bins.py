@@ -0,0 +1,134 @@
+# backend/price_bins.py
+# 價格區間規格：帶 price_bin 的端點（filter_data、batch_bins_data、random_sample、export）與 price_ranges、histogram 共用。
+# 預設為 config.PRICE_BINS；請求可用 edges=遞增邊界（逗號分隔，最後一個可寫 inf）或 log_buckets=N
+# （在 [log_min, log_max) 間取 N 個對數等距桶）替換。相鄰兩個邊界為一個區間 [low, high)，
+# 最後一個邊界為 inf 或不小於 1e20（PRICE_BINS 的哨兵）時最後一個區間沒有上界。
+
+import math
+from typing import NamedTuple, Optional
+
+from fastapi import Query
+
+from config import LOG_BUCKETS_RANGE, PRICE_BINS, PRICE_BINS_MAX
+
+# 不小於此值的邊界視為無上界
+UNBOUNDED = 1e20
+
+
+class BinSpec(NamedTuple):
+    edges: Optional[str] = None
+    log_buckets: Optional[int] = None
+    log_min: Optional[float] = None
+    log_max: Optional[float] = None
+
+
+async def bin_spec(
+    edges: Optional[str] = Query(None, description="逗号分隔的递增区间边界，最后一个可为 inf（无上界）"),
+    log_buckets: Optional[int] = Query(None, gt=0, le=PRICE_BINS_MAX, description="对数等距桶数，与 edges 二选一"),
+    log_min: Optional[float] = Query(None, gt=0),
+    log_max: Optional[float] = Query(None, gt=0),
+):
+    """端點共用的區間參數（FastAPI 依賴）；在端點裡用 resolve_edges 解析，格式錯誤時返回 400。"""
+    return BinSpec(edges, log_buckets, log_min, log_max)
+
+
+def resolve_edges(spec=None):
+    """BinSpec → 邊界列表；沒有指定時為 PRICE_BINS。不合法時拋出 ValueError。"""
+    if spec is None or (spec.edges is None and spec.log_buckets is None):
+        return list(PRICE_BINS)
+    if spec.edges is not None and spec.log_buckets is not None:
+        raise ValueError("edges 与 log_buckets 只能指定一个")
+    if spec.log_buckets is not None:
+        low = spec.log_min if spec.log_min is not None else LOG_BUCKETS_RANGE[0]
+        high = spec.log_max if spec.log_max is not None else LOG_BUCKETS_RANGE[1]
+        if not 0 < low < high:
+            raise ValueError("log_min 必须小于 log_max")
+        step = (math.log10(high) - math.log10(low)) / spec.log_buckets
+        edges = [10 ** (math.log10(low) + i * step) for i in range(spec.log_buckets)] + [float(high)]
+        edges[0] = float(low)
+        return edges
+    try:
+        edges = [float(x) for x in spec.edges.split(",") if x.strip()]
+    except ValueError:
+        raise ValueError("edges 参数不合法")
+    if len(edges) < 2 or len(edges) - 1 > PRICE_BINS_MAX:
+        raise ValueError(f"edges 需要 2 到 {PRICE_BINS_MAX + 1} 个边界")
+    if any(math.isnan(x) or math.isinf(x) and i < len(edges) - 1 for i, x in enumerate(edges)):
+        raise ValueError("只有最后一个边界可以为 inf")
+    if any(a >= b for a, b in zip(edges, edges[1:])):
+        raise ValueError("edges 必须严格递增")
+    return [UNBOUNDED if math.isinf(x) else (int(x) if x.is_integer() else x) for x in edges]
+
+
+def sql_number(value):
+    """
+    數值的 SQL 字面量：整數原樣，其餘浮點寫成科學記號（DuckDB 按 DOUBLE 精確解析；
+    普通小數會先當成 DECIMAL，轉 DOUBLE 時可能差一個 ulp，落在邊界上的值就會分到不同區間）。
+    """
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+        return str(int(value))
+    return f"{float(value):.17e}"
+
+
+def is_unbounded(edge):
+    return edge >= UNBOUNDED
+
+
+def bin_bounds(price_bin, edges):
+    """返回 (low, high)，無上界的最後一個區間 high 為 None；price_bin 不合法時返回 None。"""
+    if edges is None or price_bin is None or not 0 <= price_bin < len(edges) - 1:
+        return None
+    high = edges[price_bin + 1]
+    return edges[price_bin], None if is_unbounded(high) else high
+
+
+def check_bin(price_bin, edges):
+    """price_bin 有給出但不在 edges 的區間內時拋出 ValueError（端點返回 400，不當成不過濾）。"""
+    if price_bin is not None and bin_bounds(price_bin, edges) is None:
+        raise ValueError("price_bin 超出区间范围")
+
+
+def format_edge(value):
+    """邊界的簡寫（10、1K、2.5M），用於區間標籤。"""
+    for unit, scale in (("B", 1e9), ("M", 1e6), ("K", 1e3)):
+        if abs(value) >= scale:
+            return f"{value / scale:g}{unit}"
+    return f"{value:g}"
+
+
+def bin_label(low, high):
+    """區間標籤：0-10、100K以上。"""
+    if high is None:
+        return f"{format_edge(low)}以上"
+    return f"{format_edge(low)}-{format_edge(high)}"
+
+
+def bin_index_expr(price_expr, edges):
+    """
+    price_expr 所在區間編號（0 起）；低於第一個邊界為 -1，高於有上界的最後一個邊界為區間數，NULL/NaN 為 NULL。
+    對數等距桶按對數直接算出編號再對照邊界校正一次，不論桶數多少都是常數成本；其他邊界用 CASE。
+    """
+    n = len(edges) - 1
+    bounded = not is_unbounded(edges[-1])
+    head = f"CASE WHEN {price_expr} IS NULL OR isnan({price_expr}) THEN NULL WHEN {price_expr} < {sql_number(edges[0])} THEN -1 "
+    if bounded:
+        head += f"WHEN {price_expr} >= {sql_number(edges[-1])} THEN {n} "
+    if n > 8 and edges[0] > 0 and _log_spaced(edges if bounded else edges[:-1]):
+        last = n if bounded else n - 1
+        step = (math.log10(edges[last]) - math.log10(edges[0])) / last
+        guess = (
+            f"least(greatest(CAST(floor((log10({price_expr}) - {sql_number(math.log10(edges[0]))}) / {sql_number(step)}) AS INTEGER), 0), {n - 1})"
+        )
+        bounds = "[" + ", ".join(f"{float(x):.17e}" for x in edges) + "]"
+        # 浮點誤差可能讓剛好落在邊界上的值偏一格：與該格的上下邊界比較後修正
+        return (
+            f"{head}ELSE {guess} - CAST({price_expr} < {bounds}[{guess} + 1] AS INTEGER) "
+            f"+ CAST({guess} + 1 < {n} AND {price_expr} >= {bounds}[{guess} + 2] AS INTEGER) END"
+        )
+    whens = " ".join(f"WHEN {price_expr} < {sql_number(edges[i + 1])} THEN {i}" for i in range(n - 1))
+    return f"{head}{whens} ELSE {n - 1} END"
+
+
+def _log_spaced(edges):
+    ratios = [math.log10(b) - math.log10(a) for a, b in zip(edges, edges[1:])]
+    return max(ratios) - min(ratios) < 1e-9 * max(1.0, abs(max(ratios)))
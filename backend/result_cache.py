@@ -0,0 +1,236 @@
+# backend/result_cache.py
+# 查詢結果快取：key 由正規化後的查詢參數組成，LRU 按近似位元組數淘汰；
+# 每項記錄寫入時的資料版本（Engine.data_version），資料集重新生成或追加新批次後舊結果自動失效。
+# get_or_compute 帶 single-flight：同一 key 同時到達的請求只算一次，其餘等待並共用結果；
+# 領頭的計算被中斷（超時/斷線取消）時不把中斷傳給等待者，它們重新競爭、由其中一個接著算；
+# 等待者自己的請求被取消時也不再等。
+# profile=1 的請求（見 metrics.py）不讀快取，以便看到真正執行的查詢；算出的結果照常寫入。
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import duckdb
+
+from config import RESULT_CACHE_FOLLOWER_WAIT, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL
+from executor import current_task
+from metrics import current_trace
+from serialize import RawJSON
+
+# 每項的固定開銷估算（key、OrderedDict 節點、元組）
+ENTRY_OVERHEAD = 200
+# 跟隨者每等這麼久（秒）檢查一次自己的請求是否已取消
+FOLLOWER_POLL = 0.1
+
+
+def normalize(value):
+    """參數值正規化：list/tuple 轉元組、數字統一成 float/int，None 與字串原樣。"""
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def profiling():
+    trace = current_trace()
+    return trace is not None and trace.profile
+
+
+def make_key(namespace, **params):
+    """(namespace, ((參數名, 值), ...))，參數按名稱排序，等價的請求得到相同的 key。"""
+    return namespace, tuple(sorted((k, normalize(v)) for k, v in params.items()))
+
+
+def approx_size(value):
+    """結果的近似記憶體佔用（位元組）。"""
+    if isinstance(value, RawJSON):
+        return len(value.text)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(approx_size(v) for v in value) + 56
+    return sys.getsizeof(value)
+
+
+def shared_error(error):
+    """領頭計算的異常是否傳給等待者：中斷只針對領頭的那個請求，不算查詢本身的錯誤。"""
+    return not isinstance(error, duckdb.InterruptException)
+
+
+class Flight:
+    """一次進行中的計算；跟隨者等 done 後讀 value/error。"""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    線程安全的 LRU 結果快取，總大小不超過 max_bytes；ttl 為 None 表示只靠資料版本失效。
+    wait_timeout 為跟隨者等待領頭計算的時限（秒），超過後自己計算。
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL,
+                 wait_timeout: float = RESULT_CACHE_FOLLOWER_WAIT):
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, version, size, expires_at)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.expirations = 0
+        self.inflight = {}  # (key, version) -> Flight
+        self.coalesced = 0
+
+    def _drop(self, key):
+        _, _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def _lookup(self, key, version):
+        """持鎖呼叫；版本不符或已過期的項順帶清掉。"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        value, entry_version, _, expires_at = entry
+        if entry_version != version:
+            self._drop(key)
+            self.invalidations += 1
+        elif expires_at is not None and expires_at <= time.time():
+            self._drop(key)
+            self.expirations += 1
+        else:
+            self.entries.move_to_end(key)
+            return True, value
+        return False, None
+
+    def get(self, key, version):
+        """命中返回 (True, value)，否則 (False, None)。"""
+        if profiling():
+            return False, None
+        with self.lock:
+            found, value = self._lookup(key, version)
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found, value
+
+    def put(self, key, value, version, size=None):
+        size = (approx_size(value) if size is None else size) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, version, size, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, version, compute):
+        """
+        快取未命中時呼叫 compute() 並寫入；同一 (key, version) 已有計算在進行時不重複計算，
+        等它完成後共用結果。查詢錯誤一併傳給等待者（不快取）；領頭的計算被中斷時等待者重新查找，
+        沒有新的領頭者就自己當領頭者。等待超過 wait_timeout 時不再等，自己計算（不與他人合併）。
+        """
+        if profiling():
+            value = compute()
+            self.put(key, value, version)
+            return value
+        while True:
+            with self.lock:
+                found, value = self._lookup(key, version)
+                if found:
+                    self.hits += 1
+                    return value
+                flight = self.inflight.get((key, version))
+                if flight is None:
+                    self.misses += 1
+                    flight = self.inflight[(key, version)] = Flight()
+                    break
+                self.coalesced += 1
+            if not self._wait(flight):
+                value = compute()
+                self.put(key, value, version)
+                return value
+            if flight.error is None:
+                return flight.value
+            if shared_error(flight.error):
+                raise flight.error
+        try:
+            flight.value = compute()
+            self.put(key, flight.value, version)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop((key, version), None)
+            flight.done.set()
+
+    def _wait(self, flight):
+        """
+        分段等待領頭計算完成，返回是否完成；超過 wait_timeout 返回 False。
+        自己所在的查詢任務被取消（超時/斷線）時拋出 InterruptException，不再佔著查詢線程。
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        task = current_task()
+        while not flight.done.wait(max(0.0, min(FOLLOWER_POLL, deadline - time.monotonic()))):
+            if task is not None:
+                task.raise_if_cancelled()
+            if time.monotonic() >= deadline:
+                return False
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "expirations": self.expirations,
+                "inflight": len(self.inflight),
+                "coalesced": self.coalesced,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """取得進程級結果快取（惰性初始化，線程安全）。"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
@@ -0,0 +1,75 @@
+# backend/sampling.py
+# 隨機抽樣 SQL：reservoir / block(system) 抽樣都只需一次串流掃描，
+# 按 token 分層抽樣先選 token 再在每個 token 內抽行；所有方法都支援 seed 重現。
+
+import random
+
+from engine import TABLE_NAME
+
+# block 抽樣按比例取整塊資料（DuckDB 向量大小 2048 行），多取一些再用 reservoir 截到 rows 條；
+# 至少期望抽到 BLOCK_MIN_VECTORS 個塊，避免小資料集上一塊都抽不到
+BLOCK_OVERSAMPLE = 1.5
+BLOCK_VECTOR_SIZE = 2048
+BLOCK_MIN_VECTORS = 4
+_HASH_MAX = 18446744073709551615.0
+
+
+def new_seed():
+    return random.randrange(2**31)
+
+
+def uniform_expr(key_expr, seed):
+    """由 (key, seed) 的雜湊得到 [0, 1] 的偽隨機數；與線程數、掃描順序無關，可重現。"""
+    return f"(hash({key_expr}, {int(seed)})::DOUBLE / {_HASH_MAX})"
+
+
+def sample_sql(select_expr, where_sql, rows, seed, method="reservoir", total=None, source=TABLE_NAME):
+    """
+    非分層抽樣：
+    - reservoir: DuckDB reservoir 抽樣，單次掃描、記憶體只保留 rows 條
+    - block: 先按向量塊抽樣（system）只讀部分資料，再在塊內 reservoir；樣本按塊聚集，資料少時可能不足 rows 條
+    source 為 FROM 來源（預設整個資料集，token 條件下可為 Engine.token_source 的結果）。
+    """
+    source = f"(SELECT {select_expr} FROM {source} WHERE {where_sql})"
+    if method == "block":
+        if total:
+            wanted = max(rows * BLOCK_OVERSAMPLE, BLOCK_MIN_VECTORS * BLOCK_VECTOR_SIZE)
+            percent = min(100.0, 100.0 * wanted / total)
+        else:
+            percent = 100.0
+        blocks = f"(SELECT * FROM {source} USING SAMPLE system({percent}%) REPEATABLE ({int(seed)}))"
+        return f"SELECT * FROM {blocks} USING SAMPLE reservoir({rows} ROWS) REPEATABLE ({int(seed)})"
+    return f"SELECT * FROM {source} USING SAMPLE reservoir({rows} ROWS) REPEATABLE ({int(seed)})"
+
+
+def stratified_sample_sql(select_expr, where_sql, rows, tokens, seed, weighted=False, source=TABLE_NAME,
+                          token_col="token_mint_address"):
+    """
+    按 token 分層抽樣：先在過濾後的資料中抽 tokens 個不同 token
+    （weighted=True 時按成交筆數加權，Efraimidis-Spirakis 無放回加權抽樣），
+    再在選中的 token 內輪流取行（每個 token 先取一條，再取第二條……），直到湊滿 rows 條。
+    token_col 為分層欄位，資料集有字典編碼時用整數 token_id。
+    """
+    token_u = uniform_expr(token_col, seed)
+    token_key = f"ln({token_u}) / COUNT(*)" if weighted else token_u
+    row_u = uniform_expr("transaction_signature", seed)
+    return f"""
+        WITH picked AS (
+            SELECT {token_col}
+            FROM {source}
+            WHERE {where_sql}
+            GROUP BY {token_col}
+            ORDER BY {token_key} DESC
+            LIMIT {tokens}
+        )
+        SELECT * EXCLUDE (_rn, _u)
+        FROM (
+            SELECT {select_expr}, {row_u} AS _u,
+                   row_number() OVER (PARTITION BY {token_col} ORDER BY {row_u}) AS _rn
+            FROM {source}
+            WHERE {where_sql} AND {token_col} IN (SELECT {token_col} FROM picked)
+            QUALIFY _rn <= {rows}
+        )
+        ORDER BY _rn, _u
+        LIMIT {rows}
+    """
@@ -0,0 +1,76 @@
+# backend/schema.py
+# SlotTest 原始 CSV（無表頭）的欄位與類型，順序與 auto_add_header.py 的表頭一致。
+
+RAW_COLUMNS = [
+    ("type", "VARCHAR"),
+    ("trade_timestamp", "BIGINT"),
+    ("transaction_slot", "BIGINT"),
+    ("trader_wallet_address", "VARCHAR"),
+    ("token_mint_address", "VARCHAR"),
+    ("signers", "VARCHAR"),
+    ("signer_balance_changes", "VARCHAR"),
+    ("buy_direction", "VARCHAR"),
+    ("buy_currency", "VARCHAR"),
+    ("buy_amount", "DOUBLE"),
+    ("buy_from_account_address", "VARCHAR"),
+    ("buy_to_account_address", "VARCHAR"),
+    ("buy_price", "DOUBLE"),
+    ("buy_sol_amount", "DOUBLE"),
+    ("sell_direction", "VARCHAR"),
+    ("sell_currency", "VARCHAR"),
+    ("sell_amount", "DOUBLE"),
+    ("sell_from_account_address", "VARCHAR"),
+    ("sell_to_account_address", "VARCHAR"),
+    ("sell_price", "DOUBLE"),
+    ("sell_sol_amount", "DOUBLE"),
+    ("arbitrage_profit_loss", "DOUBLE"),
+    ("arbitrage_price_change", "DOUBLE"),
+    ("arbitrage_volume", "DOUBLE"),
+    ("pool_state_real_token_reserves_pre_reserves", "DOUBLE"),
+    ("pool_state_real_token_reserves_post_reserves", "DOUBLE"),
+    ("pool_state_real_token_reserves_change", "DOUBLE"),
+    ("pool_state_completion_rate", "DOUBLE"),
+    ("account_creation_account", "VARCHAR"),
+    ("account_creation_owner", "VARCHAR"),
+    ("account_creation_created_at", "VARCHAR"),
+    ("token_creation_mint", "VARCHAR"),
+    ("token_creation_initial_supply", "DOUBLE"),
+    ("token_creation_creator", "VARCHAR"),
+    ("token_creation_decimals", "INTEGER"),
+    ("token_creation_symbol", "VARCHAR"),
+    ("token_creation_name", "VARCHAR"),
+    ("token_creation_uri", "VARCHAR"),
+    ("token_creation_metadata_address", "VARCHAR"),
+    ("token_creation_metadata_name", "VARCHAR"),
+    ("token_creation_metadata_symbol", "VARCHAR"),
+    ("token_creation_metadata_uri", "VARCHAR"),
+    ("token_creation_metadata_twitter_link", "VARCHAR"),
+    ("token_creation_metadata_discord_link", "VARCHAR"),
+    ("token_creation_metadata_website_link", "VARCHAR"),
+    ("add_liquidity_lp_token_mint", "VARCHAR"),
+    ("add_liquidity_lp_token_amount", "DOUBLE"),
+    ("add_liquidity_token0_amount", "DOUBLE"),
+    ("add_liquidity_token1_amount", "DOUBLE"),
+    ("add_liquidity_token0_account", "VARCHAR"),
+    ("add_liquidity_token1_account", "VARCHAR"),
+    ("add_liquidity_token0_address", "VARCHAR"),
+    ("add_liquidity_token1_address", "VARCHAR"),
+    ("remove_liquidity_lp_token_mint", "VARCHAR"),
+    ("remove_liquidity_lp_token_amount", "DOUBLE"),
+    ("remove_liquidity_token0_amount", "DOUBLE"),
+    ("remove_liquidity_token1_amount", "DOUBLE"),
+    ("remove_liquidity_token0_account", "VARCHAR"),
+    ("remove_liquidity_token1_account", "VARCHAR"),
+    ("remove_liquidity_token0_address", "VARCHAR"),
+    ("remove_liquidity_token1_address", "VARCHAR"),
+    ("net_sol_balance_change", "DOUBLE"),
+    ("transaction_fee", "DOUBLE"),
+    ("transaction_signature", "VARCHAR"),
+    ("reason", "VARCHAR"),
+    ("source_name", "VARCHAR"),
+    ("source_program", "VARCHAR"),
+    ("version", "VARCHAR"),
+]
+
+# 異常值條件：買單買價 / 賣單賣價為 NULL、0 或 NaN
+ABNORMAL_CONDITION = "((type = 'buy_token' AND (buy_price_sol IS NULL OR buy_price_sol = 0 OR isnan(buy_price_sol))) OR (type = 'sell_token' AND (sell_price_sol IS NULL OR sell_price_sol = 0 OR isnan(sell_price_sol))))"
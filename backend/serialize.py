@@ -0,0 +1,132 @@
+# backend/serialize.py
+# JSON 輸出：明細資料在 DuckDB 內逐欄清洗並直接編碼成 JSON，Python 只負責拼接外層信封。
+# 明細有三種佈局：rows（預設，每行一個物件）、columns（每欄一個陣列，欄名只出現一次）、
+# arrow（Arrow IPC stream，DuckDB 結果直接轉成 Arrow，信封 JSON 放在 schema metadata 裡）。
+
+import io
+import json
+
+import pyarrow.ipc as pa_ipc
+from fastapi.responses import Response
+
+from metrics import stage
+
+# DuckDB 中需要清洗 NaN/inf/1e20 的浮點類型
+FLOAT_TYPES = ("DOUBLE", "FLOAT", "REAL")
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# Arrow 響應 schema metadata 中存放信封（total/summary/next_cursor 等）的 key
+ARROW_ENVELOPE_KEY = b"envelope"
+
+
+def safe_json(obj):
+    if isinstance(obj, dict):
+        return {k: safe_json(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [safe_json(x) for x in obj]
+    elif isinstance(obj, float):
+        # 统一处理所有非法JSON float
+        if obj == float('inf') or obj == float('-inf') or obj == 1e20 or obj == -1e20:
+            return None
+        if obj != obj:  # NaN
+            return None
+        return float(obj)
+    return obj
+
+
+def float_scrub_expr(col):
+    """SQL 版 safe_json：NaN/inf/±1e20 轉為 NULL。"""
+    return f"CASE WHEN isfinite({col}) AND abs({col}) <> 1e20 THEN {col} END"
+
+
+def json_struct_expr(columns):
+    """
+    columns 為 [(name, duckdb_type)]，返回一個 STRUCT 表達式，
+    配合 to_json(list(...)) 即可在引擎內把一頁資料編碼成 JSON 陣列。
+    """
+    parts = []
+    for name, typ in columns:
+        ref = f'"{name}"'
+        expr = float_scrub_expr(ref) if typ in FLOAT_TYPES else ref
+        parts.append(f"'{name}': {expr}")
+    return "{" + ", ".join(parts) + "}"
+
+
+def json_columns_expr(columns, order_sql=None):
+    """
+    columnar 佈局的聚合表達式：{'欄名': [值, ...], ...}，配合 to_json(...) 編碼；
+    沒有行時每欄為空陣列。order_sql 為各欄 list() 內的排序（保證各欄行序一致）。
+    """
+    order = f" ORDER BY {order_sql}" if order_sql else ""
+    parts = []
+    for name, typ in columns:
+        ref = f'"{name}"'
+        expr = float_scrub_expr(ref) if typ in FLOAT_TYPES else ref
+        parts.append(f"'{name}': coalesce(list({expr}{order}), [])")
+    return "{" + ", ".join(parts) + "}"
+
+
+def scrubbed_select(columns):
+    """arrow 佈局的 SELECT 欄位：浮點欄位清洗方式與 JSON 輸出一致。"""
+    parts = []
+    for name, typ in columns:
+        ref = f'"{name}"'
+        parts.append(f"{float_scrub_expr(ref)} AS {ref}" if typ in FLOAT_TYPES else ref)
+    return ", ".join(parts)
+
+
+def negotiate_layout(layout, accept=None):
+    """明細佈局：format 參數優先，其次 Accept 頭（Arrow IPC 的 MIME 類型），預設 rows。"""
+    if layout:
+        return layout
+    if accept and ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    return "rows"
+
+
+def arrow_ipc(table, envelope):
+    """pyarrow.Table + 信封 → Arrow IPC stream 位元組。"""
+    metadata = dict(table.schema.metadata or {})
+    metadata[ARROW_ENVELOPE_KEY] = dumps_json(envelope).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+    sink = io.BytesIO()
+    with pa_ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class RawJSON:
+    """已編碼好的 JSON 片段（如 DuckDB 產生的資料陣列），輸出時原樣嵌入。"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text if text else "[]"
+
+
+def dumps_json(obj):
+    if isinstance(obj, RawJSON):
+        return obj.text
+    if isinstance(obj, dict):
+        return "{" + ",".join(f"{json.dumps(str(k))}:{dumps_json(v)}" for k, v in obj.items()) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(dumps_json(v) for v in obj) + "]"
+    if hasattr(obj, "item"):  # numpy 標量
+        obj = obj.item()
+    return json.dumps(safe_json(obj), ensure_ascii=False)
+
+
+class ArrowResponse(Response):
+    """已編碼好的 Arrow IPC stream（見 arrow_ipc）。"""
+
+    media_type = ARROW_MEDIA_TYPE
+
+
+class FastJSONResponse(Response):
+    """支援嵌入 RawJSON 的 JSON 響應，避免把整頁資料還原成 Python 物件再編碼。"""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        with stage("encode"):
+            return dumps_json(content).encode("utf-8")
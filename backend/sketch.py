@@ -0,0 +1,112 @@
+# backend/sketch.py
+# 可合併的近似統計草圖：在 DuckDB 的聚合裡隨同一次掃描算出草圖狀態，在 Python 端估計。
+# - 分位數：對數細分桶的計數直方圖（與 cube 同一套桶，每十倍 CUBE_BUCKETS_PER_DECADE 個），
+#   取桶的幾何中點並夾在 min/max 之間，相對誤差不超過半個桶寬（64 桶時約 1.8%）。
+# - 不同值個數：HyperLogLog，以 bitstring_agg 把每行的 (暫存器, rank) 記在一張位圖上，取回後壓成每暫存器一個位元組。
+# 兩種狀態都可合併：直方圖按桶相加、暫存器逐個取最大值，合併後再估計與一起算的結果相同；
+# DuckDB 在多線程、多個分區檔之間合併的是同樣的部分聚合，區間、批次或快取中的結果也可按 merge_* 再合併。
+
+import math
+
+import cube
+from config import CUBE_BUCKETS_PER_DECADE, SKETCH_HLL_BITS
+
+HLL_REGISTERS = 1 << SKETCH_HLL_BITS
+# 每個暫存器在位圖中佔的位數，rank 超過時截斷（機率約 2^-31，可忽略）
+HLL_RANK_SLOTS = 32
+
+
+def histogram_expr(col, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """col（略過 NaN/NULL）的對數桶計數直方圖聚合，結果為 {桶: 行數}。"""
+    return f"histogram({cube.bucket_expr(col, per_decade)}) FILTER (WHERE NOT isnan({col}))"
+
+
+def hll_expr(col):
+    """col（略過 NULL）的 HyperLogLog 位圖聚合：hash 的低位選暫存器，其餘位的前導零數 + 1 為 rank。"""
+    h = f"hash({col})"
+    rest = f"({h} >> {SKETCH_HLL_BITS})"
+    width = 64 - SKETCH_HLL_BITS
+    rank = f"least(CASE WHEN {rest} = 0 THEN {width + 1} ELSE {width} - CAST(floor(log2({rest})) AS INTEGER) END, {HLL_RANK_SLOTS - 1})"
+    slot = f"CAST(({h} & {HLL_REGISTERS - 1}) * {HLL_RANK_SLOTS} + {rank} AS INTEGER)"
+    return f"bitstring_agg({slot}, 0, {HLL_REGISTERS * HLL_RANK_SLOTS - 1}) FILTER (WHERE {col} IS NOT NULL)"
+
+
+def hll_registers(bits):
+    """bitstring_agg 的結果（'0101...' 字串）→ 每暫存器最大 rank 的 bytes；沒有行時為 None。"""
+    if bits is None:
+        return None
+    return bytes(
+        max(bits.rfind("1", r * HLL_RANK_SLOTS, (r + 1) * HLL_RANK_SLOTS) - r * HLL_RANK_SLOTS, 0)
+        for r in range(HLL_REGISTERS)
+    )
+
+
+def merge_registers(a, b):
+    if a is None or b is None:
+        return a if b is None else b
+    return bytes(map(max, a, b))
+
+
+def merge_histograms(a, b):
+    if a is None or b is None:
+        return a if b is None else b
+    merged = dict(a)
+    for bucket, n in b.items():
+        merged[bucket] = merged.get(bucket, 0) + n
+    return merged
+
+
+def distinct_count(registers):
+    """HyperLogLog 估計（小基數時改用線性計數）。"""
+    if registers is None:
+        return 0
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if zeros and estimate <= 2.5 * m:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def _bucket_order(bucket):
+    # 負數 < 0 < 正數各桶 < inf（特殊桶編號本身不按數值排序）
+    if bucket == cube.NEG_BUCKET:
+        return (0, 0)
+    if bucket == cube.ZERO_BUCKET:
+        return (1, 0)
+    if bucket == cube.INF_BUCKET:
+        return (3, 0)
+    return (2, bucket)
+
+
+def quantiles(histogram, qs, lo=None, hi=None, per_decade=CUBE_BUCKETS_PER_DECADE):
+    """
+    從對數桶直方圖估計各分位數；lo/hi 為實際最小/最大值（負數桶以 lo 代表，正數桶的估計夾在其間）。
+    沒有數值時各分位數為 None。
+    """
+    if not histogram:
+        return [None] * len(qs)
+    buckets = sorted(histogram, key=_bucket_order)
+    n = sum(histogram.values())
+    result = []
+    for q in qs:
+        target = max(1, math.ceil(q * n))
+        seen = 0
+        for bucket in buckets:
+            seen += histogram[bucket]
+            if seen >= target:
+                break
+        if bucket == cube.NEG_BUCKET:
+            value = lo
+        elif bucket == cube.ZERO_BUCKET:
+            value = 0.0
+        elif bucket == cube.INF_BUCKET:
+            value = math.inf
+        else:
+            value = 10 ** ((bucket + 0.5) / per_decade)
+            if lo is not None:
+                value = max(value, lo)
+            if hi is not None:
+                value = min(value, hi)
+        result.append(value)
+    return result
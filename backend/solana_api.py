@@ -1,29 +1,197 @@
-import requests
+import sqlite3
+import threading
 import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    SLOT_CACHE_PATH, SLOT_INTERPOLATE_MAX_GAP, SLOT_SECONDS, SOLANA_RPC_BACKOFF, SOLANA_RPC_BATCH_SIZE,
+    SOLANA_RPC_MAX_CONCURRENCY, SOLANA_RPC_MAX_RETRIES, SOLANA_RPC_RATE_LIMIT, SOLANA_RPC_URL,
+)
+from ratelimit import TokenBucket
+
+# getBlockTime 对被跳过/不存在的 slot 返回的错误码，结果不会再变化，可以缓存为 None
+PERMANENT_ERROR_CODES = (-32007, -32009)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class SlotTimeStore:
+    """slot -> 区块时间戳（秒）的 sqlite 持久化存储，block_time 为 NULL 表示该 slot 没有区块。"""
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS slot_time (slot INTEGER PRIMARY KEY, block_time INTEGER)")
+        self.conn.commit()
+
+    def get_many(self, slots):
+        found = {}
+        with self.lock:
+            for slot in slots:
+                row = self.conn.execute("SELECT block_time FROM slot_time WHERE slot = ?", (slot,)).fetchone()
+                if row is not None:
+                    found[slot] = row[0]
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO slot_time (slot, block_time) VALUES (?, ?)", list(items))
+            self.conn.commit()
+
+    def neighbors(self, slot):
+        """最近的已知前后 slot：((slot, time) 或 None, (slot, time) 或 None)。"""
+        with self.lock:
+            lower = self.conn.execute(
+                "SELECT slot, block_time FROM slot_time WHERE slot < ? AND block_time IS NOT NULL ORDER BY slot DESC LIMIT 1",
+                (slot,),
+            ).fetchone()
+            upper = self.conn.execute(
+                "SELECT slot, block_time FROM slot_time WHERE slot > ? AND block_time IS NOT NULL ORDER BY slot ASC LIMIT 1",
+                (slot,),
+            ).fetchone()
+        return lower, upper
+
+
+def interpolate_slot_time(slot, lower, upper, max_gap=SLOT_INTERPOLATE_MAX_GAP, slot_seconds=SLOT_SECONDS):
+    """用最近的已知 slot 线性插值；只有一侧在 max_gap 内时按 slot_seconds 外推，都不在时返回 None。"""
+    lower = lower if lower and slot - lower[0] <= max_gap else None
+    upper = upper if upper and upper[0] - slot <= max_gap else None
+    if lower and upper:
+        ratio = (slot - lower[0]) / (upper[0] - lower[0])
+        return int(round(lower[1] + ratio * (upper[1] - lower[1])))
+    if lower:
+        return int(round(lower[1] + (slot - lower[0]) * slot_seconds))
+    if upper:
+        return int(round(upper[1] - (upper[0] - slot) * slot_seconds))
+    return None
+
+
+class SlotTimeResolver:
+    """
+    批量解析 slot 区块时间：先查持久化存储，可选插值估算，
+    剩余的用 JSON-RPC 批量请求（连接池 + 并发 + 限流 + 重试）。endpoint 可指向本地 JSON-RPC stub。
+    """
+
+    def __init__(
+        self,
+        endpoint: str = SOLANA_RPC_URL,
+        batch_size: int = SOLANA_RPC_BATCH_SIZE,
+        max_concurrency: int = SOLANA_RPC_MAX_CONCURRENCY,
+        rate_limit: float = SOLANA_RPC_RATE_LIMIT,
+        max_retries: int = SOLANA_RPC_MAX_RETRIES,
+        backoff: float = SOLANA_RPC_BACKOFF,
+        cache_path=SLOT_CACHE_PATH,
+        timeout: float = 10,
+    ):
+        self.endpoint = endpoint
+        self.batch_size = max(1, int(batch_size))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit, self.max_concurrency)
+        self.store = SlotTimeStore(cache_path) if cache_path else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, payload):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                resp = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp.json()
+                error = requests.HTTPError(f"{resp.status_code} from RPC", response=resp)
+            except requests.RequestException as e:
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code not in RETRY_STATUS:
+                    raise
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def fetch_batch(self, slots):
+        """一个 JSON-RPC 批次请求，返回 ({slot: ts}, {可缓存的 slot: ts})。"""
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": "getBlockTime", "params": [slot]}
+            for i, slot in enumerate(slots)
+        ]
+        data = self._post(payload)
+        if isinstance(data, dict):  # 不支持批量的节点会返回单个错误对象
+            data = [data]
+        result, cacheable = {}, {}
+        for item in data:
+            i = item.get("id")
+            if not isinstance(i, int) or not 0 <= i < len(slots):
+                continue
+            slot = slots[i]
+            if "error" in item:
+                result[slot] = None
+                if (item.get("error") or {}).get("code") in PERMANENT_ERROR_CODES:
+                    cacheable[slot] = None
+            else:
+                result[slot] = item.get("result")
+                if result[slot] is not None:
+                    cacheable[slot] = result[slot]
+        return result, cacheable
+
+    def resolve(self, slots, interpolate=False):
+        """返回 ({slot: ts}, {slot: 来源})，来源为 cache / interpolated / rpc；无法解析的 ts 为 None。"""
+        unique = list(dict.fromkeys(int(s) for s in slots))
+        times, sources = {}, {}
+        if self.store is not None:
+            for slot, ts in self.store.get_many(unique).items():
+                times[slot], sources[slot] = ts, "cache"
+        missing = [s for s in unique if s not in times]
+        if interpolate and self.store is not None:
+            still = []
+            for slot in missing:
+                ts = interpolate_slot_time(slot, *self.store.neighbors(slot))
+                if ts is None:
+                    still.append(slot)
+                else:
+                    times[slot], sources[slot] = ts, "interpolated"
+            missing = still
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+
+            def run(batch):
+                try:
+                    return self.fetch_batch(batch)
+                except Exception:
+                    return {slot: None for slot in batch}, {}
+
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                for result, cacheable in pool.map(run, batches):
+                    for slot, ts in result.items():
+                        times[slot] = ts
+                        sources[slot] = "rpc" if ts is not None else None
+                    if cacheable and self.store is not None:
+                        self.store.put_many(cacheable.items())
+        return {s: times.get(int(s)) for s in slots}, {s: sources.get(int(s)) for s in slots}
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(endpoint=SOLANA_RPC_URL) -> SlotTimeResolver:
+    with _resolvers_lock:
+        if endpoint not in _resolvers:
+            _resolvers[endpoint] = SlotTimeResolver(endpoint=endpoint)
+        return _resolvers[endpoint]
+
 
-def get_slot_timestamps(slots, endpoint="https://api.mainnet-beta.solana.com"):
+def get_slot_timestamps(slots, endpoint=SOLANA_RPC_URL, interpolate=False):
     """
     批量获取Solana slot的区块时间戳，返回{slot: timestamp}
     slots: list[int]
     """
-    result = {}
-    for idx, slot in enumerate(slots):
-        # 构造请求体
-        payload = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "getBlockTime",
-            "params": [int(slot)]
-        }
-        try:
-            resp = requests.post(endpoint, json=payload, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            ts = data.get("result", None)
-            result[slot] = ts
-        except Exception as e:
-            result[slot] = None
-        # 限流：每次请求后sleep 1秒，最后一条不sleep
-        if idx != len(slots) - 1:
-            time.sleep(1)
-    return result
+    timestamps, _ = get_resolver(endpoint).resolve(slots, interpolate=interpolate)
+    return timestamps
@@ -0,0 +1,81 @@
+# backend/tests/conftest.py
+# 測試從 backend 目錄匯入模組（與 uvicorn main:app 相同的匯入方式）。
+# 需要資料的測試用 bench.generate 生成的小資料集，經 ingest.py 導入（連同 token 索引、cube、異常旁路檔），
+# 再用 use_dataset 把進程級引擎換成指向它的新引擎。
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine  # noqa: E402
+import ingest  # noqa: E402
+import prefetch  # noqa: E402
+import result_cache  # noqa: E402
+from bench.generate import generate_csv  # noqa: E402
+
+# 行數小、row group 也小，讓 token 裁剪與分頁跨多個 row group
+ROWS = 6000
+ROW_GROUP_SIZE = 1024
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@pytest.fixture(scope="session")
+def trades_csv(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "trades.csv")
+    generate_csv(path, ROWS, seed=7, days=2)
+    return path
+
+
+@pytest.fixture(scope="session")
+def trades_parquet(trades_csv):
+    path = os.path.join(os.path.dirname(trades_csv), "trades.parquet")
+    ingest.ingest_csv(trades_csv, path, row_group_size=ROW_GROUP_SIZE, temp_dir=None)
+    return path
+
+
+@pytest.fixture(scope="session")
+def nullkey_parquet(trades_csv):
+    """排序鍵帶 NULL 且大量並列的資料：時間截到分鐘，部分 slot / 時間為 NULL。"""
+    import duckdb
+
+    directory = os.path.dirname(trades_csv)
+    csv_path = os.path.join(directory, "nullkey.csv")
+    path = os.path.join(directory, "nullkey.parquet")
+    con = duckdb.connect()
+    try:
+        con.execute(f"""
+            COPY (
+                SELECT * REPLACE (
+                    CASE WHEN hash(transaction_signature) % 11 = 0 THEN NULL
+                         ELSE trade_timestamp // 60000 * 60000 END AS trade_timestamp,
+                    CASE WHEN hash(transaction_signature) % 3 = 0 THEN NULL ELSE transaction_slot END AS transaction_slot
+                )
+                FROM {ingest.read_csv_sql(trades_csv)}
+            ) TO {sql_string(csv_path)} (FORMAT csv, HEADER false)
+        """)
+    finally:
+        con.close()
+    ingest.ingest_csv(csv_path, path, row_group_size=ROW_GROUP_SIZE, temp_dir=None)
+    return path
+
+
+@pytest.fixture
+def use_dataset():
+    """use_dataset(path)：進程級引擎改指向 path，結果快取清空；測試結束後關閉引擎。"""
+    def use(path):
+        engine.close_engine()
+        result_cache._cache = None
+        engine._engine = engine.Engine(path)
+        return engine._engine
+
+    yield use
+    # 背景預取（batch_bins_data 觸發）先停下，才關閉引擎
+    prefetch.close_prefetcher()
+    engine.close_engine()
+    result_cache._cache = None
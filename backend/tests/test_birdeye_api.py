@@ -0,0 +1,139 @@
+# backend/tests/test_birdeye_api.py
+# BirdeyeClient 對本地樁 HTTP 服務：同一 (token, 分鐘) 合併請求、sqlite 價格快取、令牌桶限流、429 重試。
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from birdeye_api import BirdeyeClient, PriceCache, minute_bucket
+from ratelimit import TokenBucket
+
+# 樁服務的價格表：(address, time_from) -> value；不在表裡的返回空 items
+PRICES = {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        key = (query["address"], int(query["time_from"]))
+        server = self.server
+        with server.lock:
+            server.requests.append(key)
+            throttled = server.throttle > 0
+            if throttled:
+                server.throttle -= 1
+        if throttled:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        items = [{"unixTime": key[1], "value": PRICES[key]}] if key in PRICES else []
+        body = json.dumps({"success": True, "data": {"items": items}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.throttle = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_client(server, tmp_path, **kwargs):
+    options = dict(rate_limit=1000, burst=100, backoff=0, cache_path=str(tmp_path / "birdeye.sqlite"))
+    options.update(kwargs)
+    return BirdeyeClient(base_url=f"http://127.0.0.1:{server.server_port}/", api_key="test", **options)
+
+
+# 2025-04-18 23:55:45 GMT+8 的秒級時間戳（與 trade_time 相同的 GMT+8 記法）
+T0 = 1745020545
+
+
+def test_coalesces_trades_by_token_and_minute(server, tmp_path):
+    minute = minute_bucket(T0)
+    PRICES[("tokA", minute)] = 1.5
+    PRICES[("tokA", minute + 60)] = 2.5
+    PRICES[("tokB", minute)] = 7.0
+    trades = [
+        {"token_mint_address": "tokA", "trade_time": T0},
+        {"token_mint_address": "tokA", "trade_time": T0 - 45},  # 同一分鐘
+        {"token_mint_address": "tokA", "trade_time": T0 + 60},  # 下一分鐘
+        {"token_mint_address": "tokB", "trade_time": T0},
+        {"token_mint_address": "tokC", "trade_time": T0},  # Birdeye 無資料
+        {"token_mint_address": "tokA"},  # 缺 trade_time
+    ]
+    prices = make_client(server, tmp_path).batch_prices(trades)
+    assert prices == [1.5, 1.5, 2.5, 7.0, "-", "-"]
+    assert sorted(server.requests) == sorted([
+        ("tokA", minute), ("tokA", minute + 60), ("tokB", minute), ("tokC", minute),
+    ])
+
+
+def test_price_cache_serves_repeat_lookups(server, tmp_path):
+    minute = minute_bucket(T0)
+    PRICES[("tokD", minute)] = 3.0
+    trades = [{"token_mint_address": "tokD", "trade_time": T0}, {"token_mint_address": "tokE", "trade_time": T0}]
+    assert make_client(server, tmp_path).batch_prices(trades) == [3.0, "-"]
+    assert len(server.requests) == 2
+    # 新客戶端、同一快取檔：有價格與「無價格」都命中，不再請求
+    assert make_client(server, tmp_path).batch_prices(trades) == [3.0, "-"]
+    assert len(server.requests) == 2
+    # 「無價格」過期後重新請求，有價格的結果永久有效
+    client = make_client(server, tmp_path)
+    client.cache = PriceCache(str(tmp_path / "birdeye.sqlite"), negative_ttl=0)
+    time.sleep(0.01)
+    assert client.batch_prices(trades) == [3.0, "-"]
+    assert server.requests[2:] == [("tokE", minute)]
+
+
+def test_price_cache_roundtrip(tmp_path):
+    cache = PriceCache(str(tmp_path / "cache.sqlite"))
+    cache.put(("tok", 60), 1.25)
+    cache.put(("tok", 120), None)
+    assert cache.get_many([("tok", 60), ("tok", 120), ("tok", 180)]) == {("tok", 60): 1.25, ("tok", 120): None}
+
+
+def test_token_bucket_throttles_requests(server, tmp_path):
+    # 10 次/秒、容量 1：6 個不同的分鐘至少要 0.5 秒，即使並發 4
+    trades = [{"token_mint_address": "tokF", "trade_time": T0 + 60 * i} for i in range(6)]
+    client = make_client(server, tmp_path, rate_limit=10, burst=1, max_concurrency=4)
+    start = time.monotonic()
+    client.batch_prices(trades)
+    assert time.monotonic() - start >= 0.45
+    assert len(server.requests) == 6
+
+
+def test_token_bucket_allows_burst():
+    bucket = TokenBucket(rate=5, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.1
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_retries_after_429(server, tmp_path):
+    minute = minute_bucket(T0)
+    PRICES[("tokG", minute)] = 9.0
+    server.throttle = 2
+    client = make_client(server, tmp_path)
+    assert client.batch_prices([{"token_mint_address": "tokG", "trade_time": T0}]) == [9.0]
+    assert server.requests == [("tokG", minute)] * 3
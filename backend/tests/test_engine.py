@@ -0,0 +1,67 @@
+# backend/tests/test_engine.py
+# 引擎在資料集變動時重新註冊：併發查詢不會碰到已關閉的 token 索引；token_source 的裁剪範圍。
+
+import threading
+
+import duckdb
+
+import engine
+import ingest
+from engine import TABLE_NAME
+
+
+def some_tokens(path, n=3):
+    rows = duckdb.sql(
+        f"SELECT DISTINCT token_mint_address FROM read_parquet('{path}') ORDER BY 1 LIMIT {int(n)}"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def test_token_source_single_file(use_dataset, trades_parquet):
+    eng = use_dataset(trades_parquet)
+    tokens = some_tokens(trades_parquet)
+    assert eng.token_fragments(tokens)
+    # 單檔資料集索引不裁剪讀取，仍讀整個資料集（靠 row group 統計跳過）
+    assert eng.token_source(tokens) == TABLE_NAME
+    assert "WHERE FALSE" in eng.token_source(["no-such-token"])
+
+
+def test_reregister_while_querying(use_dataset, trades_csv, tmp_path):
+    path = str(tmp_path / "dataset")
+    ingest.append_csv(trades_csv, path, temp_dir=None)
+    eng = use_dataset(path)
+    tokens = some_tokens(f"{path}/**/*.parquet")
+    first = eng.token_source(tokens)
+    assert first != TABLE_NAME and "WHERE FALSE" not in first
+
+    errors = []
+    stop = threading.Event()
+
+    def query():
+        cur = engine.get_engine().cursor()
+        while not stop.is_set():
+            try:
+                cur.execute(f"SELECT count(*) FROM {engine.get_engine().token_source(tokens)}").fetchall()
+            except Exception as e:  # noqa: BLE001 - 收集後在主線程斷言
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(3):
+            ingest.append_csv(trades_csv, path, temp_dir=None, force=True)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert errors == []
+    in_list = ", ".join(f"'{t}'" for t in tokens)
+    count = eng.cursor().execute(
+        f"SELECT count(*) FROM {eng.token_source(tokens)} WHERE token_mint_address IN ({in_list})"
+    ).fetchone()[0]
+    expected = duckdb.sql(
+        f"SELECT count(*) FROM read_parquet('{path}/**/*.parquet') WHERE token_mint_address IN ({in_list})"
+    ).fetchone()[0]
+    assert count == expected > 0
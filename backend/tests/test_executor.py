@@ -0,0 +1,181 @@
+# backend/tests/test_executor.py
+# 查詢執行層：排隊滿 503、超時 504、斷線 499，取消後查詢線程確實停下（含取消落在語句開始之前的競態）。
+
+import asyncio
+import threading
+import time
+
+import duckdb
+import pytest
+
+import engine
+from executor import (
+    QueryCancelled, QueryExecutor, QueryRejected, QueryTask, QueryTimeout, bounded, close_executor, error_response,
+)
+
+# 不中斷時要跑數十秒的查詢
+SLOW_SQL = "SELECT count(*) FROM range(2000000000) t(i) WHERE hash(i) % 7 = 3"
+
+
+@pytest.fixture
+def eng(use_dataset, trades_parquet):
+    yield use_dataset(trades_parquet)
+    close_executor()
+
+
+class Finished:
+    """記錄查詢函數在線程裡的結局（正常返回或拋出的異常）與結束時間。"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.outcome = None
+        self.at = None
+
+    def wrap(self, fn):
+        def run():
+            try:
+                self.outcome = fn()
+                return self.outcome
+            except BaseException as e:
+                self.outcome = e
+                raise
+            finally:
+                self.at = time.monotonic()
+                self.done.set()
+        return run
+
+
+def slow_query():
+    return engine.get_engine().cursor().execute(SLOW_SQL).fetchall()
+
+
+class FakeRequest:
+    def __init__(self, disconnect_after):
+        self.deadline = time.monotonic() + disconnect_after
+
+    async def is_disconnected(self):
+        return time.monotonic() >= self.deadline
+
+
+def test_timeout_interrupts_query(eng):
+    executor = QueryExecutor(workers=2, limits={"default": (2, 4)}, timeout=0.3, queue_timeout=1)
+    finished = Finished()
+    start = time.monotonic()
+    with pytest.raises(QueryTimeout):
+        asyncio.run(executor.run("slow", finished.wrap(slow_query)))
+    assert finished.done.wait(5)
+    assert isinstance(finished.outcome, duckdb.InterruptException)
+    assert finished.at - start < 3
+    assert executor.stats()["slow"]["timeouts"] == 1
+    executor.shutdown()
+
+
+def test_disconnect_cancels_query(eng):
+    executor = QueryExecutor(workers=2, limits={"default": (2, 4)}, timeout=30, queue_timeout=1)
+    finished = Finished()
+    with pytest.raises(QueryCancelled):
+        asyncio.run(executor.run("slow", finished.wrap(slow_query), FakeRequest(0.3)))
+    assert finished.done.wait(5)
+    assert isinstance(finished.outcome, duckdb.InterruptException)
+    assert executor.stats()["slow"]["cancelled"] == 1
+    executor.shutdown()
+
+
+def test_queue_full_rejects(eng):
+    executor = QueryExecutor(workers=2, limits={"default": (1, 0)}, timeout=0.5, queue_timeout=1)
+
+    async def main():
+        first = asyncio.ensure_future(executor.run("slow", slow_query))
+        await asyncio.sleep(0.1)
+        with pytest.raises(QueryRejected):
+            await executor.run("slow", lambda: 1)
+        with pytest.raises(QueryTimeout):
+            await first
+
+    asyncio.run(main())
+    assert executor.stats()["slow"]["rejected"] == 1
+    executor.shutdown()
+
+
+def test_cancelled_task_runs_no_further_statements(eng):
+    task_ref = {}
+    ran = []
+
+    def fn():
+        cur = engine.get_engine().cursor()
+        cur.execute("SELECT 1").fetchall()
+        ran.append(1)
+        task_ref["task"].cancel()  # 兩個語句之間被取消
+        cur.execute("SELECT 2").fetchall()
+        ran.append(2)
+
+    task = task_ref["task"] = QueryTask(fn)
+    with pytest.raises(duckdb.InterruptException):
+        task.run()
+    assert ran == [1]
+    assert engine.get_engine().cursor().task is None
+
+
+def test_cancel_before_statement_starts(eng, monkeypatch):
+    # begin_statement 之後、DuckDB 真正開始執行之前取消：第一次 interrupt 落空，靠重發中斷
+    run = engine.TracedCursor._run
+    started = threading.Event()
+
+    def delayed_run(self, sql, params):
+        started.set()
+        time.sleep(0.3)
+        return run(self, sql, params)
+
+    monkeypatch.setattr(engine.TracedCursor, "_run", delayed_run)
+    task = QueryTask(slow_query)
+    finished = Finished()
+
+    def target():
+        try:
+            finished.wrap(task.run)()
+        except duckdb.InterruptException:
+            pass
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    assert started.wait(5)
+    start = time.monotonic()
+    task.cancel()
+    assert finished.done.wait(5)
+    thread.join()
+    assert isinstance(finished.outcome, duckdb.InterruptException)
+    assert finished.at - start < 3
+
+
+def test_bounded_error_statuses(eng):
+    assert error_response("x", QueryRejected("queue full")).status_code == 503
+    assert error_response("x", QueryTimeout()).status_code == 504
+    assert error_response("x", QueryCancelled()).status_code == 499
+    assert error_response("x", ValueError()) is None
+
+    @bounded("unit_test")
+    def endpoint(value: int):
+        return {"value": value}
+
+    class Connected:
+        async def is_disconnected(self):
+            return False
+
+    assert asyncio.run(endpoint(3, request=Connected())) == {"value": 3}
+
+
+def test_profile_pass_does_not_swallow_interrupt(eng):
+    from metrics import end_trace, start_trace
+
+    trace, token = start_trace(profile=True)
+    try:
+        def fn():
+            task.cancel()
+            return engine.get_engine().cursor().execute("SELECT 1").fetchall()
+
+        task = QueryTask(fn)
+        with pytest.raises(duckdb.InterruptException):
+            task.run()
+        assert trace.plans == []
+    finally:
+        end_trace(token)
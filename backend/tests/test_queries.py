@@ -0,0 +1,192 @@
+# backend/tests/test_queries.py
+# 端點層面的查詢結果：cube 摘要與原始資料一致、結果快取命中與失效、可重現的抽樣、價格區間的檢查與歸屬。
+
+import bisect
+import math
+
+import duckdb
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import price_bins
+import result_cache
+from bench.generate import START_MS
+from price_bins import BinSpec, bin_index_expr, resolve_edges
+
+DAY_MS = 86400000
+
+
+@pytest.fixture
+def client(use_dataset, trades_parquet):
+    # 不進入 with：不跑 startup 的預熱，引擎由 use_dataset 指定
+    use_dataset(trades_parquet)
+    return TestClient(main.app)
+
+
+def get(client, path, **params):
+    response = client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def assert_summary_equal(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        if isinstance(a[key], float) or isinstance(b[key], float):
+            assert a[key] == pytest.approx(b[key], rel=1e-9), key
+        else:
+            assert a[key] == b[key], key
+
+
+def raw_summaries(monkeypatch, fn):
+    """關掉 cube（cube_summaries 返回 None）並清空結果快取後再算一次。"""
+    result_cache._cache = None
+    with monkeypatch.context() as m:
+        m.setattr(main, "cube_summaries", lambda *args, **kwargs: None)
+        return fn()
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"price_unit": "SOL", "price_bin": 1},
+    {"price_unit": "USD", "price_bin": 3},
+    {"price_type": "sell_price", "price_unit": "USD", "price_bin": 5},
+    {"buy_price_filter": "gt0"},
+    {"start_time": START_MS + DAY_MS, "end_time": START_MS + 2 * DAY_MS},
+    {"log_buckets": 6, "price_bin": 2},
+])
+def test_cube_summary_matches_raw(client, monkeypatch, trades_parquet, params):
+    calls = []
+    cube_summaries = main.cube_summaries
+
+    def spy(*args, **kwargs):
+        result = cube_summaries(*args, **kwargs)
+        calls.append(result)
+        return result
+
+    monkeypatch.setattr(main, "cube_summaries", spy)
+    cubed = get(client, "/api/filter_data", page_size=5, **params)
+    assert calls and calls[0] is not None  # 確實走了 cube
+    monkeypatch.undo()
+    raw = raw_summaries(monkeypatch, lambda: get(client, "/api/filter_data", page_size=5, **params))
+    assert cubed["total"] == raw["total"] > 0
+    assert_summary_equal(cubed["summary"], raw["summary"])
+    assert cubed["data"] == raw["data"]
+
+
+def test_cube_summary_with_tokens(client, monkeypatch, trades_parquet):
+    tokens = [r[0] for r in duckdb.sql(
+        f"SELECT token_mint_address FROM read_parquet('{trades_parquet}') GROUP BY 1 ORDER BY count(*) DESC LIMIT 3"
+    ).fetchall()]
+    params = {"token_list": ",".join(tokens), "price_unit": "USD"}
+    cubed = get(client, "/api/filter_data", **params)
+    raw = raw_summaries(monkeypatch, lambda: get(client, "/api/filter_data", **params))
+    assert_summary_equal(cubed["summary"], raw["summary"])
+    in_list = ", ".join(f"'{t}'" for t in tokens)
+    expected = duckdb.sql(
+        f"SELECT count(*) FROM read_parquet('{trades_parquet}') WHERE token_mint_address IN ({in_list})"
+    ).fetchone()[0]
+    assert cubed["total"] == expected
+
+
+def test_batch_bins_summaries_match_raw(client, monkeypatch):
+    params = {"mode": "init", "bins": "0,1,2,3,4,5", "page_size": 3}
+    cubed = get(client, "/api/batch_bins_data", **params)
+    raw = raw_summaries(monkeypatch, lambda: get(client, "/api/batch_bins_data", **params))
+    assert cubed.keys() == raw.keys()
+    for idx in cubed:
+        assert_summary_equal(cubed[idx]["summary"], raw[idx]["summary"])
+        assert cubed[idx]["pages"] == raw[idx]["pages"]
+
+
+def test_result_cache_hits_and_invalidates(client):
+    first = get(client, "/api/filter_data", price_bin=2, page_size=5)
+    before = get(client, "/api/cache_stats")
+    assert get(client, "/api/filter_data", price_bin=2, page_size=5) == first
+    after = get(client, "/api/cache_stats")
+    assert after["hits"] > before["hits"]
+    # 資料版本變了（如重新導入）之後舊結果不再命中
+    cache = result_cache.get_cache()
+    key = result_cache.make_key("unit", a=1)
+    cache.put(key, "old", version=("path", 1))
+    assert cache.get(key, ("path", 2)) == (False, None)
+    assert cache.stats()["invalidations"] >= 1
+
+
+def test_lru_eviction_and_ttl():
+    cache = result_cache.ResultCache(max_bytes=3 * (result_cache.ENTRY_OVERHEAD + 100))
+    for i in range(4):
+        cache.put(("k", i), "x" * 100, 1)
+    assert cache.get(("k", 0), 1) == (False, None)
+    assert cache.get(("k", 3), 1) == (True, "x" * 100)
+    assert cache.stats()["evictions"] == 1
+    expiring = result_cache.ResultCache(ttl=-1)
+    expiring.put("k", "v", 1)
+    assert expiring.get("k", 1) == (False, None)
+    assert expiring.stats()["expirations"] == 1
+    assert result_cache.make_key("n", b=2.0, a=[1, 2]) == result_cache.make_key("n", a=(1, 2), b=2)
+
+
+def test_seeded_sample_is_reproducible(client):
+    for method in ("reservoir", "block"):
+        params = {"rows": 20, "seed": 42, "method": method}
+        first = get(client, "/api/random_sample", **params)
+        again = get(client, "/api/random_sample", **params)
+        assert first["data"] == again["data"] and first["seed"] == 42
+        other = get(client, "/api/random_sample", **dict(params, seed=43))
+        assert other["data"] != first["data"]
+    params = {"rows": 10, "seed": 7, "stratify": "true", "tokens": 3, "weighted": "true"}
+    first = get(client, "/api/random_sample", **params)
+    assert first["data"] == get(client, "/api/random_sample", **params)["data"]
+    assert len({row["token_mint_address"] for row in first["data"]}) <= 3
+
+
+@pytest.mark.parametrize("spec, error", [
+    (BinSpec(edges="1,1,2"), "严格递增"),
+    (BinSpec(edges="1,inf,3"), "inf"),
+    (BinSpec(edges="1"), "边界"),
+    (BinSpec(edges="0,1", log_buckets=3), "只能指定一个"),
+    (BinSpec(log_buckets=3, log_min=10, log_max=1), "log_min"),
+])
+def test_resolve_edges_rejects(spec, error):
+    with pytest.raises(ValueError, match=error):
+        resolve_edges(spec)
+
+
+@pytest.mark.parametrize("edges", [
+    [0, 10, 100, 1000, 1e20],
+    resolve_edges(BinSpec(log_buckets=12, log_min=0.001, log_max=1e6)),
+    resolve_edges(BinSpec(edges="0.1,0.3,2.5,inf")),
+])
+def test_bin_index_expr_matches_python(edges):
+    values = [0.0005, 0.001, 0.1, 0.3, 0.2999999999999999, 2.5, 9.99, 10, 1e5, 999999.9, 1e6, 5e7, -1.0]
+    values += list(edges[:-1])
+    got = dict(duckdb.execute(
+        f"SELECT v, {bin_index_expr('v', edges)} FROM (SELECT unnest(?::DOUBLE[]) AS v)", [values]
+    ).fetchall())
+    n = len(edges) - 1
+    for v in values:
+        idx = bisect.bisect_right(edges, v) - 1
+        if not price_bins.is_unbounded(edges[-1]) and v >= edges[-1]:
+            idx = n
+        assert got[v] == min(idx, n), (v, got[v])
+    nan = duckdb.execute(f"SELECT {bin_index_expr('v', edges)} FROM (SELECT CAST(? AS DOUBLE) AS v)", [math.nan])
+    assert nan.fetchone()[0] is None
+
+
+def test_price_bin_out_of_range_is_rejected(client):
+    for path in ("/api/filter_data", "/api/random_sample", "/api/export"):
+        response = client.get(path, params={"price_bin": 6})
+        assert response.status_code == 400, path
+        assert response.json()["error"] == "price_bin 超出区间范围"
+    assert client.get("/api/filter_data", params={"price_bin": 1, "edges": "0,1,10"}).status_code == 200
+
+
+def test_histogram_counts_add_up(client, trades_parquet):
+    body = get(client, "/api/histogram", log_buckets=8, price_unit="SOL")["data"]
+    counted = sum(b["count"] for b in body["bins"]) + body["below"] + body["above"]
+    expected = duckdb.sql(
+        f"SELECT count(*) FROM read_parquet('{trades_parquet}') WHERE buy_price_sol IS NOT NULL AND NOT isnan(buy_price_sol)"
+    ).fetchone()[0]
+    assert counted == expected
@@ -0,0 +1,119 @@
+# backend/tests/test_result_cache.py
+# 結果快取：single-flight 合併、錯誤共用與中斷不共用、跟隨者的等待時限與自身取消。
+
+import threading
+import time
+
+import duckdb
+import pytest
+
+from executor import QueryTask
+from result_cache import ResultCache
+
+
+def start(fn):
+    """在背景線程呼叫 fn，返回 (線程, 結果 dict)；結果為 value 或 error。"""
+    out = {}
+
+    def run():
+        try:
+            out["value"] = fn()
+        except BaseException as e:  # noqa: BLE001 - 在主線程斷言
+            out["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, out
+
+
+def slow(value, seconds=0.3, calls=None):
+    def compute():
+        if calls is not None:
+            calls.append(value)
+        time.sleep(seconds)
+        return value
+    return compute
+
+
+def test_single_flight_computes_once():
+    cache = ResultCache()
+    calls = []
+    runs = [start(lambda: cache.get_or_compute("k", 1, slow("v", calls=calls))) for _ in range(5)]
+    for thread, _ in runs:
+        thread.join()
+    assert [out["value"] for _, out in runs] == ["v"] * 5
+    assert calls == ["v"]
+    stats = cache.stats()
+    assert stats["coalesced"] == 4 and stats["misses"] == 1 and stats["inflight"] == 0
+    assert cache.get("k", 1) == (True, "v")
+
+
+def test_query_error_is_shared():
+    cache = ResultCache()
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    leader, leader_out = start(lambda: cache.get_or_compute("k", 1, fail))
+    time.sleep(0.05)
+    with pytest.raises(ValueError):
+        cache.get_or_compute("k", 1, slow("unused"))
+    leader.join()
+    assert isinstance(leader_out["error"], ValueError)
+    assert cache.get("k", 1) == (False, None)
+
+
+def test_interrupt_is_not_shared():
+    cache = ResultCache()
+
+    def interrupted():
+        time.sleep(0.2)
+        raise duckdb.InterruptException("INTERRUPT Error: Interrupted!")
+
+    leader, leader_out = start(lambda: cache.get_or_compute("k", 1, interrupted))
+    time.sleep(0.05)
+    # 領頭者被中斷後跟隨者自己當領頭者算出結果
+    assert cache.get_or_compute("k", 1, lambda: "mine") == "mine"
+    leader.join()
+    assert isinstance(leader_out["error"], duckdb.InterruptException)
+    assert cache.get("k", 1) == (True, "mine")
+
+
+def test_follower_stops_waiting_after_timeout():
+    cache = ResultCache(wait_timeout=0.2)
+    leader, _ = start(lambda: cache.get_or_compute("k", 1, slow("leader", seconds=1.0)))
+    time.sleep(0.05)
+    began = time.monotonic()
+    assert cache.get_or_compute("k", 1, lambda: "follower") == "follower"
+    assert time.monotonic() - began < 0.6
+    leader.join()
+
+
+def test_cancelled_follower_gives_up(use_dataset, trades_parquet):
+    use_dataset(trades_parquet)  # QueryTask 需要引擎的 cursor
+    cache = ResultCache(wait_timeout=10)
+    leader, _ = start(lambda: cache.get_or_compute("k", 1, slow("leader", seconds=1.5)))
+    time.sleep(0.05)
+    computed = []
+
+    def follower():
+        return cache.get_or_compute("k", 1, lambda: computed.append(1))
+
+    task = QueryTask(follower)
+    thread, out = start(task.run)
+    time.sleep(0.1)
+    began = time.monotonic()
+    task.cancel()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert time.monotonic() - began < 0.5
+    assert isinstance(out["error"], duckdb.InterruptException)
+    assert computed == []
+    leader.join()
+
+
+def test_follower_wait_shorter_than_query_timeout():
+    from config import QUERY_TIMEOUT, RESULT_CACHE_FOLLOWER_WAIT
+
+    assert RESULT_CACHE_FOLLOWER_WAIT < QUERY_TIMEOUT / 2
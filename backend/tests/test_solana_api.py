@@ -0,0 +1,124 @@
+# backend/tests/test_solana_api.py
+# SlotTimeResolver 對本地假 JSON-RPC 服務：批次請求、sqlite 持久化、插值回退。
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from solana_api import SlotTimeResolver, SlotTimeStore, interpolate_slot_time
+
+BASE_TIME = 1_700_000_000
+SKIPPED = -32007  # 被跳過的 slot（永久錯誤，可快取）
+UNAVAILABLE = -32004  # 區塊暫時取不到（不快取）
+
+
+def block_time(slot):
+    return BASE_TIME + int(slot * 0.4)
+
+
+def rpc_reply(request):
+    slot = request["params"][0]
+    if slot % 10 == 7:
+        return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": SKIPPED, "message": "slot skipped"}}
+    if slot % 10 == 9:
+        return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": UNAVAILABLE, "message": "not available"}}
+    return {"jsonrpc": "2.0", "id": request["id"], "result": block_time(slot)}
+
+
+class RpcHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.batches.append([item["params"][0] for item in payload])
+        if self.server.single_only:
+            reply = {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch not supported"}}
+        else:
+            reply = [rpc_reply(item) for item in payload]
+        body = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RpcHandler)
+    httpd.lock = threading.Lock()
+    httpd.batches = []
+    httpd.single_only = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_resolver(server, tmp_path, **kwargs):
+    options = dict(batch_size=3, max_concurrency=2, rate_limit=1000, backoff=0, cache_path=str(tmp_path / "slots.sqlite"))
+    options.update(kwargs)
+    return SlotTimeResolver(endpoint=f"http://127.0.0.1:{server.server_port}/", **options)
+
+
+def test_batches_unique_slots(server, tmp_path):
+    slots = [100, 101, 100, 102, 103, 107, 109, 104, 101]
+    times, sources = make_resolver(server, tmp_path).resolve(slots)
+    # 7 個不同的 slot，每批 3 個
+    assert sorted(len(b) for b in server.batches) == [1, 3, 3]
+    assert sorted(s for b in server.batches for s in b) == [100, 101, 102, 103, 104, 107, 109]
+    assert times[100] == block_time(100) and times[104] == block_time(104)
+    assert times[107] is None and times[109] is None
+    assert sources[100] == "rpc" and sources[107] is None
+    assert set(times) == set(slots)
+
+
+def test_store_persists_results(server, tmp_path):
+    make_resolver(server, tmp_path).resolve([200, 201, 207, 209])
+    store = SlotTimeStore(str(tmp_path / "slots.sqlite"))
+    # 暫時性錯誤不寫入；被跳過的 slot 記為 NULL
+    assert store.get_many([200, 201, 207, 209]) == {200: block_time(200), 201: block_time(201), 207: None}
+
+    server.batches.clear()
+    times, sources = make_resolver(server, tmp_path).resolve([200, 201, 207, 209])
+    assert server.batches == [[209]]
+    assert sources == {200: "cache", 201: "cache", 207: "cache", 209: None}
+    assert times[200] == block_time(200) and times[207] is None
+
+
+def test_interpolates_from_known_neighbors(server, tmp_path):
+    store = SlotTimeStore(str(tmp_path / "slots.sqlite"))
+    store.put_many([(1000, BASE_TIME), (2000, BASE_TIME + 500)])
+    resolver = make_resolver(server, tmp_path, batch_size=100)
+    far = 2000 + 20000  # 超出 SLOT_INTERPOLATE_MAX_GAP，回退到 RPC
+    times, sources = resolver.resolve([1500, 2100, far], interpolate=True)
+    assert times[1500] == BASE_TIME + 250 and sources[1500] == "interpolated"
+    assert times[2100] == BASE_TIME + 500 + 40 and sources[2100] == "interpolated"
+    assert times[far] == block_time(far) and sources[far] == "rpc"
+    assert server.batches == [[far]]
+
+    # 不要求插值時一律走 RPC
+    server.batches.clear()
+    resolver.resolve([1500], interpolate=False)
+    assert server.batches == [[1500]]
+
+
+def test_interpolate_slot_time():
+    lower, upper = (100, 1000), (200, 1040)
+    assert interpolate_slot_time(150, lower, upper) == 1020
+    assert interpolate_slot_time(150, lower, None, slot_seconds=0.5) == 1025
+    assert interpolate_slot_time(150, None, upper, slot_seconds=0.5) == 1015
+    assert interpolate_slot_time(150, lower, upper, max_gap=10) is None
+
+
+def test_node_without_batch_support(server, tmp_path):
+    server.single_only = True
+    times, sources = make_resolver(server, tmp_path).resolve([300, 301])
+    assert times == {300: None, 301: None}
+    assert sources == {300: None, 301: None}
+    assert SlotTimeStore(str(tmp_path / "slots.sqlite")).get_many([300, 301]) == {}
@@ -0,0 +1,177 @@
+# backend/token_index.py
+# token → 資料片段的 sidecar 索引（sqlite），導入時建立：
+# 每個 (token, 檔案, row group) 記錄該 token 在檔案中的起始行號與行數。
+# 查詢帶 token_list 時只讀包含這些 token 的檔案，不必打開資料集裡每個檔案的 footer；
+# 檔案按 token 排序，檔案內再靠 row group 的 min/max 統計跳過其餘片段。
+# 讀取只裁剪到檔案（單檔資料集因此不裁剪），記錄的 row group / 行號只用於 approx_total 估算。
+
+import logging
+import os
+import sqlite3
+import threading
+
+import dataset
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".tokens.sqlite"  # 單檔資料集：<parquet>.tokens.sqlite
+DATASET_INDEX_NAME = "_token_index.sqlite"  # 分區資料集：<dataset>/_token_index.sqlite
+
+# sqlite 單條語句的參數個數有上限，token 較多時分批查
+LOOKUP_CHUNK = 500
+
+
+def index_path(path):
+    if dataset.is_dataset_dir(path):
+        return os.path.join(path, DATASET_INDEX_NAME)
+    return path + INDEX_SUFFIX
+
+
+def base_dir(path):
+    """索引中的檔案路徑相對於此目錄保存，資料集整體搬移後索引仍可用。"""
+    return path if dataset.is_dataset_dir(path) else os.path.dirname(path)
+
+
+def file_signature(file_path):
+    st = os.stat(file_path)
+    return st.st_size, int(st.st_mtime)
+
+
+def dataset_files(path):
+    """資料集目前的全部 parquet 檔（相對 base_dir 的路徑）。"""
+    if not dataset.is_dataset_dir(path):
+        return [os.path.basename(path)]
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(".parquet"):
+                files.append(os.path.relpath(os.path.join(root, name), path).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def sql_list(values):
+    return "[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def fragment_rows(con, files, root):
+    """
+    用 DuckDB 只讀 token 欄位，算出每個 (token, 檔案, row group) 的起始行號與行數。
+    row group 邊界取自 parquet_metadata，行號用 ASOF JOIN 對應到所在 row group。
+    """
+    full = [os.path.join(root, f) for f in files]
+    rel = {os.path.normpath(f): r for f, r in zip(full, files)}
+    rows = con.execute(f"""
+        WITH rg AS (
+            SELECT file_name, row_group_id,
+                   SUM(row_group_num_rows) OVER (PARTITION BY file_name ORDER BY row_group_id) - row_group_num_rows AS rg_start
+            FROM (SELECT DISTINCT file_name, row_group_id, row_group_num_rows FROM parquet_metadata({sql_list(full)}))
+        )
+        SELECT t.token_mint_address, t.filename, rg.row_group_id, MIN(t.file_row_number), COUNT(*)
+        FROM (
+            SELECT token_mint_address, filename, file_row_number
+            FROM read_parquet({sql_list(full)}, filename=true, file_row_number=true)
+            WHERE token_mint_address IS NOT NULL
+        ) t
+        ASOF JOIN rg ON t.filename = rg.file_name AND t.file_row_number >= rg.rg_start
+        GROUP BY ALL
+    """).fetchall()
+    return [(token, rel[os.path.normpath(f)], int(g), int(start), int(n)) for token, f, g, start, n in rows]
+
+
+class TokenIndex:
+    """token_fragment(token, file, row_group, row_start, row_count) + 已索引檔案的大小/修改時間。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_fragment ("
+            "token TEXT NOT NULL, file TEXT NOT NULL, row_group INTEGER NOT NULL, "
+            "row_start INTEGER NOT NULL, row_count INTEGER NOT NULL, "
+            "PRIMARY KEY (token, file, row_group)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS indexed_file (file TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def add_files(self, con, files, root):
+        """為 files（相對 root）建立索引，已索引過的同名檔案先清掉再重建。"""
+        if not files:
+            return 0
+        rows = fragment_rows(con, files, root)
+        with self.lock:
+            self.conn.executemany("DELETE FROM token_fragment WHERE file = ?", [(f,) for f in files])
+            self.conn.executemany("INSERT INTO token_fragment VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO indexed_file VALUES (?, ?, ?)",
+                [(f, *file_signature(os.path.join(root, f))) for f in files],
+            )
+            self.conn.commit()
+        return len(rows)
+
+    def covers(self, path):
+        """索引是否與資料集現狀一致：檔案集合相同且大小/修改時間未變。"""
+        root = base_dir(path)
+        with self.lock:
+            indexed = {f: (size, mtime) for f, size, mtime in self.conn.execute("SELECT file, size, mtime FROM indexed_file")}
+        files = dataset_files(path)
+        if set(files) != set(indexed):
+            return False
+        try:
+            return all(file_signature(os.path.join(root, f)) == indexed[f] for f in files)
+        except OSError:
+            return False
+
+    def fragments(self, tokens):
+        """返回 [(file, row_group, row_start, row_count)]，file 為相對路徑。"""
+        tokens = list(dict.fromkeys(tokens))
+        result = []
+        with self.lock:
+            for i in range(0, len(tokens), LOOKUP_CHUNK):
+                chunk = tokens[i:i + LOOKUP_CHUNK]
+                result += self.conn.execute(
+                    f"SELECT file, row_group, row_start, row_count FROM token_fragment "
+                    f"WHERE token IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        return result
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def build_index(con, path, files=None):
+    """
+    為資料集建立/追加索引：files 為 None 時重建整個索引，否則只追加這些檔案（相對路徑）。
+    單檔資料集先寫臨時檔再替換，服務端不會讀到半成品。
+    """
+    target = index_path(path)
+    rebuild = files is None
+    write_path = target + ".tmp" if rebuild else target
+    if rebuild and os.path.exists(write_path):
+        os.remove(write_path)
+    index = TokenIndex(write_path)
+    try:
+        n = index.add_files(con, dataset_files(path) if rebuild else files, base_dir(path))
+    finally:
+        index.close()
+    if rebuild:
+        os.replace(write_path, target)
+    logger.info(f"[token_index] {target}: {n} fragments")
+    return n
+
+
+def open_index(path):
+    """打開資料集的索引；不存在或與資料集不一致（過期）時返回 None。"""
+    target = index_path(path)
+    if not os.path.exists(target):
+        return None
+    index = TokenIndex(target)
+    if not index.covers(path):
+        logger.warning(f"[token_index] {target} is stale, token lookups fall back to full scan")
+        index.close()
+        return None
+    return index
@@ -27,7 +27,7 @@ export const fetchPriceRanges = async (priceType = "buy_price") => {
   return res.data.data;
 };
 
-export const fetchFilterData = async ({ priceType, priceUnit, solPrice, token, priceBin, page, pageSize, buyPriceFilter, abnormal_only }) => {
+export const fetchFilterData = async ({ priceType, priceUnit, solPrice, token, priceBin, page, pageSize, buyPriceFilter, abnormal_only, cursor }) => {
   const params = {
     price_type: priceType,
     price_unit: priceUnit,
@@ -39,6 +39,8 @@ export const fetchFilterData = async ({ priceType, priceUnit, solPrice, token, p
   if (priceBin !== undefined && priceBin !== null) params.price_bin = priceBin;
   if (buyPriceFilter) params.buy_price_filter = buyPriceFilter;
   if (abnormal_only) params.abnormal_only = abnormal_only;
+  // 传入上次返回的 next_cursor 时按 keyset 翻页
+  if (cursor) params.cursor = cursor;
   const res = await axios.get(`${API_BASE}/filter_data`, { params });
   return res.data;
 };
@@ -46,7 +48,7 @@ export const fetchFilterData = async ({ priceType, priceUnit, solPrice, token, p
 // 新增支持多模式批量bins分页数据加载
 export const fetchBatchBinsData = async (paramsObj) => {
   console.debug('[DEBUG] fetchBatchBinsData called with:', JSON.stringify(paramsObj, null, 2));
-  const { priceType, priceUnit, solPrice, bins, page, pageSize, pageStart, pageEnd, mode } = paramsObj;
+  const { priceType, priceUnit, solPrice, bins, page, pageSize, pageStart, pageEnd, mode, cursor } = paramsObj;
   
   // 检查参数详细信息
   console.debug('[DEBUG] Parameter details:', {
@@ -89,6 +91,7 @@ export const fetchBatchBinsData = async (paramsObj) => {
     bins: bins.join(','),
     page_size: pageSize
   };
+  if (cursor) params.cursor = cursor;
   
   // 检测请求模式并设置参数
   let requestMode = '';